@@ -3,10 +3,9 @@ from datetime import datetime
 import os
 from dotenv import load_dotenv
 import atexit
-import hashlib
 
 from database import Database
-from scraper import MoodleScraper
+from scraper import MoodleScraper, LMS_BASE_URLS
 from notifier import Notifier
 from calendar_scraper import CalendarScraper
 from scheduler import TaskScheduler
@@ -17,14 +16,18 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'change-this-secret-key')
 
 db = Database()
-calendar_scraper = CalendarScraper()
+calendar_scraper = CalendarScraper(db=db)
 
 # Initialize and start the scheduler
 scheduler = TaskScheduler()
-scheduler.start()
 
-# Ensure scheduler stops when app shuts down
-atexit.register(lambda: scheduler.stop())
+# Scans parse pages in worker processes; on platforms that spawn them, this module
+# is re-imported there as __mp_main__ and must not start a second scheduler
+if __name__ != '__mp_main__':
+    scheduler.start()
+    
+    # Ensure scheduler stops when app shuts down
+    atexit.register(lambda: scheduler.stop())
 
 @app.route('/')
 def index():
@@ -32,6 +35,7 @@ def index():
     stats = db.get_stats()
     recent_activities = db.get_recent_activities(limit=20)
     scan_history = db.get_scan_history(limit=10)
+    removed_activities = db.get_removed_activities(limit=10)
     
     # Get activities separated by LMS
     ousl_activities = db.get_activities_by_lms('OUSL', limit=15)
@@ -39,23 +43,9 @@ def index():
     
     # Get upcoming deadlines (combined from activities, calendar, and scraped)
     # Fetch all upcoming deadlines (no time limit) and filter on frontend
+    # Calendar deadlines are linked to their course when synced, so course_name is already set
     upcoming_deadlines = db.get_all_upcoming_deadlines(days_ahead=365)
     
-    # Try to match calendar/scraped events with courses by course code in title
-    import re
-    for deadline in upcoming_deadlines:
-        if deadline['source'] in ['calendar', 'scraped'] and not deadline.get('course_name'):
-            # Try to extract course code from title (e.g., "EEI4362", "AGM4367")
-            course_code_match = re.search(r'\b([A-Z]{2,4}\d{4})\b', deadline['title'])
-            if course_code_match:
-                course_code = course_code_match.group(1)
-                # Try to find matching course
-                courses = db.get_all_courses()
-                for course in courses:
-                    if course_code in course['course_name']:
-                        deadline['course_name'] = course['course_name']
-                        break
-    
     # Check if running on Render or Railway (to disable scan button)
     is_render = os.getenv('RENDER') is not None or os.getenv('RAILWAY_ENVIRONMENT') is not None
     
@@ -66,6 +56,7 @@ def index():
                           rusl_activities=rusl_activities,
                           upcoming_deadlines=upcoming_deadlines,
                           scan_history=scan_history,
+                          removed_activities=removed_activities,
                           is_render=is_render)
 
 @app.route('/courses')
@@ -95,9 +86,8 @@ def activities():
     
     return render_template('activities.html', activities=activities_list)
 
-@app.route('/api/scan', methods=['POST'])
-def trigger_scan():
-    """Trigger a manual scan."""
+def _scanning_disabled_response():
+    """Return a 403 response if manual scanning is unavailable on this platform."""
     # Disable manual scanning on Render/Railway (Chrome not available)
     if os.getenv('RENDER') or os.getenv('RAILWAY_ENVIRONMENT'):
         platform = 'Render' if os.getenv('RENDER') else 'Railway'
@@ -105,14 +95,83 @@ def trigger_scan():
             'success': False,
             'message': f'Manual scanning is disabled on {platform}. GitHub Actions handles automated scanning twice daily.'
         }), 403
+    return None
+
+@app.route('/api/scan', methods=['POST'])
+def trigger_scan():
+    """
+    Trigger a manual scan. An optional JSON body of
+    {"course_ids": [...]} and/or {"lms": "OUSL"} limits the scan to those courses.
+    """
+    disabled = _scanning_disabled_response()
+    if disabled:
+        return disabled
+    
+    payload = request.get_json(silent=True) or {}
+    if not isinstance(payload, dict):
+        return jsonify({
+            'success': False,
+            'message': 'Request body must be a JSON object'
+        }), 400
+    
+    course_ids = payload.get('course_ids')
+    lms_name = payload.get('lms')
+    
+    if course_ids is not None and (not isinstance(course_ids, list) or not course_ids or
+                                   not all(isinstance(c, str) and c for c in course_ids)):
+        return jsonify({
+            'success': False,
+            'message': 'course_ids must be a non-empty list of course ID strings'
+        }), 400
+    
+    if lms_name is not None and (not isinstance(lms_name, str) or lms_name not in LMS_BASE_URLS):
+        return jsonify({
+            'success': False,
+            'message': f'Unknown LMS: {lms_name} (expected one of {", ".join(LMS_BASE_URLS)})'
+        }), 400
+    
+    try:
+        scraper = MoodleScraper(headless=True)
+        
+        if course_ids or lms_name:
+            results = scraper.run_targeted_scan(course_ids=course_ids, lms_name=lms_name)
+            message = (f'Scanned {results["courses_scanned"]} course(s). '
+                       f'Found {results["total_new_activities"]} new activities.')
+        else:
+            results = scraper.run_full_scan()
+            message = f'Scan completed. Found {results["total_new_activities"]} new activities.'
+        
+        return jsonify({
+            'success': True,
+            'message': message,
+            'results': results
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Scan failed: {str(e)}'
+        }), 500
+
+@app.route('/api/scan/course/<course_id>', methods=['POST'])
+def trigger_course_scan(course_id):
+    """Scan a single course right now."""
+    disabled = _scanning_disabled_response()
+    if disabled:
+        return disabled
+    
+    if not db.get_courses_by_ids([course_id]):
+        return jsonify({
+            'success': False,
+            'message': f'Unknown course: {course_id}'
+        }), 404
     
     try:
         scraper = MoodleScraper(headless=True)
-        results = scraper.run_full_scan()
+        results = scraper.run_targeted_scan(course_ids=[course_id])
         
         return jsonify({
             'success': True,
-            'message': f'Scan completed. Found {results["total_new_activities"]} new activities.',
+            'message': f'Course scanned. Found {results["total_new_activities"]} new activities.',
             'results': results
         })
     except Exception as e:
@@ -183,42 +242,19 @@ def api_new_activities():
 def sync_calendar():
     """Sync calendar events from both LMS."""
     try:
-        # Delete existing calendar events before syncing to prevent duplicates
-        db.delete_calendar_events()
-        
-        events = calendar_scraper.get_all_calendar_events()
-        
-        # Store calendar events in deadlines table
-        count = 0
-        within_60_days = 0
-        from datetime import timezone, timedelta
-        now = datetime.now(timezone.utc)
-        sixty_days_later = now + timedelta(days=60)
+        summary = calendar_scraper.sync_to_database()
         
-        for event in events:
-            # Generate deterministic deadline ID using MD5 hash
-            content = f"{event['lms']}_{event['date'].isoformat()}_{event['title']}"
-            hash_obj = hashlib.md5(content.encode('utf-8'))
-            deadline_id = f"cal_{hash_obj.hexdigest()[:16]}"
-            
-            db.add_deadline(
-                deadline_id=deadline_id,
-                title=event['title'],
-                description=event.get('description', ''),
-                deadline_date=event['date'].isoformat(),
-                lms_name=event['lms'],
-                source='calendar',
-                location=event.get('location', '')
-            )
-            count += 1
-            
-            # Count events within 60 days
-            if event['date'] <= sixty_days_later:
-                within_60_days += 1
+        message = (f"Synced {summary['count']} calendar events successfully! "
+                   f"({summary['within_60_days']} within next 60 days; {summary['added']} added, "
+                   f"{summary['updated']} updated, {summary['removed']} removed)")
+        if summary['unchanged_feeds']:
+            message += f" {', '.join(summary['unchanged_feeds'])} unchanged since the last sync."
+        if summary['failed_feeds']:
+            message += f" Could not fetch {', '.join(summary['failed_feeds'])}."
         
         return jsonify({
             'success': True,
-            'message': f'Synced {count} calendar events successfully! ({within_60_days} within next 60 days)'
+            'message': message
         })
     except Exception as e:
         return jsonify({
@@ -1,148 +1,382 @@
 import requests
-from icalendar import Calendar
+from requests.adapters import HTTPAdapter
+from icalendar.prop import vText
 from datetime import datetime, timezone, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import re
-from typing import List, Dict
+import tempfile
+from typing import List, Dict, Any, Iterable, Iterator
+
+import date_extractor
+from ical_recurrence import split_content_line, ical_datetime, ical_start, next_occurrence
+
+# The only VEVENT properties the monitor uses; everything else in a feed is skipped unparsed
+VEVENT_PROPERTIES = {'UID', 'SUMMARY', 'DESCRIPTION', 'LOCATION', 'DTSTART',
+                     'SEQUENCE', 'LAST-MODIFIED', 'RECURRENCE-ID'}
+
+# Recurrence properties are kept as raw lines and only expanded at query time (see ical_recurrence.expand_recurrence)
+RECURRENCE_PROPERTIES = {'RRULE', 'RDATE', 'EXDATE'}
+
+# Lines that make a past event worth reading after all: it recurs, or it overrides one instance
+_RECURRING_LINE = re.compile(rb'(?:RRULE|RDATE|RECURRENCE-ID)[;:]', re.IGNORECASE)
+
+# Feed bodies up to this size are hashed and kept in memory; larger ones spill to a temp file
+FEED_SPOOL_BYTES = 4 * 1024 * 1024
+
+
+def split_ical_lines(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Split a stream of byte chunks into physical iCalendar lines (CRLF or LF)."""
+    buffer = b''
+    for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            yield line.rstrip(b'\r')
+    if buffer:
+        yield buffer.rstrip(b'\r')
+
+
+def unfold_ical_lines(lines: Iterable[bytes]) -> Iterator[bytes]:
+    """Join folded continuation lines (leading space or tab). Works on bytes, so
+    a fold in the middle of a multi-byte UTF-8 character is harmless."""
+    current = None
+    for line in lines:
+        if current is not None and line[:1] in (b' ', b'\t'):
+            current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line
+    if current is not None:
+        yield current
+
+
+def _ical_text(props: Dict[str, Any], name: str, default: str = '') -> str:
+    """Unescape a TEXT property read by iter_upcoming_vevents."""
+    return str(vText.from_ical(props[name][1])) if name in props else default
+
+
+def _read_property(props: Dict[str, Any], line: bytes) -> str:
+    """Store one wanted content line of a VEVENT in props and return its name."""
+    name = re.match(rb'[^;:]*', line).group().upper().decode('ascii', errors='replace')
+    if name in RECURRENCE_PROPERTIES:
+        props.setdefault('recurrence', []).append(line.decode('utf-8', errors='replace'))
+    elif name in VEVENT_PROPERTIES:
+        props[name] = split_content_line(line)[1:]
+    return name
+
+
+def iter_upcoming_vevents(lines: Iterable[bytes], after: datetime) -> Iterator[Dict[str, Any]]:
+    """
+    Read VEVENTs from unfolded content lines and yield the raw properties
+    (name -> (params, value)) of those starting after the given time, with
+    'start' holding the parsed DTSTART and 'recurrence' the RRULE / RDATE /
+    EXDATE lines, if any.
+    Once an event's DTSTART turns out to be past, its remaining lines are only
+    collected, not decoded. They are read after all if the event recurs (it is
+    yielded when it still has an occurrence after the time) or overrides one
+    instance of a recurring event (yielded with 'past' set, so the caller can
+    take that instance out of the series).
+    """
+    in_event = False
+    past_lines = None
+    nested = 0
+    props = {}
+    
+    for line in lines:
+        if line == b'BEGIN:VEVENT' and not in_event:
+            in_event, past_lines, nested, props = True, None, 0, {}
+            continue
+        if not in_event:
+            continue
+        
+        if line == b'END:VEVENT' and nested == 0:
+            in_event = False
+            if past_lines is None:
+                if 'start' in props:
+                    yield props
+                continue
+            
+            if 'recurrence' not in props and 'RECURRENCE-ID' not in props and \
+                    not any(_RECURRING_LINE.match(past_line) for past_line in past_lines):
+                continue
+            for past_line in past_lines:
+                _read_property(props, past_line)
+            
+            if 'recurrence' in props and next_occurrence(props['start'], '\n'.join(props['recurrence']), after):
+                yield props
+            elif 'RECURRENCE-ID' in props:
+                props['past'] = True
+                yield props
+            continue
+        
+        # Sub-components (VALARM) carry their own DESCRIPTION etc., which are not the event's
+        if line.startswith(b'BEGIN:'):
+            nested += 1
+            continue
+        if line.startswith(b'END:'):
+            nested -= 1
+            continue
+        if nested:
+            continue
+        
+        if past_lines is not None:
+            past_lines.append(line)
+            continue
+        
+        if _read_property(props, line) == 'DTSTART':
+            props['start'] = ical_start(*props['DTSTART'])
+            if props['start'] <= after:
+                past_lines = []
+
 
 class CalendarScraper:
-    def __init__(self):
+    def __init__(self, db=None):
         self.ousl_calendar_url = "https://oulms.ou.ac.lk/calendar/export_execute.php?userid=19900&authtoken=9e92461354ae8674632a70fdaaadde2280af8dfb&preset_what=all&preset_time=custom"
         self.rusl_calendar_url = "https://lms.aps.rjt.ac.lk/calendar/export_execute.php?userid=17234&authtoken=55a6286965183ea25486870ac8006fab00c9c038&preset_what=all&preset_time=custom"
+        
+        # Optional Database, used to remember each feed's validators between syncs
+        self.db = db
+        
+        # One pooled session, so repeated syncs reuse the connections to each LMS
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=2, pool_maxsize=2))
+    
+    @property
+    def feeds(self) -> Dict[str, str]:
+        """Calendar export URL of each LMS."""
+        return {'OUSL': self.ousl_calendar_url, 'RUSL': self.rusl_calendar_url}
     
     def fetch_calendar_events(self, url: str, lms_name: str) -> List[Dict]:
         """Fetch and parse iCal calendar events."""
         try:
-            response = requests.get(url, timeout=30)
-            response.raise_for_status()
-            
-            cal = Calendar.from_ical(response.content)
-            events = []
-            
-            now = datetime.now(timezone.utc)
-            
-            for component in cal.walk():
-                if component.name == "VEVENT":
-                    summary = str(component.get('summary', 'Untitled Event'))
-                    dtstart = component.get('dtstart')
-                    description = str(component.get('description', ''))
-                    location = str(component.get('location', ''))
-                    
-                    if dtstart:
-                        # Convert to datetime if it's a date
-                        if hasattr(dtstart.dt, 'date'):
-                            event_date = dtstart.dt
-                        else:
-                            event_date = datetime.combine(dtstart.dt, datetime.min.time())
-                            event_date = event_date.replace(tzinfo=timezone.utc)
-                        
-                        # Only include future events
-                        if event_date > now:
-                            events.append({
-                                'title': summary,
-                                'date': event_date,
-                                'description': description,
-                                'location': location,
-                                'lms': lms_name,
-                                'source': 'calendar'
-                            })
-            
-            # Sort by date
-            events.sort(key=lambda x: x['date'])
-            return events
+            with self.session.get(url, timeout=30, stream=True) as response:
+                response.raise_for_status()
+                return self.parse_calendar_stream(response.iter_content(chunk_size=65536), lms_name)
             
         except Exception as e:
             print(f"Error fetching calendar from {lms_name}: {e}")
             return []
     
+    def parse_calendar(self, content: bytes, lms_name: str) -> List[Dict]:
+        """Parse the future events out of an iCal feed body."""
+        return self.parse_calendar_stream([content], lms_name)
+    
+    def parse_calendar_stream(self, chunks: Iterable[bytes], lms_name: str) -> List[Dict]:
+        """
+        Parse the future events out of an iCal feed as it downloads. Past events
+        are dropped line by line, so memory and time follow the number of
+        upcoming events rather than the whole feed history.
+        """
+        return self._parse_lines(unfold_ical_lines(split_ical_lines(chunks)), lms_name)
+    
+    def _parse_lines(self, lines: Iterable[bytes], lms_name: str) -> List[Dict]:
+        """Build event dicts for the upcoming VEVENTs in unfolded content lines."""
+        now = datetime.now(timezone.utc)
+        events = []
+        overridden = {}
+        
+        for props in iter_upcoming_vevents(lines, now):
+            last_modified = props.get('LAST-MODIFIED')
+            recurrence_id = props.get('RECURRENCE-ID')
+            
+            if recurrence_id:
+                # A moved or edited instance replaces that slot of its series
+                slot = ical_start(*recurrence_id).astimezone(timezone.utc)
+                overridden.setdefault(_ical_text(props, 'UID'), []).append(f"EXDATE:{slot:%Y%m%dT%H%M%SZ}")
+            if props.get('past'):
+                continue
+            
+            events.append({
+                'title': _ical_text(props, 'SUMMARY', 'Untitled Event'),
+                'date': props['start'],
+                'description': _ical_text(props, 'DESCRIPTION'),
+                'location': _ical_text(props, 'LOCATION'),
+                'lms': lms_name,
+                'source': 'calendar',
+                'uid': _ical_text(props, 'UID'),
+                'recurrence_id': ical_datetime(*recurrence_id).isoformat() if recurrence_id else None,
+                'sequence': int(props['SEQUENCE'][1]) if 'SEQUENCE' in props else 0,
+                'last_modified': ical_datetime(*last_modified).isoformat() if last_modified else None,
+                'recurrence': props.get('recurrence')
+            })
+        
+        # Recurring events keep their rules as text, expanded when deadlines are queried
+        for event in events:
+            if event['recurrence']:
+                if not event['recurrence_id']:
+                    event['recurrence'] += overridden.get(event['uid'], [])
+                event['recurrence'] = '\n'.join(event['recurrence'])
+        
+        # Sort by date
+        events.sort(key=lambda x: x['date'])
+        return events
+    
     def get_all_calendar_events(self) -> List[Dict]:
-        """Get calendar events from both OUSL and RUSL."""
-        ousl_events = self.fetch_calendar_events(self.ousl_calendar_url, 'OUSL')
-        rusl_events = self.fetch_calendar_events(self.rusl_calendar_url, 'RUSL')
+        """Get calendar events from both OUSL and RUSL (feeds are fetched concurrently)."""
+        with ThreadPoolExecutor(max_workers=len(self.feeds)) as pool:
+            fetches = [pool.submit(self.fetch_calendar_events, url, lms_name)
+                       for lms_name, url in self.feeds.items()]
+            all_events = [event for fetch in fetches for event in fetch.result()]
         
-        all_events = ousl_events + rusl_events
         all_events.sort(key=lambda x: x['date'])
         
         return all_events
     
-    def extract_dates_from_text(self, text: str) -> List[datetime]:
-        """Extract dates from activity descriptions.
-        Returns a list of dates found, with the latest date first (usually the deadline).
+    def get_calendar_updates(self) -> List[Dict[str, Any]]:
+        """
+        Fetch every feed concurrently, skipping the ones that haven't changed since
+        the last sync. Returns one update per LMS: {'lms_name', 'changed', 'events',
+        'state'}; 'events' is only set for changed feeds. Once a changed feed's
+        events are stored, pass its update to mark_feed_synced().
+        """
+        with ThreadPoolExecutor(max_workers=len(self.feeds)) as pool:
+            fetches = {lms_name: pool.submit(self.fetch_feed_update, lms_name, url)
+                       for lms_name, url in self.feeds.items()}
+        
+        updates = []
+        for lms_name, fetch in fetches.items():
+            try:
+                updates.append(fetch.result())
+            except Exception as e:
+                # Leave this LMS's stored events alone rather than syncing an empty list
+                print(f"Error fetching calendar from {lms_name}: {e}")
+                updates.append({'lms_name': lms_name, 'changed': False, 'error': str(e)})
+        
+        return updates
+    
+    def fetch_feed_update(self, lms_name: str, url: str) -> Dict[str, Any]:
         """
-        dates = []
-        seen_dates = set()  # Track unique dates
-        
-        if not text:
-            return dates
-        
-        # Pattern 1-3: With keywords like "by", "due", "deadline", etc. (higher priority)
-        priority_patterns = [
-            r'(?:by|before|due on|due|deadline|submit by)\s*:?\s*(?:monday|tuesday|wednesday|thursday|friday|saturday|sunday)?,?\s*(\d{1,2})[/-](\d{1,2})[/-](\d{4})',  # DD-MM-YYYY or DD/MM/YYYY
-            r'(?:by|before|due on|due|deadline|submit by)\s*:?\s*(?:monday|tuesday|wednesday|thursday|friday|saturday|sunday)?,?\s*(\d{4})[/-](\d{1,2})[/-](\d{1,2})',  # YYYY-MM-DD
-            r'(?:by|before|due on|due|deadline|submit by)\s*:?\s*(?:monday|tuesday|wednesday|thursday|friday|saturday|sunday)?,?\s*(\d{1,2})(?:st|nd|rd|th)?\s+([A-Za-z]+)\s+(\d{4})',  # 15th October 2025 or Due:Sunday, 19 October 2025
-            r'(?:deadline|due date)\s*:\s*(\d{4})[/-](\d{1,2})[/-](\d{1,2})',  # "deadline: YYYY-MM-DD"
-        ]
-        
-        # First, try priority patterns (with keywords)
-        for pattern in priority_patterns:
-            matches = re.finditer(pattern, text, re.IGNORECASE)
-            for match in matches:
-                try:
-                    groups = match.groups()
-                    date = self._parse_date_groups(groups)
-                    if date and date not in seen_dates:
-                        dates.append(date)
-                        seen_dates.add(date)
-                except (ValueError, IndexError):
-                    continue
-        
-        # If no priority patterns matched, try standalone dates
-        if not dates:
-            standalone_patterns = [
-                r'\b(\d{4})[/-](\d{1,2})[/-](\d{1,2})\b',  # YYYY-MM-DD or YYYY/MM/DD
-            ]
+        Conditionally fetch one feed. Sends the stored ETag / Last-Modified, and
+        falls back to comparing a hash of the body (Moodle's export usually sends
+        neither), so an unchanged feed is neither parsed nor synced.
+        """
+        previous = self.db.get_calendar_feed_state(lms_name) if self.db else None
+        if previous and previous['url'] != url:
+            previous = None  # new export token: start over
+        
+        headers = {}
+        if previous and previous['etag']:
+            headers['If-None-Match'] = previous['etag']
+        if previous and previous['last_modified']:
+            headers['If-Modified-Since'] = previous['last_modified']
+        
+        # The body is hashed as it downloads and parsed only if the hash changed; it is
+        # spooled meanwhile, so a large feed goes to a temp file instead of memory
+        with tempfile.SpooledTemporaryFile(max_size=FEED_SPOOL_BYTES) as body:
+            with self.session.get(url, headers=headers, timeout=30, stream=True) as response:
+                if response.status_code == 304:
+                    return {'lms_name': lms_name, 'changed': False}
+                response.raise_for_status()
+                content_hash = self._feed_hash(self._spooled(response.iter_content(chunk_size=65536), body))
             
-            for pattern in standalone_patterns:
-                matches = re.finditer(pattern, text, re.IGNORECASE)
-                for match in matches:
-                    try:
-                        groups = match.groups()
-                        date = self._parse_date_groups(groups)
-                        if date and date not in seen_dates:
-                            dates.append(date)
-                            seen_dates.add(date)
-                    except (ValueError, IndexError):
-                        continue
-        
-        # Sort by date (latest first - usually the deadline)
-        dates.sort(reverse=True)
-        
-        return dates
-    
-    def _parse_date_groups(self, groups) -> datetime:
-        """Parse date from regex groups."""
-        if len(groups) != 3:
-            return None
-        
-        if groups[0].isdigit() and groups[1].isdigit() and groups[2].isdigit():
-            # Determine format based on first group length
-            if len(groups[0]) == 4:  # YYYY-MM-DD
-                return datetime(int(groups[0]), int(groups[1]), int(groups[2]), tzinfo=timezone.utc)
-            elif len(groups[2]) == 4:  # DD-MM-YYYY
-                return datetime(int(groups[2]), int(groups[1]), int(groups[0]), tzinfo=timezone.utc)
-        elif groups[1].isalpha():  # 15th October 2025
-            # Parse month name
-            months = {
-                'january': 1, 'february': 2, 'march': 3, 'april': 4,
-                'may': 5, 'june': 6, 'july': 7, 'august': 8,
-                'september': 9, 'october': 10, 'november': 11, 'december': 12,
-                'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
-                'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12
+            state = {
+                'url': url,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'content_hash': content_hash
             }
-            month = months.get(groups[1].lower())
-            if month:
-                return datetime(int(groups[2]), month, int(groups[0]), tzinfo=timezone.utc)
+            
+            if previous and previous['content_hash'] == state['content_hash']:
+                # Same events as last time; just keep any new validators
+                self.db.save_calendar_feed_state(lms_name, **state)
+                return {'lms_name': lms_name, 'changed': False}
+            
+            body.seek(0)
+            events = self.parse_calendar_stream(iter(lambda: body.read(65536), b''), lms_name)
         
-        return None
+        return {
+            'lms_name': lms_name,
+            'changed': True,
+            'events': events,
+            'state': state
+        }
+    
+    def sync_to_database(self) -> Dict[str, Any]:
+        """
+        Sync the calendar deadlines of every changed feed. Each LMS is diffed by
+        event UID and applied in one transaction (see Database.sync_calendar_events).
+        Used by both the scheduled job and /api/sync-calendar.
+        Returns totals plus the LMSs whose feed was unchanged or failed to download.
+        """
+        summary = {'count': 0, 'within_60_days': 0, 'added': 0, 'updated': 0, 'removed': 0,
+                   'unchanged_feeds': [], 'failed_feeds': []}
+        sixty_days_later = datetime.now(timezone.utc) + timedelta(days=60)
+        
+        for update in self.get_calendar_updates():
+            if not update['changed']:
+                key = 'failed_feeds' if update.get('error') else 'unchanged_feeds'
+                summary[key].append(update['lms_name'])
+                continue
+            
+            rows = [{
+                'deadline_id': self.event_deadline_id(event),
+                'version': self._event_version(event),
+                'title': event['title'],
+                'description': event.get('description', ''),
+                'deadline_date': event['date'].isoformat(),
+                'location': event.get('location', ''),
+                'recurrence': event.get('recurrence')
+            } for event in update['events']]
+            
+            result = self.db.sync_calendar_events(update['lms_name'], rows)
+            self.mark_feed_synced(update)
+            
+            summary['count'] += len(rows)
+            summary['within_60_days'] += sum(1 for event in update['events'] if event['date'] <= sixty_days_later)
+            for key in ('added', 'updated', 'removed'):
+                summary[key] += result[key]
+        
+        return summary
+    
+    def event_deadline_id(self, event: Dict) -> str:
+        """Deadline ID of a calendar event: stable per iCal UID, so edits update the same row."""
+        if event.get('uid'):
+            # Overridden instances of a recurring event share its UID and add a RECURRENCE-ID
+            content = f"{event['lms']}_{event['uid']}_{event.get('recurrence_id') or ''}"
+        else:
+            content = f"{event['lms']}_{event['date'].isoformat()}_{event['title']}"
+        return f"cal_{hashlib.md5(content.encode('utf-8')).hexdigest()[:16]}"
+    
+    def _event_version(self, event: Dict) -> str:
+        """SEQUENCE + LAST-MODIFIED when the feed has them, else a hash of the stored fields."""
+        recurrence = event.get('recurrence') or ''
+        if event.get('last_modified') or event.get('sequence'):
+            version = f"{event.get('sequence', 0)}:{event.get('last_modified') or ''}"
+            # Overrides added to a series change its EXDATEs without bumping its SEQUENCE
+            if recurrence:
+                version += ':' + hashlib.md5(recurrence.encode('utf-8')).hexdigest()[:8]
+            return version
+        fields = '\x1f'.join([event['title'], event['date'].isoformat(),
+                              event.get('description', ''), event.get('location', '')] +
+                             ([recurrence] if recurrence else []))
+        return hashlib.md5(fields.encode('utf-8')).hexdigest()
+    
+    def mark_feed_synced(self, update: Dict[str, Any]):
+        """Remember a changed feed's validators once its events are stored, so a failed sync is retried."""
+        if self.db and update.get('state'):
+            self.db.save_calendar_feed_state(update['lms_name'], **update['state'])
+    
+    def _spooled(self, chunks: Iterable[bytes], body) -> Iterator[bytes]:
+        """Pass chunks through, writing each to the body file as it goes."""
+        for chunk in chunks:
+            body.write(chunk)
+            yield chunk
+    
+    def _feed_hash(self, chunks: Iterable[bytes]) -> str:
+        """Hash a feed body, ignoring the DTSTAMP lines Moodle regenerates on every export."""
+        hasher = hashlib.sha256()
+        for line in split_ical_lines(chunks):
+            if not re.match(rb'DTSTAMP[:;]', line):
+                hasher.update(line + b'\n')
+        return hasher.hexdigest()
+    
+    def extract_dates_from_text(self, text: str) -> List[datetime]:
+        """Extract dates from activity descriptions.
+        Returns a list of dates found, with the latest date first (usually the deadline).
+        """
+        return date_extractor.extract_dates(text)
 
 if __name__ == "__main__":
     scraper = CalendarScraper()
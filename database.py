@@ -1,25 +1,204 @@
 import sqlite3
 import json
-from datetime import datetime
-from typing import List, Dict, Any, Optional
+from datetime import datetime, timezone, timedelta
+from typing import List, Dict, Any, Optional, Tuple
 import os
+import re
+import time
+import atexit
+import threading
+import weakref
+
+from ical_recurrence import expand_recurrence
+from moodle_parser import stable_activity_id
+
+# Applied to every connection. WAL lets the dashboard read while a scan writes; with it,
+# synchronous=NORMAL only risks the last commits on power loss, never corruption
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",      # 16 MB page cache
+    "PRAGMA mmap_size = 268435456",    # read through a 256 MB memory map
+    "PRAGMA temp_store = MEMORY",
+)
+
+# Seconds a connection waits for another writer's lock before raising "database is locked"
+BUSY_TIMEOUT = 30
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    A thread's persistent connection, as returned by Database.get_connection().
+    close() only ends a transaction left open (rolling it back, as closing would),
+    so the connection and its prepared-statement cache are reused by the next call.
+    The connection really closes when its thread ends or the process exits.
+    """
+    
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+
+
+# Per-thread connections by database path, every open one (to close at exit), and
+# the paths whose schema this process has already set up
+_thread_connections = threading.local()
+_open_connections = weakref.WeakSet()
+_initialized_paths = set()
+_pool_lock = threading.Lock()
+_init_lock = threading.Lock()
+
+
+@atexit.register
+def _close_connections():
+    """Close every pooled connection, so SQLite folds the WAL back into the database file."""
+    with _pool_lock:
+        connections = list(_open_connections)
+    for connection in connections:
+        try:
+            sqlite3.Connection.close(connection)
+        except sqlite3.Error:
+            pass
+
+
+# Course codes as they appear in course names and calendar event titles (e.g. "EEI4362", "AGM4367")
+COURSE_CODE_PATTERN = re.compile(r'\b([A-Z]{2,4}\d{4})\b')
+
+# Title words that don't tell deadlines apart ("TMA 1 is due" is the same deadline as "TMA 1")
+DEADLINE_STOPWORDS = {'is', 'are', 'due', 'the', 'a', 'an', 'of', 'for', 'to', 'on', 'by', 'at',
+                      'deadline', 'submission', 'closes', 'close', 'ends'}
+
+# Titles announcing an opening are never the same deadline as ones that don't
+OPENING_WORDS = {'opens', 'open', 'starts', 'start', 'begins'}
+
+# Which copy of a de-duplicated deadline is shown: the activity itself has the exact
+# due date and a link, a calendar event at least the exact time
+DEADLINE_SOURCE_PRIORITY = {'activity': 0, 'calendar': 1, 'scraped': 2}
+
+# Deadlines more than this many days past keep the cluster they had and are not compared again
+DEADLINE_CLUSTER_LOOKBACK_DAYS = 7
+
+
+def deadline_title_tokens(title: str) -> frozenset:
+    """Normalize a deadline title to its distinctive tokens; letters and digits are split ("TMA01" -> tma, 1)."""
+    tokens = set()
+    for token in re.findall(r'[a-z]+|\d+', (title or '').lower()):
+        if token.isdigit():
+            token = str(int(token))
+        if token not in DEADLINE_STOPWORDS:
+            tokens.add(token)
+    return frozenset(tokens)
+
+
+def same_deadline_title(a: frozenset, b: frozenset) -> bool:
+    """Whether two token sets (see deadline_title_tokens) name the same deadline."""
+    if not a or not b or bool(a & OPENING_WORDS) != bool(b & OPENING_WORDS):
+        return False
+    
+    # Numbers tell TMA 1 from TMA 2; extra ones (a course code) are allowed on one side
+    numbers_a = {token for token in a if token.isdigit()}
+    numbers_b = {token for token in b if token.isdigit()}
+    if not (numbers_a <= numbers_b or numbers_b <= numbers_a):
+        return False
+    
+    return a <= b or b <= a or len(a & b) / len(a | b) >= 0.6
+
+
+# Schema migrations (methods of Database) in the order they run; PRAGMA user_version
+# counts how many a database has had. Append new ones - never reorder or edit shipped ones.
+MIGRATIONS = (
+    '_create_baseline_schema',
+    '_merge_activities_by_moodle_id',    # old title-hash activity IDs -> Moodle IDs
+    '_create_hot_path_indexes',
+    '_add_scan_run_checkpoints',
+)
+
+# Natural keys of the per-course tables a scan shard exports and a merge upserts
+SHARD_TABLE_KEYS = {
+    'courses': ('course_id',),
+    'activities': ('activity_id',),
+    'deadlines': ('deadline_id',),
+    'forum_state': ('course_id', 'forum_cmid'),
+    'activity_details': ('activity_id',),
+    'enrollment_cache': ('lms_name',)
+}
+
+# Run IDs of shard scan checkpoints start with this; a full scan never resumes a shard's
+SHARD_CHECKPOINT_PREFIX = 'shard-'
+
+
+def shard_checkpoint_scope(shard: int, shard_count: int) -> str:
+    """Run ID prefix of one shard's scan checkpoints (kept across workflow re-runs)."""
+    return f"{SHARD_CHECKPOINT_PREFIX}{shard}of{shard_count}-"
+
 
 class Database:
     """Handle all database operations for LMS monitoring."""
     
     def __init__(self, db_path: str = "lms_data.db"):
         self.db_path = db_path
-        self.init_database()
+        
+        # The app, scheduler and scraper each create a Database; the schema is set up once per process
+        key = os.path.abspath(db_path)
+        with _init_lock:
+            if key not in _initialized_paths or not os.path.exists(db_path):
+                self.init_database()
+                _initialized_paths.add(key)
     
     def get_connection(self):
-        """Get database connection."""
-        return sqlite3.connect(self.db_path)
+        """
+        Get this thread's connection to the database, opening it on first use.
+        Callers still close() it when done, which keeps it open for reuse.
+        """
+        connections = _thread_connections.__dict__.setdefault('by_path', {})
+        key = os.path.abspath(self.db_path)
+        
+        conn = connections.get(key)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT, factory=PooledConnection,
+                                   check_same_thread=False, cached_statements=256)
+            for pragma in CONNECTION_PRAGMAS:
+                conn.execute(pragma)
+            connections[key] = conn
+            with _pool_lock:
+                _open_connections.add(conn)
+        return conn
     
     def init_database(self):
-        """Initialize database with required tables."""
+        """
+        Bring the schema up to date by running the MIGRATIONS this database hasn't
+        had yet, each in its own transaction. PRAGMA user_version records how many
+        have run; it is re-read under the write lock, so processes starting
+        together don't run a migration twice.
+        """
         conn = self.get_connection()
         cursor = conn.cursor()
         
+        cursor.execute("PRAGMA user_version")
+        if cursor.fetchone()[0] >= len(MIGRATIONS):
+            conn.close()
+            return
+        
+        while True:
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("PRAGMA user_version")
+            version = cursor.fetchone()[0]
+            if version >= len(MIGRATIONS):
+                conn.commit()
+                break
+            
+            print(f"🗄️ Migrating database schema to version {version + 1} ({MIGRATIONS[version]})")
+            getattr(self, MIGRATIONS[version])(cursor)
+            cursor.execute(f"PRAGMA user_version = {version + 1}")
+            conn.commit()
+        
+        conn.close()
+    
+    def _create_baseline_schema(self, cursor):
+        """
+        Migration 1: the schema as it stood before migrations were versioned.
+        Databases created before then run it too, so it only adds the tables and
+        columns that are missing.
+        """
         # Courses table
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS courses (
@@ -96,8 +275,252 @@ class Database:
             )
         """)
         
-        conn.commit()
-        conn.close()
+        # Enrollment cache (per-LMS course list, so discovery can be skipped)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS enrollment_cache (
+                lms_name TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                course_count INTEGER NOT NULL,
+                courses TEXT NOT NULL,
+                cached_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # Forum state (last seen discussion/unread counts from mod/forum/index.php)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS forum_state (
+                course_id TEXT NOT NULL,
+                forum_cmid TEXT NOT NULL,
+                discussions INTEGER NOT NULL DEFAULT 0,
+                unread INTEGER NOT NULL DEFAULT 0,
+                checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (course_id, forum_cmid),
+                FOREIGN KEY (course_id) REFERENCES courses(course_id)
+            )
+        """)
+        
+        # Change-feed state (timestamp the notification/recent-activity feeds were last read from)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS change_feed_state (
+                lms_name TEXT PRIMARY KEY,
+                last_polled INTEGER NOT NULL
+            )
+        """)
+        
+        # Full text of activity pages, cached per activity version (fingerprint);
+        # content is NULL while a fetch is still pending
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS activity_details (
+                activity_id TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                content TEXT,
+                fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (activity_id) REFERENCES activities(activity_id)
+            )
+        """)
+        
+        # Shared scan runs: one row per run, and one leased job per course so several
+        # scraper processes (or hosts sharing this file) can work through a run together
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS scan_runs (
+                run_id TEXT PRIMARY KEY,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+        """)
+        
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS scan_jobs (
+                job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                run_id TEXT NOT NULL,
+                course_id TEXT NOT NULL,
+                lms_name TEXT NOT NULL,
+                course_name TEXT,
+                course_url TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                worker_id TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                activities_found INTEGER DEFAULT 0,
+                new_activities INTEGER DEFAULT 0,
+                error_message TEXT,
+                UNIQUE (run_id, course_id),
+                FOREIGN KEY (run_id) REFERENCES scan_runs(run_id)
+            )
+        """)
+        
+        # Shard outputs already applied by a merge (so re-running a merge is a no-op)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS shard_merges (
+                run_id TEXT NOT NULL,
+                shard INTEGER NOT NULL,
+                merged_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (run_id, shard)
+            )
+        """)
+        
+        # Validators of each calendar feed, so unchanged feeds are not parsed or synced again
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS calendar_feed_state (
+                lms_name TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                content_hash TEXT,
+                fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # Progress of a full scan, so an interrupted one can be resumed (see scraper --resume)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS scan_checkpoints (
+                run_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL DEFAULT 'running',
+                state TEXT NOT NULL,
+                started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # Dates found in activity texts, keyed by a hash of the text (see date_extractor.ExtractionCache)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS deadline_extractions (
+                text_hash TEXT PRIMARY KEY,
+                dates TEXT NOT NULL,
+                extracted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # Columns added after the initial schema
+        self._ensure_column(cursor, 'courses', 'last_crawled', 'TIMESTAMP')
+        self._ensure_column(cursor, 'activities', 'fingerprint', 'TEXT')
+        self._ensure_column(cursor, 'activities', 'removed_at', 'TIMESTAMP')
+        self._ensure_column(cursor, 'deadlines', 'calendar_version', 'TEXT')
+        self._ensure_column(cursor, 'deadlines', 'text_hash', 'TEXT')
+        self._ensure_column(cursor, 'deadlines', 'recurrence', 'TEXT')
+        self._ensure_column(cursor, 'deadlines', 'cluster_id', 'TEXT')
+        self._ensure_column(cursor, 'activities', 'deadline_cluster', 'TEXT')
+    
+    def _create_hot_path_indexes(self, cursor):
+        """
+        Migration 3: indexes for the dashboard, notification and sync queries, so
+        they seek instead of scanning and sorting whole tables.
+        """
+        # get_activities_by_course (and every per-course lookup): course, newest first
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_activities_course_first_seen ON activities (course_id, first_seen)")
+        # get_recent_activities / get_activities_by_lms: walk newest first and stop at the limit
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_activities_first_seen ON activities (first_seen)")
+        # get_new_activities: only the few rows still waiting to be notified
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_activities_new ON activities (first_seen)
+            WHERE is_new = 1 AND removed_at IS NULL
+        """)
+        # (courses stays unindexed by LMS: it is a few dozen rows, and an index there would
+        # make get_activities_by_lms sort every activity of the LMS instead of stopping early)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_scan_history_time ON scan_history (scan_time)")
+        # Scraped deadlines per course, calendar deadlines per LMS
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_deadlines_course ON deadlines (course_id, source)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_deadlines_source_lms ON deadlines (source, lms_name)")
+    
+    def _merge_activities_by_moodle_id(self, cursor):
+        """
+        Migration 2: re-key activities stored under the old title-hash IDs onto
+        their Moodle cmid/discussion IDs. Rows that turn out to be the same Moodle
+        item (e.g. renamed activities) are merged into the earliest one, and
+        notifications and deadlines are pointed at the surviving ID.
+        Rows of different courses or types are never merged: old scans could store
+        another module's link (one from the description) or a site-wide forum
+        under several courses. Only the row whose type matches its link's module
+        takes the ID; the others keep their old IDs until a scan re-keys them.
+        """
+        cursor.execute("""
+            SELECT id, activity_id, course_id, activity_type, url, is_new
+            FROM activities
+            WHERE (url LIKE '%/mod/%/view.php?%' OR url LIKE '%/mod/forum/discuss.php?%')
+            AND activity_id NOT LIKE '%\\_cm\\_%' ESCAPE '\\'
+            AND activity_id NOT LIKE '%\\_d\\_%' ESCAPE '\\'
+        """)
+        legacy_rows = cursor.fetchall()
+        
+        groups = {}
+        urls = {}
+        for row_id, activity_id, course_id, activity_type, url, is_new in legacy_rows:
+            new_id = stable_activity_id(course_id, url)
+            if new_id:
+                groups.setdefault(new_id, {}).setdefault((course_id, activity_type), []).append(
+                    (row_id, activity_id, is_new))
+                urls[new_id] = url
+        
+        for new_id, owners in groups.items():
+            # A row that already uses the new ID owns it; only its own course and type join it
+            cursor.execute("""
+                SELECT id, activity_id, is_new, course_id, activity_type FROM activities WHERE activity_id = ?
+            """, (new_id,))
+            existing = cursor.fetchone()
+            if existing:
+                owner = existing[3:]
+            elif len(owners) == 1:
+                owner = next(iter(owners))
+            else:
+                matching = [key for key in owners if f"/mod/{key[1]}/" in urls[new_id]]
+                owner = matching[0] if len(matching) == 1 else None
+            if owner not in owners:
+                continue
+            
+            members = owners[owner]
+            if existing:
+                members.append(existing[:3])
+            
+            members.sort(key=lambda m: m[0])
+            keeper_row_id = members[0][0]
+            latest_row_id = members[-1][0]
+            old_ids = [m[1] for m in members if m[1] != new_id]
+            # If any copy was already notified, the merged row counts as notified
+            is_new = min(m[2] for m in members)
+            
+            # Keep the earliest row (and its first_seen) with the latest content
+            cursor.execute("""
+                SELECT title, description, url, deadline, metadata
+                FROM activities WHERE id = ?
+            """, (latest_row_id,))
+            latest = cursor.fetchone()
+            cursor.execute("""
+                UPDATE activities
+                SET title = ?, description = ?, url = ?, deadline = ?, metadata = ?
+                WHERE id = ?
+            """, latest + (keeper_row_id,))
+            
+            cursor.execute(
+                "DELETE FROM activities WHERE id IN ({}) AND id != ?".format(','.join('?' * len(members))),
+                [m[0] for m in members] + [keeper_row_id]
+            )
+            cursor.execute("UPDATE activities SET activity_id = ?, is_new = ? WHERE id = ?",
+                           (new_id, is_new, keeper_row_id))
+            
+            for old_id in old_ids:
+                cursor.execute("UPDATE notifications SET activity_id = ? WHERE activity_id = ?", (new_id, old_id))
+                # Scraped deadline IDs embed the activity ID; drop copies that now collide
+                cursor.execute("""
+                    UPDATE OR IGNORE deadlines
+                    SET deadline_id = 'scraped_' || ? || substr(deadline_id, length('scraped_' || ?) + 1),
+                        activity_id = ?
+                    WHERE activity_id = ? AND source = 'scraped'
+                """, (new_id, old_id, new_id, old_id))
+                cursor.execute("DELETE FROM deadlines WHERE activity_id = ? AND source = 'scraped'", (old_id,))
+                cursor.execute("UPDATE deadlines SET activity_id = ? WHERE activity_id = ?", (new_id, old_id))
+    
+    def _add_scan_run_checkpoints(self, cursor):
+        """
+        Migration 4: the change-feed checkpoint of each LMS a shared scan run was
+        planned from, applied only once the run's jobs for that LMS succeed.
+        """
+        self._ensure_column(cursor, 'scan_runs', 'feed_checkpoints', 'TEXT')
+    
+    def _ensure_column(self, cursor, table: str, column: str, definition: str):
+        """Add a column to an existing table if it is missing."""
+        cursor.execute(f"PRAGMA table_info({table})")
+        if column not in [row[1] for row in cursor.fetchall()]:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
     
     def add_course(self, course_id: str, lms_name: str, course_name: str, course_url: str = None):
         """Add or update a course."""
@@ -116,6 +539,159 @@ class Database:
         conn.commit()
         conn.close()
     
+    def mark_course_crawled(self, course_id: str):
+        """Record that a course page was fully crawled."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            UPDATE courses
+            SET last_crawled = CURRENT_TIMESTAMP, last_checked = CURRENT_TIMESTAMP
+            WHERE course_id = ?
+        """, (course_id,))
+        
+        conn.commit()
+        conn.close()
+    
+    def get_courses_due_for_crawl(self, course_ids: List[str], max_age_hours: float) -> set:
+        """Return the course IDs that were never crawled or not within max_age_hours."""
+        if not course_ids:
+            return set()
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        placeholders = ','.join('?' * len(course_ids))
+        cursor.execute(f"""
+            SELECT course_id FROM courses
+            WHERE course_id IN ({placeholders})
+            AND last_crawled IS NOT NULL
+            AND (julianday('now') - julianday(last_crawled)) * 24 < ?
+        """, list(course_ids) + [max_age_hours])
+        
+        fresh = {row[0] for row in cursor.fetchall()}
+        
+        conn.close()
+        return set(course_ids) - fresh
+    
+    def find_course_by_cmid(self, lms_prefix: str, cmid: str) -> Optional[str]:
+        """Find the course that owns a course module, using stored activity URLs."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            SELECT course_id FROM activities
+            WHERE course_id LIKE ? || '\\_%' ESCAPE '\\'
+            AND url LIKE '%/view.php?id=' || ?
+            LIMIT 1
+        """, (lms_prefix, cmid))
+        
+        row = cursor.fetchone()
+        conn.close()
+        return row[0] if row else None
+    
+    def get_change_feed_checkpoint(self, lms_name: str) -> Optional[int]:
+        """Get the unix time the change feeds were last read up to for an LMS."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT last_polled FROM change_feed_state WHERE lms_name = ?", (lms_name,))
+        row = cursor.fetchone()
+        
+        conn.close()
+        return row[0] if row else None
+    
+    def set_change_feed_checkpoint(self, lms_name: str, last_polled: int):
+        """Advance the change-feed checkpoint for an LMS."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            INSERT INTO change_feed_state (lms_name, last_polled)
+            VALUES (?, ?)
+            ON CONFLICT(lms_name) DO UPDATE SET last_polled = excluded.last_polled
+        """, (lms_name, last_polled))
+        
+        conn.commit()
+        conn.close()
+    
+    def get_enrollment_cache(self, lms_name: str) -> Optional[Dict[str, Any]]:
+        """Get the cached course list for an LMS, or None if nothing is cached."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            SELECT fingerprint, course_count, courses, cached_at,
+                   (julianday('now') - julianday(cached_at)) * 24 AS age_hours
+            FROM enrollment_cache
+            WHERE lms_name = ?
+        """, (lms_name,))
+        
+        row = cursor.fetchone()
+        conn.close()
+        
+        if not row:
+            return None
+        
+        return {
+            'fingerprint': row[0],
+            'course_count': row[1],
+            'courses': json.loads(row[2]),
+            'cached_at': row[3],
+            'age_hours': row[4]
+        }
+    
+    def save_enrollment_cache(self, lms_name: str, courses: List[Dict[str, Any]], fingerprint: str):
+        """Cache the discovered course list for an LMS."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            INSERT INTO enrollment_cache (lms_name, fingerprint, course_count, courses, cached_at)
+            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(lms_name) DO UPDATE SET
+                fingerprint = excluded.fingerprint,
+                course_count = excluded.course_count,
+                courses = excluded.courses,
+                cached_at = CURRENT_TIMESTAMP
+        """, (lms_name, fingerprint, len(courses), json.dumps(courses)))
+        
+        conn.commit()
+        conn.close()
+    
+    def get_forum_counts(self, course_id: str) -> Dict[str, tuple]:
+        """Get the stored (discussions, unread) counts for each forum in a course."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            SELECT forum_cmid, discussions, unread
+            FROM forum_state
+            WHERE course_id = ?
+        """, (course_id,))
+        
+        counts = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+        
+        conn.close()
+        return counts
+    
+    def update_forum_counts(self, course_id: str, forum_cmid: str, discussions: int, unread: int):
+        """Remember the discussion/unread counts of a forum after it was scraped."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            INSERT INTO forum_state (course_id, forum_cmid, discussions, unread, checked_at)
+            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(course_id, forum_cmid) DO UPDATE SET
+                discussions = excluded.discussions,
+                unread = excluded.unread,
+                checked_at = CURRENT_TIMESTAMP
+        """, (course_id, forum_cmid, discussions, unread))
+        
+        conn.commit()
+        conn.close()
+    
     def add_activity(self, activity_id: str, course_id: str, activity_type: str,
                      title: str, description: str = None, url: str = None,
                      deadline: str = None, metadata: Dict = None) -> bool:
@@ -130,12 +706,12 @@ class Database:
         exists = cursor.fetchone()
         
         if exists:
-            # Update existing activity
+            # Update existing activity (title/url too, since IDs survive renames)
             cursor.execute("""
                 UPDATE activities
-                SET is_new = 0, description = ?, deadline = ?, metadata = ?
+                SET is_new = 0, removed_at = NULL, title = ?, url = ?, description = ?, deadline = ?, metadata = ?
                 WHERE activity_id = ?
-            """, (description, deadline, json.dumps(metadata) if metadata else None, activity_id))
+            """, (title, url, description, deadline, json.dumps(metadata) if metadata else None, activity_id))
             conn.commit()
             conn.close()
             return False
@@ -152,6 +728,297 @@ class Database:
             conn.close()
             return True
     
+    def get_existing_activity_ids(self, activity_ids: List[str]) -> set:
+        """Return the subset of the given activity IDs that are already stored."""
+        if not activity_ids:
+            return set()
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        placeholders = ','.join('?' * len(activity_ids))
+        cursor.execute(f"""
+            SELECT activity_id FROM activities
+            WHERE activity_id IN ({placeholders})
+        """, activity_ids)
+        
+        existing = {row[0] for row in cursor.fetchall()}
+        
+        conn.close()
+        return existing
+    
+    def get_removed_activity_ids(self, activity_ids: List[str]) -> set:
+        """Return the subset of the given activity IDs that are stored as removed (tombstoned)."""
+        if not activity_ids:
+            return set()
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        placeholders = ','.join('?' * len(activity_ids))
+        cursor.execute(f"""
+            SELECT activity_id FROM activities
+            WHERE activity_id IN ({placeholders}) AND removed_at IS NOT NULL
+        """, activity_ids)
+        
+        removed = {row[0] for row in cursor.fetchall()}
+        
+        conn.close()
+        return removed
+    
+    def apply_course_scan(self, course_id: str, items: List[Dict[str, Any]]) -> Dict[str, set]:
+        """
+        Reconcile one crawl of a course page with the stored activities.
+        
+        The observed items are staged in a temporary table and classified in a
+        single query: added (not stored yet), changed (fingerprint differs, or
+        the item was tombstoned and is back) and removed (stored for this course
+        but no longer observed). Removals are kept as tombstones in removed_at.
+        Forum posts are not listed on the course page, so they only count as
+        removed when the stored forum they were walked from is gone (posts
+        without a forum_url are never removed here).
+        
+        Each item needs activity_id, type, title, description, url, deadline
+        and fingerprint (metadata is optional). Returns the three ID sets.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS scan_observed (
+                activity_id TEXT PRIMARY KEY,
+                activity_type TEXT NOT NULL,
+                title TEXT NOT NULL,
+                description TEXT,
+                url TEXT,
+                deadline TIMESTAMP,
+                metadata TEXT,
+                fingerprint TEXT NOT NULL
+            )
+        """)
+        cursor.execute("DELETE FROM scan_observed")
+        cursor.executemany("""
+            INSERT OR REPLACE INTO scan_observed
+            (activity_id, activity_type, title, description, url, deadline, metadata, fingerprint)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, [(item['activity_id'], item['type'], item['title'], item.get('description'),
+               item.get('url'), item.get('deadline'),
+               json.dumps(item['metadata']) if item.get('metadata') else None,
+               item['fingerprint']) for item in items])
+        
+        cursor.execute("""
+            SELECT o.activity_id,
+                   CASE
+                       WHEN a.activity_id IS NULL THEN 'added'
+                       WHEN a.removed_at IS NOT NULL THEN 'changed'
+                       WHEN a.fingerprint IS NOT NULL AND a.fingerprint != o.fingerprint THEN 'changed'
+                   END
+            FROM scan_observed o
+            LEFT JOIN activities a ON a.activity_id = o.activity_id
+            UNION ALL
+            SELECT a.activity_id, 'removed'
+            FROM activities a
+            WHERE a.course_id = ?
+              AND a.removed_at IS NULL
+              AND NOT EXISTS (SELECT 1 FROM scan_observed o WHERE o.activity_id = a.activity_id)
+              AND (a.activity_type != 'forum_post'
+                   OR json_extract(a.metadata, '$.forum_url') IN
+                      (SELECT f.url FROM activities f
+                       WHERE f.course_id = a.course_id AND f.activity_type = 'forum' AND f.url IS NOT NULL
+                         AND NOT EXISTS (SELECT 1 FROM scan_observed o WHERE o.activity_id = f.activity_id)))
+        """, (course_id,))
+        
+        diff = {'added': set(), 'changed': set(), 'removed': set()}
+        for activity_id, status in cursor.fetchall():
+            if status:
+                diff[status].add(activity_id)
+        
+        # A forum that is back brings back the posts tombstoned with it
+        cursor.execute("""
+            UPDATE activities SET removed_at = NULL
+            WHERE course_id = ? AND activity_type = 'forum_post' AND removed_at IS NOT NULL
+              AND json_extract(metadata, '$.forum_url') IN
+                  (SELECT o.url FROM scan_observed o
+                   JOIN activities f ON f.activity_id = o.activity_id
+                   WHERE o.activity_type = 'forum' AND f.removed_at IS NOT NULL)
+        """, (course_id,))
+        
+        # Refresh rows that were seen again (also backfills missing fingerprints)
+        cursor.execute("""
+            UPDATE activities
+            SET (title, description, url, deadline, metadata, fingerprint) =
+                (SELECT o.title, o.description, o.url, o.deadline, o.metadata, o.fingerprint
+                 FROM scan_observed o WHERE o.activity_id = activities.activity_id),
+                is_new = 0,
+                removed_at = NULL
+            WHERE activity_id IN (SELECT activity_id FROM scan_observed)
+        """)
+        
+        cursor.execute("""
+            INSERT INTO activities
+            (activity_id, course_id, activity_type, title, description, url, deadline, metadata,
+             fingerprint, is_new)
+            SELECT o.activity_id, ?, o.activity_type, o.title, o.description, o.url, o.deadline,
+                   o.metadata, o.fingerprint, 1
+            FROM scan_observed o
+            WHERE NOT EXISTS (SELECT 1 FROM activities a WHERE a.activity_id = o.activity_id)
+        """, (course_id,))
+        
+        if diff['removed']:
+            placeholders = ','.join('?' * len(diff['removed']))
+            cursor.execute(f"""
+                UPDATE activities SET removed_at = CURRENT_TIMESTAMP
+                WHERE activity_id IN ({placeholders})
+            """, tuple(diff['removed']))
+        
+        cursor.execute("DELETE FROM scan_observed")
+        conn.commit()
+        conn.close()
+        return diff
+    
+    def get_activity_details(self, activity_id: str, fingerprint: str) -> Optional[str]:
+        """Get cached page text for this version of an activity, or None if not fetched yet."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            SELECT content FROM activity_details
+            WHERE activity_id = ? AND fingerprint = ?
+        """, (activity_id, fingerprint))
+        row = cursor.fetchone()
+        
+        conn.close()
+        return row[0] if row else None
+    
+    def save_activity_details(self, activity_id: str, fingerprint: str, content: Optional[str]):
+        """
+        Cache page text for an activity, replacing any older version. Pass None to
+        record that the fetch is still pending (e.g. the per-scan limit was hit).
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            INSERT INTO activity_details (activity_id, fingerprint, content)
+            VALUES (?, ?, ?)
+            ON CONFLICT(activity_id) DO UPDATE SET
+                fingerprint = excluded.fingerprint,
+                content = excluded.content,
+                fetched_at = CURRENT_TIMESTAMP
+        """, (activity_id, fingerprint, content))
+        
+        conn.commit()
+        conn.close()
+    
+    def get_pending_detail_ids(self, activity_ids: List[str]) -> set:
+        """Return the subset of the given activity IDs whose detail fetch is still pending."""
+        if not activity_ids:
+            return set()
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        placeholders = ','.join('?' * len(activity_ids))
+        cursor.execute(f"""
+            SELECT activity_id FROM activity_details
+            WHERE content IS NULL AND activity_id IN ({placeholders})
+        """, activity_ids)
+        
+        pending = {row[0] for row in cursor.fetchall()}
+        
+        conn.close()
+        return pending
+    
+    def get_cached_extractions(self, text_hashes: List[str]) -> Dict[str, List[str]]:
+        """Get the stored dates (ISO strings) extracted from each of the given text hashes."""
+        if not text_hashes:
+            return {}
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        placeholders = ','.join('?' * len(text_hashes))
+        cursor.execute(f"""
+            SELECT text_hash, dates FROM deadline_extractions
+            WHERE text_hash IN ({placeholders})
+        """, text_hashes)
+        
+        cached = {row[0]: json.loads(row[1]) for row in cursor.fetchall()}
+        
+        conn.close()
+        return cached
+    
+    def save_cached_extractions(self, extractions: Dict[str, List[str]]):
+        """Store the dates (ISO strings) extracted from each text hash."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.executemany("""
+            INSERT OR REPLACE INTO deadline_extractions (text_hash, dates)
+            VALUES (?, ?)
+        """, [(digest, json.dumps(dates)) for digest, dates in extractions.items()])
+        
+        conn.commit()
+        conn.close()
+    
+    def prune_cached_extractions(self, max_age_days: int = 30) -> int:
+        """Forget extraction results older than max_age_days. Returns how many were removed."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            DELETE FROM deadline_extractions
+            WHERE extracted_at < datetime('now', '-' || ? || ' days')
+        """, (max_age_days,))
+        removed = cursor.rowcount
+        
+        conn.commit()
+        conn.close()
+        return removed
+    
+    def get_scraped_deadline_hashes(self, course_id: str) -> set:
+        """Get (activity_id, text_hash) of the scraped deadlines stored for a course."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            SELECT activity_id, text_hash FROM deadlines
+            WHERE course_id = ? AND source = 'scraped' AND text_hash IS NOT NULL
+        """, (course_id,))
+        
+        stored = set(cursor.fetchall())
+        
+        conn.close()
+        return stored
+    
+    def get_removed_activities(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Get the most recently removed (tombstoned) activities."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            SELECT 
+                a.activity_id,
+                a.activity_type,
+                a.title,
+                a.url,
+                a.first_seen,
+                a.removed_at,
+                c.course_name,
+                c.lms_name
+            FROM activities a
+            JOIN courses c ON a.course_id = c.course_id
+            WHERE a.removed_at IS NOT NULL
+            ORDER BY a.removed_at DESC
+            LIMIT ?
+        """, (limit,))
+        
+        columns = [desc[0] for desc in cursor.description]
+        activities = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        
+        conn.close()
+        return activities
+    
     def get_new_activities(self) -> List[Dict[str, Any]]:
         """Get all new activities that haven't been notified."""
         conn = self.get_connection()
@@ -167,12 +1034,15 @@ class Database:
                 a.deadline,
                 a.first_seen,
                 a.metadata,
+                d.content AS details,
                 c.course_name,
                 c.lms_name,
                 c.course_url
             FROM activities a
             JOIN courses c ON a.course_id = c.course_id
-            WHERE a.is_new = 1
+            LEFT JOIN activity_details d ON d.activity_id = a.activity_id
+                AND (a.fingerprint IS NULL OR d.fingerprint = a.fingerprint)
+            WHERE a.is_new = 1 AND a.removed_at IS NULL
             ORDER BY a.first_seen DESC
         """)
         
@@ -229,6 +1099,352 @@ class Database:
         conn.commit()
         conn.close()
     
+    def create_scan_run(self, run_id: str, courses: List[Dict[str, Any]],
+                        feed_checkpoints: Dict[str, int] = None):
+        """
+        Create a shared scan run with one pending job per course. feed_checkpoints
+        ({lms_name: unix time the run was planned from}) are kept for when the run finishes.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("INSERT INTO scan_runs (run_id, feed_checkpoints) VALUES (?, ?)",
+                       (run_id, json.dumps(feed_checkpoints or {})))
+        cursor.executemany("""
+            INSERT OR IGNORE INTO scan_jobs (run_id, course_id, lms_name, course_name, course_url)
+            VALUES (?, ?, ?, ?, ?)
+        """, [(run_id, c['course_id'], c['lms_name'], c['name'], c['url']) for c in courses])
+        
+        conn.commit()
+        conn.close()
+    
+    def get_scan_run_checkpoints(self, run_id: str) -> Dict[str, int]:
+        """Get the change-feed checkpoints a scan run was planned from."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT feed_checkpoints FROM scan_runs WHERE run_id = ?", (run_id,))
+        row = cursor.fetchone()
+        
+        conn.close()
+        return json.loads(row[0]) if row and row[0] else {}
+    
+    def get_open_scan_run(self) -> Optional[str]:
+        """Get the most recent scan run that has not been finished yet."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            SELECT run_id FROM scan_runs
+            WHERE finished_at IS NULL
+            ORDER BY created_at DESC, rowid DESC
+            LIMIT 1
+        """)
+        row = cursor.fetchone()
+        
+        conn.close()
+        return row[0] if row else None
+    
+    def claim_scan_job(self, run_id: str, worker_id: str, lease_seconds: float,
+                       max_attempts: int, skip_lms: List[str] = ()) -> Optional[Dict[str, Any]]:
+        """
+        Lease the next job of a run to this worker: a pending job, or one that
+        failed or whose previous worker's lease expired (it died or hung) and that
+        has attempts left. Jobs tried fewer times go first, so a retry waits its turn.
+        Jobs of the LMSs in skip_lms (e.g. ones this worker can't log in to) are left
+        for other workers.
+        Returns the job, or None when there is nothing left to claim.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        now = time.time()
+        skip_lms = list(skip_lms)
+        
+        # IMMEDIATE takes the write lock up front, so two workers can't claim the same job
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute(f"""
+            SELECT job_id, course_id, lms_name, course_name, course_url, attempts
+            FROM scan_jobs
+            WHERE run_id = ?
+              AND attempts < ?
+              AND (status IN ('pending', 'failed') OR (status = 'leased' AND lease_expires < ?))
+              AND lms_name NOT IN ({', '.join('?' * len(skip_lms))})
+            ORDER BY attempts, job_id
+            LIMIT 1
+        """, (run_id, max_attempts, now, *skip_lms))
+        row = cursor.fetchone()
+        
+        job = None
+        if row:
+            job = dict(zip(['job_id', 'course_id', 'lms_name', 'course_name', 'course_url', 'attempts'], row))
+            job['attempts'] += 1
+            cursor.execute("""
+                UPDATE scan_jobs
+                SET status = 'leased', worker_id = ?, lease_expires = ?, attempts = ?
+                WHERE job_id = ?
+            """, (worker_id, now + lease_seconds, job['attempts'], job['job_id']))
+        
+        conn.commit()
+        conn.close()
+        return job
+    
+    def renew_scan_job_lease(self, job_id: int, worker_id: str, lease_seconds: float) -> bool:
+        """Extend a job's lease (heartbeat). Returns False if the worker no longer holds it."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            UPDATE scan_jobs SET lease_expires = ?
+            WHERE job_id = ? AND worker_id = ? AND status = 'leased'
+        """, (time.time() + lease_seconds, job_id, worker_id))
+        renewed = cursor.rowcount == 1
+        
+        conn.commit()
+        conn.close()
+        return renewed
+    
+    def complete_scan_job(self, job_id: int, worker_id: str, status: str,
+                          activities_found: int = 0, new_activities: int = 0,
+                          error_message: str = None):
+        """Mark a leased job 'done' or 'failed', unless its lease has passed to another worker."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            UPDATE scan_jobs
+            SET status = ?, activities_found = ?, new_activities = ?, error_message = ?,
+                lease_expires = NULL
+            WHERE job_id = ? AND worker_id = ? AND status = 'leased'
+        """, (status, activities_found, new_activities, error_message, job_id, worker_id))
+        
+        conn.commit()
+        conn.close()
+    
+    def finish_scan_run(self, run_id: str, max_attempts: int) -> Optional[List[Dict[str, Any]]]:
+        """
+        Close a run once no job is pending, leased or retryable (failed or expired
+        with attempts left). Only one caller can
+        win this; it gets a per-LMS summary back (and should send the notifications),
+        every other caller gets None.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        now = time.time()
+        
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("""
+            SELECT COUNT(*) FROM scan_jobs
+            WHERE run_id = ?
+              AND (status = 'pending'
+                   OR (status = 'failed' AND attempts < ?)
+                   OR (status = 'leased' AND (lease_expires >= ? OR attempts < ?)))
+        """, (run_id, max_attempts, now, max_attempts))
+        remaining = cursor.fetchone()[0]
+        
+        summary = None
+        if remaining == 0:
+            cursor.execute("""
+                UPDATE scan_runs SET finished_at = CURRENT_TIMESTAMP
+                WHERE run_id = ? AND finished_at IS NULL
+            """, (run_id,))
+            if cursor.rowcount == 1:
+                cursor.execute("""
+                    SELECT lms_name,
+                           COUNT(*) AS courses,
+                           SUM(CASE WHEN status = 'done' THEN activities_found ELSE 0 END) AS activities,
+                           SUM(CASE WHEN status = 'done' THEN new_activities ELSE 0 END) AS new_activities,
+                           SUM(CASE WHEN status = 'done' THEN 0 ELSE 1 END) AS failed
+                    FROM scan_jobs
+                    WHERE run_id = ?
+                    GROUP BY lms_name
+                """, (run_id,))
+                columns = [desc[0] for desc in cursor.description]
+                summary = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        
+        conn.commit()
+        conn.close()
+        return summary
+    
+    def export_course_rows(self, course_ids: List[str], lms_names: List[str] = ()) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Export every stored row belonging to the given courses, table by table,
+        plus the enrollment cache of the given LMSs.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        placeholders = ','.join('?' * len(course_ids)) or "''"
+        
+        queries = {
+            'courses': f"SELECT * FROM courses WHERE course_id IN ({placeholders})",
+            'activities': f"SELECT * FROM activities WHERE course_id IN ({placeholders})",
+            'deadlines': f"SELECT * FROM deadlines WHERE course_id IN ({placeholders})",
+            'forum_state': f"SELECT * FROM forum_state WHERE course_id IN ({placeholders})",
+            'activity_details': f"""
+                SELECT d.* FROM activity_details d
+                JOIN activities a ON a.activity_id = d.activity_id
+                WHERE a.course_id IN ({placeholders})
+            """
+        }
+        
+        rows = {}
+        for table, query in queries.items():
+            cursor.execute(query, course_ids)
+            # Local row IDs differ between databases, so they are left out
+            columns = [desc[0] for desc in cursor.description]
+            rows[table] = [{k: v for k, v in zip(columns, row) if k != 'id'} for row in cursor.fetchall()]
+        
+        cursor.execute(f"""
+            SELECT * FROM enrollment_cache WHERE lms_name IN ({','.join('?' * len(lms_names)) or "''"})
+        """, list(lms_names))
+        columns = [desc[0] for desc in cursor.description]
+        rows['enrollment_cache'] = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        
+        conn.close()
+        return rows
+    
+    def merge_shard_rows(self, run_id: str, shard: int, rows: Dict[str, List[Dict[str, Any]]]) -> bool:
+        """
+        Upsert one shard's exported rows on their natural keys, in one transaction.
+        Returns False (and changes nothing) if this shard of this run was merged before.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("INSERT OR IGNORE INTO shard_merges (run_id, shard) VALUES (?, ?)", (run_id, shard))
+        if cursor.rowcount == 0:
+            conn.close()
+            return False
+        
+        for table, keys in SHARD_TABLE_KEYS.items():
+            for row in rows.get(table, []):
+                columns = list(row)
+                updates = ', '.join(f"{c} = excluded.{c}" for c in columns if c not in keys)
+                cursor.execute(f"""
+                    INSERT INTO {table} ({', '.join(columns)})
+                    VALUES ({', '.join('?' * len(columns))})
+                    ON CONFLICT({', '.join(keys)}) DO UPDATE SET {updates}
+                """, [row[c] for c in columns])
+        
+        conn.commit()
+        conn.close()
+        return True
+    
+    def mark_scan_run_finished(self, run_id: str) -> bool:
+        """Record a run as finished. Returns True only for the first caller."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("INSERT OR IGNORE INTO scan_runs (run_id) VALUES (?)", (run_id,))
+        cursor.execute("""
+            UPDATE scan_runs SET finished_at = CURRENT_TIMESTAMP
+            WHERE run_id = ? AND finished_at IS NULL
+        """, (run_id,))
+        first = cursor.rowcount == 1
+        
+        conn.commit()
+        conn.close()
+        return first
+    
+    def get_scan_checkpoint(self, include_finished: bool = False, scope: str = '') -> Optional[Dict[str, Any]]:
+        """
+        Get the most recent unfinished scan checkpoint (or the most recent of any
+        status). scope is the run ID prefix of one shard's checkpoints (see
+        shard_checkpoint_scope); the default is full scans.
+        """
+        scope_filter, params = self._checkpoint_scope_filter(scope)
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute(f"""
+            SELECT run_id, state, started_at, updated_at FROM scan_checkpoints
+            WHERE {scope_filter}
+            {'' if include_finished else "AND status = 'running'"}
+            ORDER BY rowid DESC
+            LIMIT 1
+        """, params)
+        row = cursor.fetchone()
+        conn.close()
+        
+        if not row:
+            return None
+        return {'run_id': row[0], 'state': json.loads(row[1]), 'started_at': row[2], 'updated_at': row[3]}
+    
+    def start_scan_checkpoint(self, run_id: str, state: Dict[str, Any], scope: str = ''):
+        """Begin checkpointing a new scan; any older unfinished checkpoint of its scope is abandoned."""
+        scope_filter, params = self._checkpoint_scope_filter(scope)
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute(f"""
+            UPDATE scan_checkpoints SET status = 'abandoned'
+            WHERE status = 'running' AND {scope_filter}
+        """, params)
+        cursor.execute("INSERT INTO scan_checkpoints (run_id, state) VALUES (?, ?)",
+                       (run_id, json.dumps(state)))
+        
+        conn.commit()
+        conn.close()
+    
+    def _checkpoint_scope_filter(self, scope: str) -> Tuple[str, tuple]:
+        """WHERE clause and parameters matching the checkpoints of a scope."""
+        if scope:
+            return "substr(run_id, 1, ?) = ?", (len(scope), scope)
+        # Full scans: anything that isn't a shard's checkpoint
+        return "substr(run_id, 1, ?) != ?", (len(SHARD_CHECKPOINT_PREFIX), SHARD_CHECKPOINT_PREFIX)
+    
+    def save_scan_checkpoint(self, run_id: str, state: str):
+        """Store the latest progress (a JSON string) of a running full scan."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            UPDATE scan_checkpoints SET state = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE run_id = ?
+        """, (state, run_id))
+        
+        conn.commit()
+        conn.close()
+    
+    def finish_scan_checkpoint(self, run_id: str):
+        """Mark a full scan as complete so it is no longer offered for --resume."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            UPDATE scan_checkpoints SET status = 'complete', updated_at = CURRENT_TIMESTAMP
+            WHERE run_id = ?
+        """, (run_id,))
+        
+        conn.commit()
+        conn.close()
+    
+    def flag_pending_notifications(self, activity_ids: List[str]) -> List[str]:
+        """
+        Re-mark activities found by earlier scans as new, unless they were removed
+        or already notified, so the next notification round includes them even if
+        a rescan in between cleared the flag. Returns the IDs still awaiting notification.
+        """
+        if not activity_ids:
+            return []
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        placeholders = ','.join('?' * len(activity_ids))
+        cursor.execute(f"""
+            UPDATE activities
+            SET is_new = 1
+            WHERE activity_id IN ({placeholders})
+              AND removed_at IS NULL
+              AND NOT EXISTS (SELECT 1 FROM notifications n WHERE n.activity_id = activities.activity_id)
+            RETURNING activity_id
+        """, activity_ids)
+        pending = [row[0] for row in cursor.fetchall()]
+        
+        conn.commit()
+        conn.close()
+        return pending
+    
     def get_all_courses(self, lms_name: str = None) -> List[Dict[str, Any]]:
         """Get all courses, optionally filtered by LMS."""
         conn = self.get_connection()
@@ -254,6 +1470,28 @@ class Database:
         conn.close()
         return courses
     
+    def get_courses_by_ids(self, course_ids: List[str]) -> List[Dict[str, Any]]:
+        """Get the given courses (unknown IDs are skipped)."""
+        if not course_ids:
+            return []
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        placeholders = ','.join('?' * len(course_ids))
+        cursor.execute(f"""
+            SELECT course_id, lms_name, course_name, course_url, first_seen, last_checked
+            FROM courses
+            WHERE course_id IN ({placeholders})
+            ORDER BY lms_name, course_name
+        """, list(course_ids))
+        
+        columns = [desc[0] for desc in cursor.description]
+        courses = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        
+        conn.close()
+        return courses
+    
     def get_activities_by_course(self, course_id: str) -> List[Dict[str, Any]]:
         """Get all activities for a specific course."""
         conn = self.get_connection()
@@ -264,7 +1502,7 @@ class Database:
                 activity_id, activity_type, title, description, url, 
                 deadline, first_seen, is_new, metadata
             FROM activities
-            WHERE course_id = ?
+            WHERE course_id = ? AND removed_at IS NULL
             ORDER BY first_seen DESC
         """, (course_id,))
         
@@ -299,6 +1537,7 @@ class Database:
                 c.lms_name
             FROM activities a
             JOIN courses c ON a.course_id = c.course_id
+            WHERE a.removed_at IS NULL
             ORDER BY a.first_seen DESC
             LIMIT ?
         """, (limit,))
@@ -336,18 +1575,22 @@ class Database:
         cursor.execute("SELECT COUNT(*) FROM courses")
         total_courses = cursor.fetchone()[0]
         
-        # Total activities
-        cursor.execute("SELECT COUNT(*) FROM activities")
+        # Total activities (tombstoned ones are counted separately)
+        cursor.execute("SELECT COUNT(*) FROM activities WHERE removed_at IS NULL")
         total_activities = cursor.fetchone()[0]
         
+        cursor.execute("SELECT COUNT(*) FROM activities WHERE removed_at IS NOT NULL")
+        removed_activities = cursor.fetchone()[0]
+        
         # New activities
-        cursor.execute("SELECT COUNT(*) FROM activities WHERE is_new = 1")
+        cursor.execute("SELECT COUNT(*) FROM activities WHERE is_new = 1 AND removed_at IS NULL")
         new_activities = cursor.fetchone()[0]
         
         # Activities by type
         cursor.execute("""
             SELECT activity_type, COUNT(*) as count
             FROM activities
+            WHERE removed_at IS NULL
             GROUP BY activity_type
         """)
         activities_by_type = dict(cursor.fetchall())
@@ -374,6 +1617,7 @@ class Database:
             'total_courses': total_courses,
             'total_activities': total_activities,
             'new_activities': new_activities,
+            'removed_activities': removed_activities,
             'activities_by_type': activities_by_type,
             'last_scan_time': last_scan[0] if last_scan else None,
             'last_scan_lms': last_scan[1] if last_scan else None,
@@ -430,7 +1674,7 @@ class Database:
                 c.lms_name
             FROM activities a
             JOIN courses c ON a.course_id = c.course_id
-            WHERE c.lms_name = ?
+            WHERE c.lms_name = ? AND a.removed_at IS NULL
             ORDER BY a.first_seen DESC
             LIMIT ?
         """, (lms_name, limit))
@@ -440,39 +1684,345 @@ class Database:
         
         conn.close()
         return activities
-
+    
     
     def add_deadline(self, deadline_id: str, title: str, deadline_date: str, 
                     lms_name: str, description: str = None, course_id: str = None,
-                    activity_id: str = None, source: str = 'scraped', location: str = None):
-        """Add or update a deadline."""
+                    activity_id: str = None, source: str = 'scraped', location: str = None,
+                    text_hash: str = None):
+        """Add or update a deadline. text_hash identifies the text a scraped deadline came from."""
         conn = self.get_connection()
         cursor = conn.cursor()
         
         cursor.execute("""
             INSERT INTO deadlines (deadline_id, title, description, deadline_date, 
-                                  lms_name, course_id, activity_id, source, location)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                                  lms_name, course_id, activity_id, source, location, text_hash)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             ON CONFLICT(deadline_id) DO UPDATE SET
                 title = excluded.title,
                 description = excluded.description,
                 deadline_date = excluded.deadline_date,
-                location = excluded.location
+                location = excluded.location,
+                text_hash = excluded.text_hash
         """, (deadline_id, title, description, deadline_date, lms_name, 
-              course_id, activity_id, source, location))
+              course_id, activity_id, source, location, text_hash))
+        
+        conn.commit()
+        conn.close()
+    
+    def delete_calendar_events(self, lms_name: str = None):
+        """Delete all calendar events (optionally of one LMS) from deadlines table."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        if lms_name:
+            cursor.execute("DELETE FROM deadlines WHERE source = 'calendar' AND lms_name = ?", (lms_name,))
+        else:
+            cursor.execute("DELETE FROM deadlines WHERE source = 'calendar'")
+        
+        conn.commit()
+        conn.close()
+    
+    def sync_calendar_events(self, lms_name: str, events: List[Dict[str, Any]]) -> Dict[str, int]:
+        """
+        Bring one LMS's calendar deadlines in line with its feed in a single
+        transaction: insert new events, update those whose version changed and
+        delete those no longer listed. Unchanged rows are left untouched, and
+        readers never see a half-synced table. New and updated rows are linked
+        to a course by the course code in their title.
+        Each event needs deadline_id, version, title, description, deadline_date and location,
+        plus recurrence (RRULE/RDATE/EXDATE lines, or None) for recurring events.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("""
+                SELECT deadline_id, calendar_version FROM deadlines
+                WHERE source = 'calendar' AND lms_name = ?
+            """, (lms_name,))
+            stored = dict(cursor.fetchall())
+            
+            incoming = {e['deadline_id']: e for e in events}
+            added = [e for deadline_id, e in incoming.items() if deadline_id not in stored]
+            updated = [e for deadline_id, e in incoming.items()
+                       if deadline_id in stored and stored[deadline_id] != e['version']]
+            removed = [deadline_id for deadline_id in stored if deadline_id not in incoming]
+            
+            cursor.executemany("""
+                INSERT INTO deadlines (deadline_id, title, description, deadline_date, lms_name,
+                                       source, location, calendar_version, recurrence)
+                VALUES (?, ?, ?, ?, ?, 'calendar', ?, ?, ?)
+            """, [(e['deadline_id'], e['title'], e['description'], e['deadline_date'], lms_name,
+                   e['location'], e['version'], e.get('recurrence')) for e in added])
+            
+            # An edited title may name another course, so updated rows are linked again below
+            cursor.executemany("""
+                UPDATE deadlines
+                SET title = ?, description = ?, deadline_date = ?, location = ?, calendar_version = ?,
+                    recurrence = ?, course_id = NULL
+                WHERE deadline_id = ?
+            """, [(e['title'], e['description'], e['deadline_date'], e['location'], e['version'],
+                   e.get('recurrence'), e['deadline_id']) for e in updated])
+            
+            cursor.executemany("DELETE FROM deadlines WHERE deadline_id = ?", [(d,) for d in removed])
+            
+            self._link_calendar_deadlines(cursor, lms_name)
+            self._cluster_deadlines(cursor)
+            
+            conn.commit()
+        finally:
+            # A sync that fails part-way is rolled back here, so the next write can't commit half of it
+            conn.close()
+        
+        return {
+            'added': len(added),
+            'updated': len(updated),
+            'removed': len(removed),
+            'unchanged': len(incoming) - len(added) - len(updated)
+        }
+    
+    def _course_code_index(self, cursor, lms_name: str):
+        """
+        Index the course codes found in an LMS's course names. Returns one compiled
+        pattern matching any known code (or None if there are none) and {code: course_id}.
+        """
+        cursor.execute("SELECT course_id, course_name FROM courses WHERE lms_name = ? ORDER BY id", (lms_name,))
+        
+        course_ids = {}
+        for course_id, course_name in cursor.fetchall():
+            for code in COURSE_CODE_PATTERN.findall(course_name or ''):
+                course_ids.setdefault(code, course_id)
+        
+        if not course_ids:
+            return None, course_ids
+        codes = sorted((re.escape(code) for code in course_ids), key=len, reverse=True)
+        return re.compile(r'\b(' + '|'.join(codes) + r')\b'), course_ids
+    
+    def _link_calendar_deadlines(self, cursor, lms_name: str) -> int:
+        """Set course_id on this LMS's unlinked calendar deadlines whose title names a known course code."""
+        pattern, course_ids = self._course_code_index(cursor, lms_name)
+        if not pattern:
+            return 0
+        
+        cursor.execute("""
+            SELECT deadline_id, title FROM deadlines
+            WHERE source = 'calendar' AND lms_name = ? AND course_id IS NULL
+        """, (lms_name,))
+        
+        links = []
+        for deadline_id, title in cursor.fetchall():
+            match = pattern.search(title or '')
+            if match:
+                links.append((course_ids[match.group(1)], deadline_id))
+        
+        cursor.executemany("UPDATE deadlines SET course_id = ? WHERE deadline_id = ?", links)
+        return len(links)
+    
+    def link_calendar_deadlines(self, lms_name: str) -> int:
+        """
+        Link unlinked calendar deadlines of an LMS to its courses by course code, e.g.
+        after new courses were discovered. Returns how many were linked.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        linked = self._link_calendar_deadlines(cursor, lms_name)
+        
+        conn.commit()
+        conn.close()
+        return linked
+    
+    def get_calendar_feed_state(self, lms_name: str) -> Optional[Dict[str, Any]]:
+        """Get the stored URL, ETag, Last-Modified and content hash of a calendar feed."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            SELECT url, etag, last_modified, content_hash, fetched_at
+            FROM calendar_feed_state WHERE lms_name = ?
+        """, (lms_name,))
+        row = cursor.fetchone()
+        conn.close()
+        
+        if not row:
+            return None
+        return dict(zip(('url', 'etag', 'last_modified', 'content_hash', 'fetched_at'), row))
+    
+    def save_calendar_feed_state(self, lms_name: str, url: str, etag: str = None,
+                                 last_modified: str = None, content_hash: str = None):
+        """Store the validators of a calendar feed after a successful sync."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            INSERT INTO calendar_feed_state (lms_name, url, etag, last_modified, content_hash)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(lms_name) DO UPDATE SET
+                url = excluded.url,
+                etag = excluded.etag,
+                last_modified = excluded.last_modified,
+                content_hash = excluded.content_hash,
+                fetched_at = CURRENT_TIMESTAMP
+        """, (lms_name, url, etag, last_modified, content_hash))
         
         conn.commit()
         conn.close()
     
-    def delete_calendar_events(self):
-        """Delete all calendar events from deadlines table."""
+    def _cluster_deadlines(self, cursor) -> int:
+        """
+        Group the activity deadlines, calendar events and scraped deadlines that
+        describe the same real deadline, and store each group's cluster ID (the ID
+        of its preferred row, see DEADLINE_SOURCE_PRIORITY). Rows are bucketed by
+        course (or LMS, for calendar events without a course), day and title token,
+        so titles are only compared with those sharing a bucket nearby rather than
+        with every other row. Only deadlines from DEADLINE_CLUSTER_LOOKBACK_DAYS ago
+        on are re-clustered; older ones keep their stored cluster. Returns the
+        number of clusters.
+        """
+        # ISO dates compare as text; a day's margin covers due times in any UTC offset
+        since = (datetime.now(timezone.utc) - timedelta(days=DEADLINE_CLUSTER_LOOKBACK_DAYS + 1)).date().isoformat()
+        cursor.execute("""
+            SELECT a.activity_id, 'activity', a.title, a.deadline, a.course_id, c.lms_name
+            FROM activities a
+            JOIN courses c ON a.course_id = c.course_id
+            WHERE a.deadline >= ? AND a.removed_at IS NULL
+            UNION ALL
+            SELECT deadline_id, source, title, deadline_date, course_id, lms_name
+            FROM deadlines
+            WHERE recurrence IS NULL AND deadline_date >= ?
+        """, (since, since))
+        
+        items = []
+        for item_id, source, title, due, course_id, lms_name in cursor.fetchall():
+            try:
+                day = datetime.fromisoformat(due).astimezone(timezone.utc).date().toordinal()
+            except (TypeError, ValueError):
+                continue  # free-text due dates can't be compared
+            items.append((item_id, source, deadline_title_tokens(title), day, course_id, lms_name))
+        
+        # Hash index: (course or LMS, day, title token) -> items. Matching titles always share
+        # a token. Calendar events without a course are compared with everything in their
+        # LMS; linked rows only within their course.
+        buckets = {}
+        for index, (_, _, tokens, day, course_id, lms_name) in enumerate(items):
+            for token in tokens:
+                if course_id:
+                    buckets.setdefault(('course', course_id, day, token), []).append(index)
+                buckets.setdefault(('lms', lms_name, day, token), []).append(index)
+        
+        parent = list(range(len(items)))
+        sources = [{item[1]} for item in items]
+        
+        def find(index):
+            while parent[index] != index:
+                parent[index] = parent[parent[index]]
+                index = parent[index]
+            return index
+        
+        for index, (_, _, tokens, day, course_id, lms_name) in enumerate(items):
+            scope = ('course', course_id) if course_id else ('lms', lms_name)
+            # Due times near midnight can land on neighbouring UTC days in different sources
+            candidates = {other for neighbour_day in (day - 1, day, day + 1) for token in tokens
+                          for other in buckets.get(scope + (neighbour_day, token), ())}
+            for other in candidates:
+                # Two rows of one source are two deadlines, however alike, so a cluster
+                # takes at most one of each (an unlinked event can't join two courses' TMAs)
+                root, other_root = find(index), find(other)
+                if root == other_root or sources[root] & sources[other_root]:
+                    continue
+                if same_deadline_title(tokens, items[other][2]):
+                    parent[other_root] = root
+                    sources[root] |= sources[other_root]
+        
+        clusters = {}
+        for index in range(len(items)):
+            clusters.setdefault(find(index), []).append(items[index])
+        
+        activity_clusters = []
+        deadline_clusters = []
+        for members in clusters.values():
+            if len(members) < 2:
+                continue
+            preferred = min(members, key=lambda m: (DEADLINE_SOURCE_PRIORITY.get(m[1], 9), m[0]))
+            for member in members:
+                target = activity_clusters if member[1] == 'activity' else deadline_clusters
+                target.append((preferred[0], member[0]))
+        
+        cursor.execute("""
+            UPDATE activities SET deadline_cluster = NULL
+            WHERE deadline_cluster IS NOT NULL AND (deadline >= ? OR removed_at IS NOT NULL)
+        """, (since,))
+        cursor.execute("UPDATE deadlines SET cluster_id = NULL WHERE cluster_id IS NOT NULL AND deadline_date >= ?",
+                       (since,))
+        cursor.executemany("UPDATE activities SET deadline_cluster = ? WHERE activity_id = ?", activity_clusters)
+        cursor.executemany("UPDATE deadlines SET cluster_id = ? WHERE deadline_id = ?", deadline_clusters)
+        
+        return sum(1 for members in clusters.values() if len(members) > 1)
+    
+    def cluster_deadlines(self) -> int:
+        """De-duplicate deadlines across sources (see _cluster_deadlines). Run after deadlines are stored."""
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute("DELETE FROM deadlines WHERE source = 'calendar'")
+        clusters = self._cluster_deadlines(cursor)
         
         conn.commit()
         conn.close()
+        return clusters
+    
+    def _collapse_deadline_clusters(self, deadlines: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Keep the preferred row of each deadline cluster (rows without a cluster are kept as they are)."""
+        preferred = {}
+        collapsed = []
+        for deadline in deadlines:
+            cluster_id = deadline.pop('cluster_id', None)
+            if not cluster_id:
+                collapsed.append(deadline)
+            elif cluster_id not in preferred or (DEADLINE_SOURCE_PRIORITY.get(deadline['source'], 9) <
+                                                 DEADLINE_SOURCE_PRIORITY.get(preferred[cluster_id]['source'], 9)):
+                preferred[cluster_id] = deadline
+        
+        return collapsed + list(preferred.values())
+    
+    def _recurring_deadlines(self, cursor, days_ahead: int) -> List[Dict[str, Any]]:
+        """
+        Expand the recurring calendar events into one deadline per occurrence in
+        the next days_ahead days. Each event is stored once with its rules; the
+        window is rounded to the hour so repeated queries reuse cached expansions.
+        """
+        cursor.execute("""
+            SELECT 
+                deadline_id as id,
+                title,
+                description,
+                deadline_date,
+                '' as url,
+                COALESCE((SELECT course_name FROM courses WHERE course_id = d.course_id), '') as course_name,
+                lms_name,
+                source,
+                location,
+                recurrence
+            FROM deadlines d
+            WHERE recurrence IS NOT NULL
+        """)
+        columns = [desc[0] for desc in cursor.description]
+        
+        now = datetime.now(timezone.utc)
+        window_start = now.replace(minute=0, second=0, microsecond=0)
+        window_end = window_start + timedelta(days=days_ahead, hours=1)
+        
+        occurrences = []
+        for row in cursor.fetchall():
+            event = dict(zip(columns, row))
+            recurrence = event.pop('recurrence')
+            for when in expand_recurrence(event['deadline_date'], recurrence, window_start, window_end):
+                if now <= when <= now + timedelta(days=days_ahead):
+                    occurrences.append({**event, 'id': f"{event['id']}_{when:%Y%m%dT%H%M}",
+                                        'deadline_date': when.isoformat()})
+        
+        return occurrences
     
     def get_all_upcoming_deadlines(self, days_ahead: int = 30):
         """Get all upcoming deadlines from both activities and calendar events."""
@@ -490,11 +2040,13 @@ class Database:
                 c.course_name,
                 c.lms_name,
                 'activity' as source,
-                '' as location
+                '' as location,
+                a.deadline_cluster as cluster_id
             FROM activities a
             JOIN courses c ON a.course_id = c.course_id
             WHERE a.deadline IS NOT NULL
             AND a.deadline != ''
+            AND a.removed_at IS NULL
             AND datetime(a.deadline) >= datetime('now')
             AND datetime(a.deadline) <= datetime('now', '+' || ? || ' days')
         """, (days_ahead,))
@@ -513,19 +2065,22 @@ class Database:
                 COALESCE((SELECT course_name FROM courses WHERE course_id = d.course_id), '') as course_name,
                 lms_name,
                 source,
-                location
+                location,
+                cluster_id
             FROM deadlines d
-            WHERE datetime(deadline_date) >= datetime('now')
+            WHERE recurrence IS NULL
+            AND datetime(deadline_date) >= datetime('now')
             AND datetime(deadline_date) <= datetime('now', '+' || ? || ' days')
         """, (days_ahead,))
         
         calendar_deadlines = [dict(zip([desc[0] for desc in cursor.description], row)) 
                              for row in cursor.fetchall()]
+        calendar_deadlines += self._recurring_deadlines(cursor, days_ahead)
         
         conn.close()
         
-        # Combine and sort by date
-        all_deadlines = activity_deadlines + calendar_deadlines
+        # Combine, keeping one row per real deadline, and sort by date
+        all_deadlines = self._collapse_deadline_clusters(activity_deadlines + calendar_deadlines)
         all_deadlines.sort(key=lambda x: x.get('deadline_date', ''))
         
         return all_deadlines
@@ -554,26 +2109,28 @@ class Database:
         
         conn.close()
         return history
-
+    
     
     def add_deadline(self, deadline_id: str, title: str, deadline_date: str, 
                     lms_name: str, description: str = None, course_id: str = None,
-                    activity_id: str = None, source: str = 'scraped', location: str = None):
-        """Add or update a deadline."""
+                    activity_id: str = None, source: str = 'scraped', location: str = None,
+                    text_hash: str = None):
+        """Add or update a deadline. text_hash identifies the text a scraped deadline came from."""
         conn = self.get_connection()
         cursor = conn.cursor()
         
         cursor.execute("""
             INSERT INTO deadlines (deadline_id, title, description, deadline_date, 
-                                  lms_name, course_id, activity_id, source, location)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                                  lms_name, course_id, activity_id, source, location, text_hash)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             ON CONFLICT(deadline_id) DO UPDATE SET
                 title = excluded.title,
                 description = excluded.description,
                 deadline_date = excluded.deadline_date,
-                location = excluded.location
+                location = excluded.location,
+                text_hash = excluded.text_hash
         """, (deadline_id, title, description, deadline_date, lms_name, 
-              course_id, activity_id, source, location))
+              course_id, activity_id, source, location, text_hash))
         
         conn.commit()
         conn.close()
@@ -594,11 +2151,13 @@ class Database:
                 c.course_name,
                 c.lms_name,
                 'activity' as source,
-                '' as location
+                '' as location,
+                a.deadline_cluster as cluster_id
             FROM activities a
             JOIN courses c ON a.course_id = c.course_id
             WHERE a.deadline IS NOT NULL
             AND a.deadline != ''
+            AND a.removed_at IS NULL
             AND datetime(a.deadline) >= datetime('now')
             AND datetime(a.deadline) <= datetime('now', '+' || ? || ' days')
         """, (days_ahead,))
@@ -617,19 +2176,22 @@ class Database:
                 COALESCE((SELECT course_name FROM courses WHERE course_id = d.course_id), '') as course_name,
                 lms_name,
                 source,
-                location
+                location,
+                cluster_id
             FROM deadlines d
-            WHERE datetime(deadline_date) >= datetime('now')
+            WHERE recurrence IS NULL
+            AND datetime(deadline_date) >= datetime('now')
             AND datetime(deadline_date) <= datetime('now', '+' || ? || ' days')
         """, (days_ahead,))
         
         calendar_deadlines = [dict(zip([desc[0] for desc in cursor.description], row)) 
                              for row in cursor.fetchall()]
+        calendar_deadlines += self._recurring_deadlines(cursor, days_ahead)
         
         conn.close()
         
-        # Combine and sort by date
-        all_deadlines = activity_deadlines + calendar_deadlines
+        # Combine, keeping one row per real deadline, and sort by date
+        all_deadlines = self._collapse_deadline_clusters(activity_deadlines + calendar_deadlines)
         all_deadlines.sort(key=lambda x: x.get('deadline_date', ''))
         
         return all_deadlines
@@ -0,0 +1,179 @@
+"""
+Deadline date extraction for LMS Activity Monitor
+Finds due dates in activity titles and descriptions with a single precompiled
+pattern, and works on a whole batch of texts (e.g. every activity of a course)
+in one regex pass. ExtractionCache remembers the results by text hash, so text
+seen on an earlier scan is not extracted again.
+"""
+
+import re
+import hashlib
+from bisect import bisect_right
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import List, Iterable, Optional
+
+# Month names as written in activity texts (full and abbreviated)
+MONTHS = {
+    'january': 1, 'february': 2, 'march': 3, 'april': 4,
+    'may': 5, 'june': 6, 'july': 7, 'august': 8,
+    'september': 9, 'october': 10, 'november': 11, 'december': 12,
+    'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'jun': 6,
+    'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12
+}
+
+_KEYWORD = (r'(?:by|before|due on|due|deadline|submit by)\s*:?\s*'
+            r'(?:monday|tuesday|wednesday|thursday|friday|saturday|sunday)?,?\s*')
+
+# Dates introduced by a keyword such as "due" or "deadline"; these win over bare dates
+KEYWORD_PATTERNS = {
+    'dmy': _KEYWORD + r'(?P<dmy_d>\d{1,2})[/-](?P<dmy_m>\d{1,2})[/-](?P<dmy_y>\d{4})',  # by 15/10/2025
+    'ymd': _KEYWORD + r'(?P<ymd_y>\d{4})[/-](?P<ymd_m>\d{1,2})[/-](?P<ymd_d>\d{1,2})',  # due 2025-10-15
+    'dmony': (_KEYWORD + r'(?P<dmony_d>\d{1,2})(?:st|nd|rd|th)?\s+'
+              r'(?P<dmony_m>[A-Za-z]+)\s+(?P<dmony_y>\d{4})'),  # Due: Sunday, 19 October 2025
+    'label': r'(?:deadline|due date)\s*:\s*(?P<label_y>\d{4})[/-](?P<label_m>\d{1,2})[/-](?P<label_d>\d{1,2})',
+}
+
+# Bare YYYY-MM-DD dates, only used when a text has no keyword date
+FALLBACK_PATTERNS = {
+    'bare': r'\b(?P<bare_y>\d{4})[/-](?P<bare_m>\d{1,2})[/-](?P<bare_d>\d{1,2})\b',
+}
+
+PATTERN_NAMES = tuple(KEYWORD_PATTERNS) + tuple(FALLBACK_PATTERNS)
+
+# One pass finds every pattern: at each position that could start a date, a lookahead
+# per pattern records where that pattern matches. Lookaheads don't consume text, so
+# the patterns can overlap each other exactly as if each were run on its own. The
+# leading character class is a cheap first filter, and the trailing conditional
+# rejects positions where no pattern matched, so finditer() only stops at dates.
+_DATE_RE = re.compile(
+    r'(?=[bds\d])(?=by|before|due|deadline|submit|\b\d)'
+    + ''.join(f'(?=(?P<{name}>{pattern})?)'
+              for name, pattern in {**KEYWORD_PATTERNS, **FALLBACK_PATTERNS}.items())
+    + ''.join(f'(?({name})|' for name in PATTERN_NAMES) + '(?!)' + ')' * len(PATTERN_NAMES),
+    re.IGNORECASE
+)
+
+# Joins the texts of a batch; no pattern can match across it
+_SEPARATOR = '\x00'
+
+
+def _match_to_date(match, name: str) -> Optional[datetime]:
+    """Build the date found by one pattern, or None if it isn't a real date."""
+    day, month, year = match.group(f'{name}_d', f'{name}_m', f'{name}_y')
+    if name == 'dmony':
+        month = MONTHS.get(month.lower())
+        if not month:
+            return None
+    try:
+        return datetime(int(year), int(month), int(day), tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+
+def extract_dates_batch(texts: Iterable[str]) -> List[List[datetime]]:
+    """
+    Extract dates from many texts at once. Returns one list per text, newest
+    date first (usually the deadline). Dates introduced by a keyword ("due",
+    "deadline", "submit by", ...) are preferred; bare YYYY-MM-DD dates are only
+    returned for texts without any.
+    """
+    texts = [text or '' for text in texts]
+    starts = []
+    offset = 0
+    for text in texts:
+        starts.append(offset)
+        offset += len(text) + len(_SEPARATOR)
+    
+    keyword_dates = [set() for _ in texts]
+    fallback_dates = [set() for _ in texts]
+    # Like finditer() for each pattern alone: a match may not start inside that pattern's previous one
+    resume_at = dict.fromkeys(PATTERN_NAMES, 0)
+    
+    for match in _DATE_RE.finditer(_SEPARATOR.join(texts)):
+        position = match.start()
+        index = None
+        for name in PATTERN_NAMES:
+            if match.group(name) is None or position < resume_at[name]:
+                continue
+            resume_at[name] = match.end(name)
+            
+            date = _match_to_date(match, name)
+            if date:
+                if index is None:
+                    index = bisect_right(starts, position) - 1
+                (fallback_dates if name in FALLBACK_PATTERNS else keyword_dates)[index].add(date)
+    
+    return [sorted(found or fallback, reverse=True)
+            for found, fallback in zip(keyword_dates, fallback_dates)]
+
+
+def extract_dates(text: str) -> List[datetime]:
+    """Extract dates from one activity text, newest first."""
+    return extract_dates_batch([text])[0]
+
+
+def text_hash(text: str) -> str:
+    """
+    Hash an activity text for the extraction cache. Only surrounding whitespace is
+    normalized away: inside the text it can decide whether a date matches ("due on").
+    """
+    return hashlib.sha1((text or '').strip().encode()).hexdigest()
+
+
+class ExtractionCache:
+    """
+    Memoizes extract_dates_batch() by text hash: an in-memory LRU in front of the
+    deadline_extractions table, so results survive between scans.
+    """
+    
+    def __init__(self, db, size: int = 5000, max_age_days: int = 30):
+        self.db = db
+        self.size = size
+        self.max_age_days = max_age_days
+        self._recent = OrderedDict()
+        self._pruned = False
+    
+    def extract_batch(self, texts: Iterable[str]) -> List[List[datetime]]:
+        """Same as extract_dates_batch(), extracting only texts not seen before."""
+        texts = list(texts)
+        hashes = [text_hash(text) for text in texts]
+        
+        results = {}
+        for digest in hashes:
+            if digest in self._recent:
+                self._recent.move_to_end(digest)
+                results[digest] = self._recent[digest]
+        
+        missing = list(dict.fromkeys(digest for digest in hashes if digest not in results))
+        if missing:
+            for digest, dates in self.db.get_cached_extractions(missing).items():
+                results[digest] = [datetime.fromisoformat(date) for date in dates]
+        
+        new = {}
+        for text, digest in zip(texts, hashes):
+            if digest not in results and digest not in new:
+                new[digest] = text
+        if new:
+            for digest, dates in zip(new, extract_dates_batch(new.values())):
+                results[digest] = dates
+            self._prune()
+            self.db.save_cached_extractions({digest: [date.isoformat() for date in results[digest]]
+                                             for digest in new})
+        
+        for digest in missing:
+            self._remember(digest, results[digest])
+        
+        return [list(results[digest]) for digest in hashes]
+    
+    def _remember(self, digest: str, dates: List[datetime]):
+        self._recent[digest] = dates
+        self._recent.move_to_end(digest)
+        while len(self._recent) > self.size:
+            self._recent.popitem(last=False)
+    
+    def _prune(self):
+        """Drop stored results older than max_age_days, once per cache, before the first save."""
+        if not self._pruned:
+            self.db.prune_cached_extractions(self.max_age_days)
+            self._pruned = True
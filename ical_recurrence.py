@@ -0,0 +1,105 @@
+"""
+iCalendar content-line and recurrence helpers for LMS Activity Monitor
+Shared by the calendar feed parser and the database, which expands stored
+recurrence rules at query time; no network or database access.
+"""
+
+import re
+from datetime import datetime, date, timezone
+from functools import lru_cache
+from typing import Dict, Optional
+
+from icalendar.prop import vDDDTypes
+from dateutil.rrule import rrulestr, rruleset
+
+# One ;NAME=value parameter of a content line; a quoted value may contain ; , and :
+_PARAMETER = re.compile(r';([^=;:]+)=((?:"[^"]*"|[^;:"])*)')
+
+
+def split_content_line(line: bytes):
+    """Split an unfolded content line into (NAME, {PARAM: value}, value)."""
+    text = line.decode('utf-8', errors='replace')
+    
+    # The value starts at the first colon that is not inside a quoted parameter value
+    in_quotes = False
+    for i, char in enumerate(text):
+        if char == '"':
+            in_quotes = not in_quotes
+        elif char == ':' and not in_quotes:
+            break
+    else:
+        return text.upper(), {}, ''
+    
+    # Parameter values may be DQUOTE-quoted (TZID="Asia/Colombo") and then contain ; or :
+    name = text[:i].split(';', 1)[0]
+    params = {key.upper(): value.replace('"', '')
+              for key, value in _PARAMETER.findall(text, len(name), i)}
+    return name.upper(), params, text[i + 1:]
+
+
+def ical_datetime(params: Dict[str, str], value: str):
+    """Parse a DATE / DATE-TIME property value; floating or unknown-zone times are taken as UTC."""
+    try:
+        parsed = vDDDTypes.from_ical(value, timezone=params.get('TZID'))
+    except Exception:
+        parsed = vDDDTypes.from_ical(value)
+    if isinstance(parsed, datetime) and parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def ical_start(params: Dict[str, str], value: str) -> datetime:
+    """Parse a DTSTART (or RECURRENCE-ID); all-day dates become midnight UTC."""
+    start = ical_datetime(params, value)
+    if not isinstance(start, datetime):
+        start = datetime.combine(start, datetime.min.time()).replace(tzinfo=timezone.utc)
+    return start
+
+
+def recurrence_set(start: datetime, recurrence: str) -> rruleset:
+    """
+    Build the occurrences of a recurring event from DTSTART and its stored
+    RRULE / RDATE / EXDATE lines. Floating or date-only UNTIL values are taken
+    as UTC, like other floating times in the feed.
+    """
+    rules = rruleset()
+    rules.rdate(start)  # DTSTART is always the first instance
+    
+    for line in recurrence.splitlines():
+        name, params, value = split_content_line(line.encode('utf-8'))
+        if name == 'RRULE':
+            value = re.sub(r'UNTIL=(\d{8})(?=;|$)', r'UNTIL=\1T235959Z', value)
+            value = re.sub(r'UNTIL=(\d{8}T\d{6})(?=;|$)', r'UNTIL=\1Z', value)
+            rules.rrule(rrulestr(value, dtstart=start))
+        elif name in ('RDATE', 'EXDATE'):
+            for item in value.split(','):
+                # RDATE may be a PERIOD (start/end); only its start matters here
+                moment = ical_datetime(params, item.split('/')[0])
+                if isinstance(moment, date) and not isinstance(moment, datetime):
+                    moment = datetime.combine(moment, start.timetz())
+                (rules.rdate if name == 'RDATE' else rules.exdate)(moment)
+    
+    return rules
+
+
+def next_occurrence(start: datetime, recurrence: str, after: datetime) -> Optional[datetime]:
+    """First occurrence of a recurring event after the given time, or None (also for unreadable rules)."""
+    try:
+        return recurrence_set(start, recurrence).after(after)
+    except (ValueError, TypeError) as e:
+        print(f"Skipping unreadable recurrence rule: {e}")
+        return None
+
+
+@lru_cache(maxsize=1024)
+def expand_recurrence(start: str, recurrence: str, window_start: datetime, window_end: datetime) -> tuple:
+    """
+    Occurrences of a stored recurring event (ISO DTSTART + recurrence lines)
+    within a window. Expansions are cached per window, so callers should round
+    the window (e.g. to the hour) to reuse them between queries.
+    """
+    try:
+        return tuple(recurrence_set(datetime.fromisoformat(start), recurrence)
+                     .between(window_start, window_end, inc=True))
+    except (ValueError, TypeError):
+        return ()
@@ -0,0 +1,383 @@
+"""
+Moodle page parsers for LMS Activity Monitor
+Pure HTML -> data functions with no browser or database access, so the scraper
+can run them in worker processes while the browser fetches the next page.
+"""
+
+import re
+import hashlib
+from datetime import datetime, timezone, timedelta
+from typing import List, Dict, Any, Optional
+from urllib.parse import urljoin
+from bs4 import BeautifulSoup
+
+# Both Moodle sites render dates in Asia/Colombo time (GMT+5:30, no DST)
+LMS_TIMEZONE = timezone(timedelta(hours=5, minutes=30))
+
+# Module index pages that list every instance in a course with its exact due date,
+# keyed by the header text of the date column
+DEADLINE_INDEX_COLUMNS = {
+    'assign': 'due',
+    'quiz': 'close'
+}
+
+
+def extract_cmid(url: str) -> Optional[str]:
+    """Extract the Moodle course-module ID from a mod/*/view.php URL."""
+    match = re.search(r'/mod/\w+/view\.php\?(?:.*&)?id=(\d+)', url or '')
+    return match.group(1) if match else None
+
+
+def module_activity_id(course_id: str, cmid: str) -> str:
+    """Activity ID of a course module: the site prefix of its course plus the cmid."""
+    return f"{course_id.split('_')[0]}_cm_{cmid}"
+
+
+def stable_activity_id(course_id: str, url: str) -> Optional[str]:
+    """
+    Build an activity ID from Moodle's own identifiers: the course-module ID in
+    mod/*/view.php?id=<cmid> links, or the discussion ID for forum posts. These
+    survive renames, unlike a hash of the title. Returns None if the URL has neither.
+    """
+    cmid = extract_cmid(url)
+    if cmid:
+        return module_activity_id(course_id, cmid)
+    
+    discussion_match = re.search(r'/mod/forum/discuss\.php\?(?:.*&)?d=(\d+)', url or '')
+    if discussion_match:
+        return f"{course_id.split('_')[0]}_d_{discussion_match.group(1)}"
+    
+    return None
+
+
+def generate_activity_id(course_id: str, title: str, activity_type: str, url: str = None) -> str:
+    """
+    Generate a unique ID for an activity. Uses the Moodle cmid (or discussion ID
+    for forum posts) from the URL when there is one, so renamed items keep their ID.
+    """
+    moodle_id = stable_activity_id(course_id, url)
+    if moodle_id:
+        return moodle_id
+    
+    unique_string = f"{course_id}_{title}_{activity_type}"
+    return hashlib.md5(unique_string.encode()).hexdigest()
+
+
+def activity_fingerprint(activity: Dict[str, Any]) -> str:
+    """Hash the visible fields of an activity so edits can be detected."""
+    parts = [activity.get(key) or '' for key in ('type', 'title', 'description', 'url', 'deadline')]
+    return hashlib.md5('\x1f'.join(parts).encode()).hexdigest()
+
+
+def parse_moodle_date(text: str) -> Optional[datetime]:
+    """
+    Parse a Moodle userdate such as "Friday, 17 October 2025, 11:59 PM"
+    (site time) into an aware UTC datetime. Returns None for "-" or anything else.
+    """
+    text = re.sub(r'\s+', ' ', text or '').strip()
+    for fmt in ('%A, %d %B %Y, %I:%M %p', '%A, %d %B %Y, %H:%M',
+                '%d %B %Y, %I:%M %p', '%d %B %Y, %H:%M'):
+        try:
+            local = datetime.strptime(text, fmt).replace(tzinfo=LMS_TIMEZONE)
+            return local.astimezone(timezone.utc)
+        except ValueError:
+            continue
+    return None
+
+
+def parse_course_page(html: str, course_url: str, course_id: str) -> List[Dict[str, Any]]:
+    """Parse all activities listed on a course page."""
+    soup = BeautifulSoup(html, 'html.parser')
+    activities = []
+    
+    # Find all activity items
+    activity_items = soup.find_all('li', class_=re.compile(r'activity|modtype'))
+    
+    for item in activity_items:
+        try:
+            # Extract activity type
+            activity_type = 'unknown'
+            classes = item.get('class', [])
+            for cls in classes:
+                if 'modtype_' in cls:
+                    activity_type = cls.replace('modtype_', '')
+                    break
+            
+            # The module's own link: the description can link to other modules
+            link = item.find('a', href=re.compile(rf'/mod/{re.escape(activity_type)}/')) or item.find('a', href=True)
+            if not link:
+                continue
+            
+            title = link.get_text(strip=True)
+            url = link.get('href')
+            
+            if url.startswith('/'):
+                base_url = course_url.split('/course/')[0]
+                url = base_url + url
+            
+            # Try to find description
+            description = ''
+            desc_div = item.find('div', class_=re.compile(r'description|summary'))
+            if desc_div:
+                description = desc_div.get_text(strip=True)
+            
+            # Try to find deadline
+            deadline = None
+            deadline_spans = item.find_all('span', class_=re.compile(r'due|deadline'))
+            for span in deadline_spans:
+                deadline_text = span.get_text(strip=True)
+                if deadline_text:
+                    deadline = deadline_text
+                    break
+            
+            # The course-module ID Moodle renders on the <li> itself is the surest of all
+            module = re.fullmatch(r'module-(\d+)', item.get('id') or '')
+            if module:
+                activity_id = module_activity_id(course_id, module.group(1))
+            else:
+                activity_id = generate_activity_id(course_id, title, activity_type, url)
+            
+            activities.append({
+                'activity_id': activity_id,
+                'type': activity_type,
+                'title': title,
+                'url': url,
+                'description': description,
+                'deadline': deadline
+            })
+        
+        except Exception:
+            continue
+    
+    return activities
+
+
+def parse_module_index(html: str, modname: str, column: str, index_url: str) -> Dict[str, Optional[str]]:
+    """
+    Parse {cmid: due date} from an assignment or quiz index table. Links are
+    resolved against index_url first: the quiz index links to a relative view.php.
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    due_dates = {}
+    
+    for table in soup.find_all('table', class_=re.compile(r'generaltable')):
+        headers = [th.get_text(strip=True).lower() for th in table.find_all('th')]
+        due_col = next((i for i, h in enumerate(headers) if column in h), None)
+        if due_col is None:
+            continue
+        
+        for row in table.find_all('tr'):
+            cells = row.find_all(['td', 'th'])
+            if len(cells) <= due_col:
+                continue
+            
+            hrefs = (urljoin(index_url, a['href']) for a in row.find_all('a', href=True))
+            cmid = next((extract_cmid(href) for href in hrefs if f'/mod/{modname}/view.php' in href), None)
+            if not cmid:
+                continue
+            
+            due = parse_moodle_date(cells[due_col].get_text(' ', strip=True))
+            due_dates[cmid] = due.isoformat() if due else None
+    
+    return due_dates
+
+
+def forum_name_key(name: str) -> str:
+    """Normalize a forum name for matching course-page forums against forum index rows."""
+    return re.sub(r'\s+', '', name or '').lower()
+
+
+def parse_forum_index(html: str) -> Dict[str, tuple]:
+    """
+    Parse the discussion/unread counts of each forum from a forum index page.
+    The index links forums as view.php?f=<forum instance id>, which the course
+    page never shows, so rows are keyed by forum_name_key(name) instead. A name
+    used by two forums is left out, so both of those forums are always visited.
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    counts = {}
+    ambiguous = set()
+    
+    for table in soup.find_all('table', class_=re.compile(r'generaltable')):
+        headers = [th.get_text(strip=True).lower() for th in table.find_all('th')]
+        discussions_col = next((i for i, h in enumerate(headers) if 'discussion' in h), None)
+        name_col = next((i for i, h in enumerate(headers) if 'forum' in h), None)
+        if discussions_col is None or name_col is None:
+            continue
+        unread_col = next((i for i, h in enumerate(headers) if 'unread' in h), None)
+        
+        for row in table.find_all('tr'):
+            cells = row.find_all('td')
+            if len(cells) <= max(discussions_col, name_col):
+                continue
+            
+            key = forum_name_key(cells[name_col].get_text(strip=True))
+            if not key:
+                continue
+            
+            def cell_number(col):
+                if col is None or col >= len(cells):
+                    return 0
+                number = re.search(r'\d+', cells[col].get_text(strip=True))
+                return int(number.group()) if number else 0
+            
+            if key in counts:
+                ambiguous.add(key)
+            counts[key] = (cell_number(discussions_col), cell_number(unread_col))
+    
+    for key in ambiguous:
+        del counts[key]
+    return counts
+
+
+def forum_index_counts(title: str, index_counts: Dict[str, tuple]) -> Optional[tuple]:
+    """The forum index counts for a forum activity on the course page, or None if it has no row."""
+    key = forum_name_key(title)
+    if key in index_counts:
+        return index_counts[key]
+    # Course pages append a hidden " Forum" type label to the activity link text
+    if key.endswith('forum') and key[:-len('forum')] in index_counts:
+        return index_counts[key[:-len('forum')]]
+    return None
+
+
+def parse_forum_discussions(html: str, forum_url: str, page: int = 0):
+    """
+    Parse the discussions listed on one page of a forum.
+    Returns (discussions, has_next_page).
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    base_url = forum_url.split('/mod/forum')[0]
+    
+    # Find discussion/announcement items
+    # Moodle uses different selectors for discussions
+    discussions = []
+    
+    # Try standard discussion table
+    discussion_table = soup.find('table', class_=re.compile(r'discussion|forumheaderlist'))
+    if discussion_table:
+        rows = discussion_table.find_all('tr', class_=re.compile(r'discussion'))
+        for row in rows:
+            try:
+                # Find discussion link
+                link = row.find('a', href=re.compile(r'/mod/forum/discuss\.php'))
+                if not link:
+                    continue
+                
+                post_title = link.get_text(strip=True)
+                post_url = link.get('href')
+                
+                # Make URL absolute
+                if post_url.startswith('/'):
+                    post_url = base_url + post_url
+                
+                # Try to find author and date
+                author = ''
+                post_date = ''
+                
+                author_cell = row.find('td', class_=re.compile(r'author|picture'))
+                if author_cell:
+                    author_link = author_cell.find('a')
+                    if author_link:
+                        author = author_link.get_text(strip=True)
+                
+                date_cell = row.find('td', class_=re.compile(r'lastpost|created'))
+                if date_cell:
+                    post_date = date_cell.get_text(strip=True)
+                
+                discussions.append({
+                    'title': post_title,
+                    'url': post_url,
+                    'author': author,
+                    'date': post_date,
+                    'pinned': is_pinned_discussion(row)
+                })
+            except Exception:
+                continue
+    
+    # Alternative: Try list-based forums (newer Moodle versions)
+    if not discussions:
+        discussion_list = soup.find_all('div', class_=re.compile(r'discussion-container'))
+        for disc_div in discussion_list:
+            try:
+                link = disc_div.find('a', href=re.compile(r'/mod/forum/discuss\.php'))
+                if not link:
+                    continue
+                
+                post_title = link.get_text(strip=True)
+                post_url = link.get('href')
+                
+                if post_url.startswith('/'):
+                    post_url = base_url + post_url
+                
+                discussions.append({
+                    'title': post_title,
+                    'url': post_url,
+                    'author': '',
+                    'date': '',
+                    'pinned': is_pinned_discussion(disc_div)
+                })
+            except Exception:
+                continue
+    
+    # The paging bar links to the next page with p=<page + 1>
+    has_next_page = soup.find('a', href=re.compile(rf'[?&]p={page + 1}(?!\d)')) is not None
+    
+    return discussions, has_next_page
+
+
+def is_pinned_discussion(element) -> bool:
+    """Check whether a discussion row/container is marked as pinned."""
+    classes = element.get('class', [])
+    if any('pinned' in cls for cls in classes):
+        return True
+    return element.find(class_=re.compile(r'pinned')) is not None
+
+
+def parse_activity_details(html: str) -> str:
+    """Extract the readable text of the main region of an activity or discussion page."""
+    soup = BeautifulSoup(html, 'html.parser')
+    main = soup.find(id='region-main') or soup.find(attrs={'role': 'main'}) or soup.body
+    if not main:
+        return ''
+    
+    for tag in main.find_all(['script', 'style', 'nav', 'form']):
+        tag.decompose()
+    
+    text = re.sub(r'\s+', ' ', main.get_text(' ', strip=True))
+    return text[:5000]
+
+
+def parse_course_bundle(bundle: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Parse everything fetched for one course in a single worker call: the course
+    page, the assignment/quiz index pages (whose exact due dates replace the
+    course-page text) and the forum index. Activities come back fingerprinted.
+    """
+    activities = parse_course_page(bundle['course_html'], bundle['course_url'], bundle['course_id'])
+    
+    due_dates = {}
+    index_summary = {}
+    base_url = bundle['course_url'].split('/course/')[0]
+    for modname, html in bundle.get('index_html', {}).items():
+        index_url = f"{base_url}/mod/{modname}/index.php"
+        found = parse_module_index(html, modname, DEADLINE_INDEX_COLUMNS[modname], index_url)
+        index_summary[modname] = (sum(1 for due in found.values() if due), len(found))
+        due_dates.update(found)
+    
+    for activity in activities:
+        # An index row without a readable date ("-") keeps the course page's deadline text
+        cmid = extract_cmid(activity['url'])
+        if due_dates.get(cmid):
+            activity['deadline'] = due_dates[cmid]
+        activity['fingerprint'] = activity_fingerprint(activity)
+    
+    forum_counts = None
+    if bundle.get('forum_index_html'):
+        forum_counts = parse_forum_index(bundle['forum_index_html']) or None
+    
+    return {
+        'activities': activities,
+        'index_summary': index_summary,
+        'forum_counts': forum_counts
+    }
@@ -191,7 +191,7 @@ class Notifier:
                 activity_type = activity.get('activity_type', 'unknown').upper()
                 title = activity.get('title', 'Untitled')
                 course_name = activity.get('course_name', 'Unknown Course')
-                description = activity.get('description', '')
+                description = activity.get('details') or activity.get('description', '')
                 url = activity.get('url', '#')
                 deadline = activity.get('deadline')
                 
@@ -261,7 +261,7 @@ Scan completed at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
                 activity_type = activity.get('activity_type', 'unknown').upper()
                 title = activity.get('title', 'Untitled')
                 course_name = activity.get('course_name', 'Unknown Course')
-                description = activity.get('description', '')
+                description = activity.get('details') or activity.get('description', '')
                 url = activity.get('url', '')
                 deadline = activity.get('deadline')
                 
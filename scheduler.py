@@ -5,7 +5,6 @@ from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 from datetime import datetime
 import logging
-import hashlib
 
 from calendar_scraper import CalendarScraper
 from database import Database
@@ -21,49 +20,22 @@ class TaskScheduler:
         """Initialize the scheduler."""
         self.scheduler = BackgroundScheduler()
         self.db = Database()
-        self.calendar_scraper = CalendarScraper()
+        self.calendar_scraper = CalendarScraper(db=self.db)
     
-    def _generate_deadline_id(self, lms, date_iso, title):
-        """Generate a deterministic deadline ID using MD5 hash."""
-        content = f"{lms}_{date_iso}_{title}"
-        hash_obj = hashlib.md5(content.encode('utf-8'))
-        return f"cal_{hash_obj.hexdigest()[:16]}"
-        
     def sync_calendar_job(self):
         """Job to sync calendar events from both LMS."""
         try:
             logger.info("🗓️  Starting scheduled calendar sync...")
-            events = self.calendar_scraper.get_all_calendar_events()
-            
-            # Store calendar events in deadlines table
-            count = 0
-            within_60_days = 0
-            from datetime import timezone, timedelta
-            now = datetime.now(timezone.utc)
-            sixty_days_later = now + timedelta(days=60)
+            summary = self.calendar_scraper.sync_to_database()
             
-            for event in events:
-                deadline_id = self._generate_deadline_id(
-                    event['lms'], 
-                    event['date'].isoformat(), 
-                    event['title']
-                )
-                self.db.add_deadline(
-                    deadline_id=deadline_id,
-                    title=event['title'],
-                    description=event.get('description', ''),
-                    deadline_date=event['date'].isoformat(),
-                    lms_name=event['lms'],
-                    source='calendar',
-                    location=event.get('location', '')
-                )
-                count += 1
-                
-                # Count events within 60 days
-                if event['date'] <= sixty_days_later:
-                    within_60_days += 1
+            for lms_name in summary['unchanged_feeds']:
+                logger.info(f"⏭️  {lms_name} calendar unchanged, nothing to sync")
+            for lms_name in summary['failed_feeds']:
+                logger.warning(f"⚠️  {lms_name} calendar could not be fetched, keeping stored events")
             
-            logger.info(f"✅ Calendar sync completed! Synced {count} events ({within_60_days} within next 60 days) at {datetime.now().strftime('%Y-%m-%d %I:%M %p')}")
+            logger.info(f"✅ Calendar sync completed! Synced {summary['count']} events ({summary['within_60_days']} within next 60 days; "
+                        f"{summary['added']} added, {summary['updated']} updated, {summary['removed']} removed) "
+                        f"at {datetime.now().strftime('%Y-%m-%d %I:%M %p')}")
             
         except Exception as e:
             logger.error(f"❌ Calendar sync failed: {str(e)}")
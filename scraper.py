@@ -1,9 +1,20 @@
 import os
 import sys
 import time
+import gzip
 import hashlib
-from typing import List, Dict, Any, Optional
+import json
+import queue
+import socket
+import ssl
+import http.client
+import itertools
+import threading
+import uuid
+from typing import List, Dict, Any, Optional, Iterable, Callable, Set
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from urllib.parse import urlparse
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
@@ -22,22 +33,82 @@ if sys.platform == 'win32':
     except:
         pass
 
-from database import Database
+from database import Database, shard_checkpoint_scope
+import moodle_parser
+import date_extractor
 from notifier import Notifier
 from calendar_scraper import CalendarScraper
 from pdf_report import PDFReportGenerator
 
 load_dotenv()
 
+LMS_BASE_URLS = {
+    'OUSL': 'https://oulms.ou.ac.lk',
+    'RUSL': 'https://lms.aps.rjt.ac.lk'
+}
+
+# Enrolled courses rarely change, so the course list is only rediscovered after this many hours
+ENROLLMENT_CACHE_TTL_HOURS = float(os.getenv('ENROLLMENT_CACHE_TTL_HOURS', 24))
+
+# Upper bound on discussion pages walked per forum in one scan
+FORUM_MAX_PAGES = int(os.getenv('FORUM_MAX_PAGES', 10))
+
+# Forum view.php sort order "newest discussion first" (Moodle's default is by last post,
+# which moves old discussions with new replies above newer discussions)
+FORUM_SORT_CREATED_DESC = 3
+
+# Courses are fully crawled at least this often, even when the change feeds report nothing
+FULL_CRAWL_INTERVAL_HOURS = float(os.getenv('FULL_CRAWL_INTERVAL_HOURS', 24))
+
+# Watch mode: how often the notification feed is polled, and how often every course's
+# recent-activity page is swept as a backstop for changes the feed can't attribute
+WATCH_INTERVAL_SECONDS = int(os.getenv('WATCH_INTERVAL_SECONDS', 60))
+WATCH_SWEEP_MINUTES = float(os.getenv('WATCH_SWEEP_MINUTES', 15))
+
+# Optional detail enrichment: fetch the activity page itself for new/changed items,
+# capped per crawl (LMS scan, watch cycle or worker job) so a large batch of new
+# content can't stall the run
+FETCH_ACTIVITY_DETAILS = os.getenv('FETCH_ACTIVITY_DETAILS', 'false').lower() == 'true'
+DETAIL_FETCH_LIMIT = int(os.getenv('DETAIL_FETCH_LIMIT', 25))
+
+# Shared scan runs (--enqueue / --worker): how long a claimed course stays leased without
+# a heartbeat before another worker may take it over, and how often a course is retried
+SCAN_JOB_LEASE_SECONDS = int(os.getenv('SCAN_JOB_LEASE_SECONDS', 300))
+SCAN_JOB_MAX_ATTEMPTS = int(os.getenv('SCAN_JOB_MAX_ATTEMPTS', 3))
+
+# Crawl pipeline: parser worker processes, and how many fetched-but-unwritten
+# courses may queue up before the browser waits for parsing to catch up
+PARSE_WORKERS = int(os.getenv('PARSE_WORKERS', min(4, os.cpu_count() or 1)))
+PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', 4))
+
+# Pre-flight reachability probe (DNS, TCP/TLS, HEAD on the login page) run before
+# Chrome starts: timeout in seconds for each step, 0 disables the probe
+PREFLIGHT_TIMEOUT = float(os.getenv('PREFLIGHT_TIMEOUT', 5))
+
+# Deadline extraction cache: texts remembered in memory (the rest are read back from
+# the database), and days before a stored result is extracted again
+EXTRACTION_CACHE_SIZE = int(os.getenv('EXTRACTION_CACHE_SIZE', 5000))
+EXTRACTION_CACHE_DAYS = int(os.getenv('EXTRACTION_CACHE_DAYS', 30))
+
 class MoodleScraper:
     """Scrape Moodle LMS instances for course activities."""
     
-    def __init__(self, headless: bool = True):
+    def __init__(self, headless: bool = True, refresh_courses: bool = False,
+                 use_change_feeds: bool = True, fetch_details: bool = FETCH_ACTIVITY_DETAILS):
         self.headless = headless
+        self.refresh_courses = refresh_courses
+        self.use_change_feeds = use_change_feeds
+        self.fetch_details = fetch_details
+        self.detail_fetches_left = DETAIL_FETCH_LIMIT
+        self._writes = None
+        self._parse_pool = None
+        self.checkpoint = None
         self.driver = None
         self.db = Database()
         self.notifier = Notifier()
         self.calendar_scraper = CalendarScraper()
+        self.extraction_cache = date_extractor.ExtractionCache(self.db, EXTRACTION_CACHE_SIZE,
+                                                               EXTRACTION_CACHE_DAYS)
     
     def setup_driver(self):
         """Setup Selenium WebDriver."""
@@ -89,20 +160,26 @@ class MoodleScraper:
         if self.driver:
             self.driver.quit()
     
-    def generate_activity_id(self, course_id: str, title: str, activity_type: str) -> str:
-        """Generate a unique ID for an activity."""
-        unique_string = f"{course_id}_{title}_{activity_type}"
-        return hashlib.md5(unique_string.encode()).hexdigest()
+    def generate_activity_id(self, course_id: str, title: str, activity_type: str, url: str = None) -> str:
+        """
+        Generate a unique ID for an activity. Uses the Moodle cmid (or discussion ID
+        for forum posts) from the URL when there is one, so renamed items keep their ID.
+        """
+        return moodle_parser.generate_activity_id(course_id, title, activity_type, url)
     
     def _extract_and_store_deadline(self, activity_id: str, course_id: str, 
-                                    title: str, description: str, lms_name: str):
-        """Extract deadline from activity text and store in deadlines table."""
+                                    title: str, description: str, lms_name: str,
+                                    extracted_dates: List[datetime] = None, text_hash: str = None):
+        """
+        Extract deadline from activity text and store in deadlines table.
+        Pass extracted_dates (and the text's hash) when they were already found in a batch.
+        """
         try:
-            # Combine title and description for searching
-            search_text = f"{title} {description or ''}"
-            
-            # Extract dates using calendar scraper's method
-            extracted_dates = self.calendar_scraper.extract_dates_from_text(search_text)
+            if extracted_dates is None:
+                # Combine title and description for searching
+                search_text = f"{title} {description or ''}"
+                extracted_dates = self.extraction_cache.extract_batch([search_text])[0]
+                text_hash = date_extractor.text_hash(search_text)
             
             if extracted_dates:
                 # Use the first/earliest extracted date
@@ -121,17 +198,16 @@ class MoodleScraper:
                     course_id=course_id,
                     activity_id=activity_id,
                     source='scraped',
-                    location=''
+                    location='',
+                    text_hash=text_hash
                 )
                 print(f"      📅 Deadline extracted: {deadline_date.strftime('%Y-%m-%d')}")
         except Exception as e:
             # Silently fail - deadline extraction is optional
             pass
     
-    def scrape_ousl(self) -> Dict[str, Any]:
-        """Scrape Open University of Sri Lanka Moodle."""
-        print("\n🔍 Scraping OUSL Moodle...")
-        
+    def login_ousl(self) -> Dict[str, Any]:
+        """Log in to Open University of Sri Lanka Moodle."""
         # Ensure driver is set up
         if not self.driver:
             self.setup_driver()
@@ -193,7 +269,21 @@ class MoodleScraper:
                 return {'success': False, 'error': 'Login failed'}
             
             print("✅ Logged in successfully!")
+            return {'success': True}
             
+        except Exception as e:
+            print(f"❌ Error logging in to OUSL: {e}")
+            return {'success': False, 'error': str(e)}
+    
+    def scrape_ousl(self) -> Dict[str, Any]:
+        """Scrape Open University of Sri Lanka Moodle."""
+        print("\n🔍 Scraping OUSL Moodle...")
+        
+        login = self.login_ousl()
+        if not login['success']:
+            return login
+        
+        try:
             # Scrape courses
             courses = self._scrape_ousl_courses()
             
@@ -211,6 +301,11 @@ class MoodleScraper:
     
     def _scrape_ousl_courses(self) -> List[Dict[str, Any]]:
         """Scrape all courses from OUSL dashboard."""
+        enrolled = self._get_enrolled_courses('OUSL', self._discover_ousl_courses)
+        return self._scrape_courses(enrolled, 'OUSL')
+    
+    def _discover_ousl_courses(self) -> List[Dict[str, Any]]:
+        """Discover enrolled courses from the OUSL dashboard."""
         courses = []
         
         try:
@@ -311,18 +406,12 @@ class MoodleScraper:
                         # Add to database
                         self.db.add_course(course_id, 'OUSL', course_name, course_url)
                         
-                        # Scrape course activities
-                        activities = self._scrape_course_activities(course_url, course_id, 'OUSL')
-                        
                         courses.append({
                             'course_id': course_id,
                             'name': course_name,
-                            'url': course_url,
-                            'activities': activities
+                            'url': course_url
                         })
                         
-                        time.sleep(2)  # Be respectful
-                        
                     except Exception as e:
                         print(f"  ⚠️ Error processing course card: {e}")
                         continue
@@ -387,33 +476,25 @@ class MoodleScraper:
                         # Add to database
                         self.db.add_course(course_id, 'OUSL', course_name, course_url)
                         
-                        # Scrape course activities
-                        activities = self._scrape_course_activities(course_url, course_id, 'OUSL')
-                        
                         courses.append({
                             'course_id': course_id,
                             'name': course_name,
-                            'url': course_url,
-                            'activities': activities
+                            'url': course_url
                         })
                         
-                        time.sleep(2)  # Be respectful
-                        
                     except Exception as e:
                         print(f"  ⚠️ Error processing course: {e}")
                         continue
             
-            print(f"✅ Found {len(courses)} courses")
+            print(f"✅ Discovered {len(courses)} courses")
             
         except Exception as e:
-            print(f"❌ Error scraping courses: {e}")
+            print(f"❌ Error discovering courses: {e}")
         
         return courses
     
-    def scrape_rusl(self) -> Dict[str, Any]:
-        """Scrape Rajarata University Moodle."""
-        print("\n🔍 Scraping Rajarata University Moodle...")
-        
+    def login_rusl(self) -> Dict[str, Any]:
+        """Log in to Rajarata University Moodle."""
         # Ensure driver is set up
         if not self.driver:
             self.setup_driver()
@@ -450,7 +531,21 @@ class MoodleScraper:
                 return {'success': False, 'error': 'Login failed'}
             
             print("✅ Logged in successfully!")
+            return {'success': True}
             
+        except Exception as e:
+            print(f"❌ Error logging in to RUSL: {e}")
+            return {'success': False, 'error': str(e)}
+    
+    def scrape_rusl(self) -> Dict[str, Any]:
+        """Scrape Rajarata University Moodle."""
+        print("\n🔍 Scraping Rajarata University Moodle...")
+        
+        login = self.login_rusl()
+        if not login['success']:
+            return login
+        
+        try:
             # Scrape courses
             courses = self._scrape_rusl_courses()
             
@@ -466,6 +561,11 @@ class MoodleScraper:
     
     def _scrape_rusl_courses(self) -> List[Dict[str, Any]]:
         """Scrape all courses from RUSL dashboard."""
+        enrolled = self._get_enrolled_courses('RUSL', self._discover_rusl_courses)
+        return self._scrape_courses(enrolled, 'RUSL')
+    
+    def _discover_rusl_courses(self) -> List[Dict[str, Any]]:
+        """Discover enrolled courses from the RUSL dashboard."""
         courses = []
         
         try:
@@ -549,17 +649,12 @@ class MoodleScraper:
                         
                         self.db.add_course(course_id, 'RUSL', course_name, course_url)
                         
-                        activities = self._scrape_course_activities(course_url, course_id, 'RUSL')
-                        
                         courses.append({
                             'course_id': course_id,
                             'name': course_name,
-                            'url': course_url,
-                            'activities': activities
+                            'url': course_url
                         })
                         
-                        time.sleep(2)  # Be respectful
-                        
                     except Exception as e:
                         print(f"  ⚠️ Error processing course card: {e}")
                         continue
@@ -621,146 +716,566 @@ class MoodleScraper:
                         
                         self.db.add_course(course_id, 'RUSL', course_name, course_url)
                         
-                        activities = self._scrape_course_activities(course_url, course_id, 'RUSL')
-                        
                         courses.append({
                             'course_id': course_id,
                             'name': course_name,
-                            'url': course_url,
-                            'activities': activities
+                            'url': course_url
                         })
                         
-                        time.sleep(2)
-                        
                     except Exception as e:
                         print(f"  ⚠️ Error processing course: {e}")
                         continue
             
-            print(f"✅ Found {len(courses)} courses")
+            print(f"✅ Discovered {len(courses)} courses")
             
         except Exception as e:
-            print(f"❌ Error scraping courses: {e}")
+            print(f"❌ Error discovering courses: {e}")
         
         return courses
     
-    def _scrape_course_activities(self, course_url: str, course_id: str, lms_name: str = 'OUSL') -> List[Dict[str, Any]]:
-        """Scrape all activities from a course page."""
-        activities = []
+    def _scrape_courses(self, courses: List[Dict[str, Any]], lms_name: str) -> List[Dict[str, Any]]:
+        """Scrape activities for each enrolled course, skipping courses the change feeds report as unchanged."""
+        scan_started = int(time.time())
         
-        try:
-            self.driver.get(course_url)
-            time.sleep(3)
+        progress = self.checkpoint['state']['lms'].get(lms_name) if self.checkpoint else None
+        if progress and progress.get('plan') is not None:
+            # Resuming: crawl only what the interrupted scan planned but didn't finish
+            scan_started = progress['scan_started']
+            to_crawl = [c for c in courses
+                        if c['course_id'] in progress['plan'] and c['course_id'] not in progress['completed']]
+            print(f"  ↩️ Resuming: {len(progress['completed'])} of {len(progress['plan'])} planned courses already done")
+        else:
+            changed_course_ids = self._detect_changed_courses(lms_name, courses) if self.use_change_feeds else None
+            to_crawl = [c for c in courses if changed_course_ids is None or c['course_id'] in changed_course_ids]
+            self._checkpoint_plan(lms_name, scan_started, to_crawl)
+        
+        results = self._crawl_courses(to_crawl, lms_name)
+        
+        completed = progress['completed'] if progress else {}
+        for course in courses:
+            if course not in to_crawl:
+                result = {
+                    'course_id': course['course_id'],
+                    'name': course['name'],
+                    'url': course['url'],
+                    'activities': [],
+                    'unchanged': True
+                }
+                if course['course_id'] in completed:
+                    # Crawled before the interruption; keep its counts for scan history
+                    done = completed[course['course_id']]
+                    result.update(unchanged=False, resumed=True,
+                                  activities_found=done['activities'], new_activities=done['new'])
+                results.append(result)
+        
+        # Leave the feeds alone until every planned course is in, so a resume (or the next
+        # scan, for courses that failed) still sees the changes
+        crawled = {result['course_id'] for result in results if result.get('crawled')}
+        failed = [course for course in to_crawl if course['course_id'] not in crawled]
+        if failed:
+            print(f"  ⚠️ {len(failed)} course(s) could not be crawled, keeping the change-feed checkpoint")
+        elif not self.checkpoint or self._lms_crawl_complete(lms_name):
+            self.db.set_change_feed_checkpoint(lms_name, scan_started)
+        
+        print(f"✅ Found {len(results)} courses")
+        return results
+    
+    def _crawl_courses(self, courses: Iterable[Dict[str, Any]], lms_name: str,
+                       on_finished: Callable = None) -> List[Dict[str, Any]]:
+        """
+        Crawl the course page and forums of each given course as a pipeline: this
+        thread drives the browser and only fetches HTML, a process pool parses it
+        and a single writer thread applies the results to the database. The next
+        course page is loading while the previous ones are parsed and written.
+        
+        Steps that need the browser again once a course is parsed (forum walk,
+        detail pages) come back to this thread as follow-ups.
+        
+        courses may be a lazy iterable (run_worker claims jobs as the pipeline
+        asks for them); a course carrying its own 'lms_name' overrides lms_name.
+        on_finished(course, result) is called for every course once it is done,
+        with result None if its pages could not be fetched.
+        """
+        results = []
+        courses = iter(courses)
+        first = next(courses, None)
+        if first is None:
+            return results
+        
+        # Each crawl (a scan of an LMS, a watch cycle, a worker's run) gets its own detail budget
+        self.detail_fetches_left = DETAIL_FETCH_LIMIT
+        
+        # Bounded, so fetching pauses when parsing/writing falls behind
+        self._writes = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        followups = queue.Queue()
+        writer = threading.Thread(target=self._run_writer, args=(followups,), daemon=True)
+        
+        def finish(course, parsed, diff):
+            result = self._finish_course(course, parsed, diff, course.get('lms_name', lms_name))
+            results.append(result)
+            if on_finished:
+                on_finished(course, result)
+        
+        with ProcessPoolExecutor(max_workers=PARSE_WORKERS) as pool:
+            self._parse_pool = pool
+            writer.start()
+            submitted = 0
+            finished = 0
             
-            # Expand all sections
             try:
-                expand_buttons = self.driver.find_elements(By.CSS_SELECTOR, "[data-action='expand']")
-                for btn in expand_buttons:
+                for course in itertools.chain([first], courses):
+                    # Finish whatever the writer has handed back before fetching more
+                    while True:
+                        try:
+                            followup = followups.get_nowait()
+                        except queue.Empty:
+                            break
+                        finish(*followup)
+                        finished += 1
+                    
                     try:
-                        btn.click()
-                        time.sleep(0.5)
-                    except:
-                        pass
-            except:
-                pass
-            
-            time.sleep(2)
+                        print(f"  📚 Scanning course: {course['name']}")
+                        self._checkpoint_cursor(course.get('lms_name', lms_name), course)
+                        bundle = self._fetch_course_pages(course)
+                    except Exception as e:
+                        print(f"  ⚠️ Error processing course: {e}")
+                        if on_finished:
+                            on_finished(course, None)
+                        continue
+                    
+                    self._writes.put(('course', course, pool.submit(moodle_parser.parse_course_bundle, bundle)))
+                    submitted += 1
+                    time.sleep(2)  # Be respectful
+                
+                while finished < submitted:
+                    finish(*followups.get())
+                    finished += 1
+            finally:
+                self._writes.put(None)
+                writer.join()
+                self._writes = None
+                self._parse_pool = None
+        
+        return results
+    
+    def _fetch_course_pages(self, course: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Load a course page plus the index pages it needs (assignment/quiz due dates,
+        forum counts) and return the raw HTML for moodle_parser.parse_course_bundle.
+        """
+        self.driver.get(course['url'])
+        time.sleep(3)
+        
+        # Expand all sections
+        try:
+            expand_buttons = self.driver.find_elements(By.CSS_SELECTOR, "[data-action='expand']")
+            for btn in expand_buttons:
+                try:
+                    btn.click()
+                    time.sleep(0.5)
+                except:
+                    pass
+        except:
+            pass
+        
+        time.sleep(2)
+        
+        bundle = {
+            'course_id': course['course_id'],
+            'course_url': course['url'],
+            'course_html': self.driver.page_source,
+            'index_html': {},
+            'forum_index_html': None
+        }
+        
+        course_num = re.search(r'id=(\d+)', course['url'])
+        if not course_num:
+            return bundle
+        base_url = course['url'].split('/course/')[0]
+        
+        # Index pages are only worth a request when the course uses that module type
+        for modname in list(moodle_parser.DEADLINE_INDEX_COLUMNS) + ['forum']:
+            if f'modtype_{modname}' not in bundle['course_html']:
+                continue
             
-            soup = BeautifulSoup(self.driver.page_source, 'html.parser')
+            try:
+                self.driver.get(f"{base_url}/mod/{modname}/index.php?id={course_num.group(1)}")
+                time.sleep(2)
+            except Exception as e:
+                print(f"    ⚠️ Could not read {modname} index: {e}")
+                continue
             
-            # Find all activity items
-            activity_items = soup.find_all('li', class_=re.compile(r'activity|modtype'))
+            if modname == 'forum':
+                bundle['forum_index_html'] = self.driver.page_source
+            else:
+                bundle['index_html'][modname] = self.driver.page_source
+        
+        return bundle
+    
+    def _write(self, func, *args, **kwargs):
+        """Run a database write on the pipeline's writer thread (or directly outside a crawl)."""
+        if self._writes is not None:
+            self._writes.put(('call', func, args, kwargs))
+        else:
+            func(*args, **kwargs)
+    
+    def _run_writer(self, followups: queue.Queue):
+        """
+        Writer thread: the only place the crawl pipeline writes to the database.
+        Applies parsed courses in the order they were fetched and hands each one
+        back to the browser thread as a follow-up.
+        """
+        while True:
+            job = self._writes.get()
+            if job is None:
+                return
             
-            for item in activity_items:
+            if job[0] == 'call':
+                _, func, args, kwargs = job
                 try:
-                    # Extract activity type
-                    activity_type = 'unknown'
-                    classes = item.get('class', [])
-                    for cls in classes:
-                        if 'modtype_' in cls:
-                            activity_type = cls.replace('modtype_', '')
-                            break
-                    
-                    # Find activity link
-                    link = item.find('a', href=True)
-                    if not link:
-                        continue
-                    
-                    title = link.get_text(strip=True)
-                    url = link.get('href')
-                    
-                    if url.startswith('/'):
-                        base_url = course_url.split('/course/')[0]
-                        url = base_url + url
-                    
-                    # Try to find description
-                    description = ''
-                    desc_div = item.find('div', class_=re.compile(r'description|summary'))
-                    if desc_div:
-                        description = desc_div.get_text(strip=True)
-                    
-                    # Try to find deadline
-                    deadline = None
-                    deadline_spans = item.find_all('span', class_=re.compile(r'due|deadline'))
-                    for span in deadline_spans:
-                        deadline_text = span.get_text(strip=True)
-                        if deadline_text:
-                            deadline = deadline_text
-                            break
-                    
-                    # Generate unique activity ID
-                    activity_id = self.generate_activity_id(course_id, title, activity_type)
-                    
-                    # Add to database and check if new
-                    is_new = self.db.add_activity(
-                        activity_id=activity_id,
-                        course_id=course_id,
-                        activity_type=activity_type,
-                        title=title,
-                        description=description,
-                        url=url,
-                        deadline=deadline
-                    )
-                    
-                    # Extract deadline dates from title and description
-                    self._extract_and_store_deadline(
-                        activity_id=activity_id,
-                        course_id=course_id,
-                        title=title,
-                        description=description,
-                        lms_name=lms_name
-                    )
-                    
-                    if is_new:
-                        print(f"    🆕 New: [{activity_type}] {title}")
-                    
-                    activities.append({
-                        'activity_id': activity_id,
-                        'type': activity_type,
-                        'title': title,
-                        'url': url,
-                        'description': description,
-                        'deadline': deadline,
-                        'is_new': is_new
-                    })
-                    
+                    func(*args, **kwargs)
                 except Exception as e:
-                    print(f"    ⚠️ Error processing activity: {e}")
-                    continue
+                    print(f"  ⚠️ Database write failed: {e}")
+                continue
             
-            print(f"    Found {len(activities)} activities")
+            _, course, parsed_future = job
+            parsed = None
+            diff = None
+            try:
+                parsed = parsed_future.result()
+                diff = self._apply_parsed_course(course, parsed)
+            except Exception as e:
+                print(f"  ❌ Error scraping course activities ({course['name']}): {e}")
+                parsed = None  # not stored, so the course counts as not crawled
+            followups.put((course, parsed, diff))
+    
+    def _apply_parsed_course(self, course: Dict[str, Any], parsed: Dict[str, Any]) -> Optional[Dict[str, set]]:
+        """Diff a parsed course page against the database and flag new activities."""
+        activities = parsed['activities']
+        print(f"    {course['name']}: found {len(activities)} activities")
+        
+        for modname, (dated, total) in parsed['index_summary'].items():
+            print(f"    📅 {modname} index: {dated}/{total} with due dates")
+        
+        if not activities:
+            # An empty page is more likely a rendering hiccup than a wiped course
+            print("    ⚠️ No activities parsed, skipping removal check")
+            return None
+        
+        # Diff against what is stored: inserts, updates and tombstones in one go
+        diff = self.db.apply_course_scan(course['course_id'], activities)
+        
+        for activity in activities:
+            activity['is_new'] = activity['activity_id'] in diff['added']
+            if activity['is_new']:
+                print(f"    🆕 New: [{activity['type']}] {activity['title']}")
+            elif activity['activity_id'] in diff['changed']:
+                print(f"    ✏️ Changed: [{activity['type']}] {activity['title']}")
+        
+        if diff['removed']:
+            print(f"    🗑️ {len(diff['removed'])} activities no longer on the course page")
+        
+        return diff
+    
+    def _finish_course(self, course: Dict[str, Any], parsed: Optional[Dict[str, Any]],
+                       diff: Optional[Dict[str, set]], lms_name: str) -> Dict[str, Any]:
+        """Browser-side follow-up for a parsed course: detail pages, forum walk, deadlines."""
+        course_id = course['course_id']
+        activities = parsed['activities'] if parsed else []
+        
+        if parsed:
+            if self.fetch_details and diff:
+                # New/changed items, plus ones a previous scan had to leave for later
+                wanted = diff['added'] | diff['changed'] | self.db.get_pending_detail_ids(
+                    [a['activity_id'] for a in activities]
+                )
+                self._enrich_activity_details([a for a in activities if a['activity_id'] in wanted])
             
             # Now scrape forum posts for any forum activities found
-            forum_posts = self._scrape_forum_posts(course_url, course_id, activities, lms_name)
-            activities.extend(forum_posts)
+            forum_posts = self._scrape_forum_posts(course_id, activities, parsed['forum_counts'])
+            if self.fetch_details and forum_posts:
+                self._enrich_activity_details(forum_posts)
+            
+            self._write(self._store_course_deadlines, course_id, activities, forum_posts, lms_name)
+            self._write(self.db.mark_course_crawled, course_id)
+            activities = activities + forum_posts
+            self._checkpoint_course(lms_name, course_id, activities)
+        
+        return {
+            'course_id': course_id,
+            'name': course['name'],
+            'url': course['url'],
+            'activities': activities,
+            'crawled': parsed is not None
+        }
+    
+    def _store_course_deadlines(self, course_id: str, activities: List[Dict[str, Any]],
+                                forum_posts: List[Dict[str, Any]], lms_name: str):
+        """Extract deadline dates from each activity's text (or full page text when fetched)."""
+        items = [(activity, activity.get('details') or activity['description']) for activity in activities]
+        
+        # Forum post descriptions are just the author, so only their page text is worth reading
+        items += [(post, post['details']) for post in forum_posts if post.get('details')]
+        
+        search_texts = [f"{item['title']} {text or ''}" for item, text in items]
+        hashes = [date_extractor.text_hash(search_text) for search_text in search_texts]
+        
+        # A deadline already stored from the same text needs neither extraction nor a write
+        stored = self.db.get_scraped_deadline_hashes(course_id)
+        pending = [i for i, (item, _) in enumerate(items) if (item['activity_id'], hashes[i]) not in stored]
+        
+        # One extraction pass for the rest of the course (texts seen on earlier scans come from the cache)
+        found = self.extraction_cache.extract_batch(search_texts[i] for i in pending)
+        
+        for i, dates in zip(pending, found):
+            item, text = items[i]
+            self._extract_and_store_deadline(
+                activity_id=item['activity_id'],
+                course_id=course_id,
+                title=item['title'],
+                description=text,
+                lms_name=lms_name,
+                extracted_dates=dates,
+                text_hash=hashes[i]
+            )
+    
+    def _parse(self, func, *args):
+        """Run a moodle_parser function in the parser pool (inline outside a crawl)."""
+        if self._parse_pool is not None:
+            return self._parse_pool.submit(func, *args).result()
+        return func(*args)
+    
+    def _detect_changed_courses(self, lms_name: str, courses: List[Dict[str, Any]]) -> Optional[set]:
+        """
+        Work out which courses need a full crawl using Moodle's cheap change feeds:
+        the popup notification feed first, then course/recent.php for the rest.
+        Returns the set of course IDs to crawl, or None to crawl everything.
+        """
+        since = self.db.get_change_feed_checkpoint(lms_name)
+        if since is None:
+            print("  No change-feed checkpoint yet, crawling all courses")
+            return None
+        
+        # Courses that were never crawled, or not recently, are always crawled
+        changed = self.db.get_courses_due_for_crawl([c['course_id'] for c in courses], FULL_CRAWL_INTERVAL_HOURS)
+        
+        notifications = self._poll_notifications(since)
+        if notifications is not None:
+            for notification in notifications:
+                course_id = self._course_for_notification(notification, lms_name)
+                if course_id:
+                    changed.add(course_id)
+            print(f"  🔔 {len(notifications)} notification(s) since last scan")
+        
+        for course in courses:
+            if course['course_id'] in changed:
+                continue
+            if self._course_has_recent_activity(course['url'], since):
+                changed.add(course['course_id'])
+        
+        print(f"  📡 Change feeds: {len(changed)} of {len(courses)} course(s) changed")
+        return changed
+    
+    def _poll_notifications(self, since: int) -> Optional[List[Dict[str, Any]]]:
+        """
+        Read the logged-in user's popup notifications newer than `since` (unix time)
+        through Moodle's AJAX service. Returns None if the feed is unavailable.
+        """
+        script = """
+            var since = arguments[0];
+            var done = arguments[arguments.length - 1];
+            if (typeof M === 'undefined' || !M.cfg || !M.cfg.sesskey) { done(null); return; }
+            fetch(M.cfg.wwwroot + '/lib/ajax/service.php?sesskey=' + M.cfg.sesskey +
+                  '&info=message_popup_get_popup_notifications', {
+                method: 'POST',
+                credentials: 'same-origin',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify([{
+                    index: 0,
+                    methodname: 'message_popup_get_popup_notifications',
+                    args: {useridto: 0, newestfirst: true, limit: 50, offset: 0}
+                }])
+            }).then(function(r) { return r.json(); })
+              .then(function(data) { done(JSON.stringify(data)); })
+              .catch(function() { done(null); });
+        """
+        try:
+            raw = self.driver.execute_async_script(script, since)
+            if not raw:
+                return None
+            
+            response = json.loads(raw)[0]
+            if response.get('error'):
+                return None
             
+            notifications = response['data']['notifications']
+            return [n for n in notifications if int(n.get('timecreated', 0)) >= since]
         except Exception as e:
-            print(f"  ❌ Error scraping course activities: {e}")
+            print(f"  ⚠️ Notification feed unavailable: {e}")
+            return None
+    
+    def _course_for_notification(self, notification: Dict[str, Any], lms_name: str) -> Optional[str]:
+        """Map a popup notification to the course it belongs to, if we can tell."""
+        prefix = lms_name.lower()
+        context_url = notification.get('contexturl') or ''
+        
+        course_match = re.search(r'/course/view\.php\?(?:.*&)?id=(\d+)', context_url)
+        if course_match:
+            return f"{prefix}_{course_match.group(1)}"
+        
+        # Forum, assignment and quiz notifications carry the course-module ID in customdata
+        cmid = moodle_parser.extract_cmid(context_url)
+        if not cmid:
+            try:
+                customdata = json.loads(notification.get('customdata') or '{}')
+                cmid = str(customdata['cmid']) if customdata.get('cmid') else None
+            except (ValueError, TypeError, AttributeError):
+                cmid = None
+        
+        if cmid:
+            return self.db.find_course_by_cmid(prefix, cmid)
+        
+        return None
+    
+    def _course_has_recent_activity(self, course_url: str, since: int) -> bool:
+        """Check course/recent.php for anything logged in the course since `since`."""
+        course_num = re.search(r'id=(\d+)', course_url)
+        if not course_num:
+            return True
+        
+        base_url = course_url.split('/course/')[0]
+        recent_url = f"{base_url}/course/recent.php?id={course_num.group(1)}&date={since}"
+        
+        try:
+            self.driver.get(recent_url)
+            time.sleep(1)
+            
+            if "login" in self.driver.current_url.lower():
+                return True
+            
+            soup = BeautifulSoup(self.driver.page_source, 'html.parser')
+            main = soup.find(attrs={'role': 'main'}) or soup
+            return not main.find(string=re.compile(r'No recent activity', re.IGNORECASE))
+        except Exception:
+            # If we can't tell, crawl the course
+            return True
+    
+    def _enrollment_fingerprint(self, course_ids) -> str:
+        """Fingerprint a set of course IDs independent of their order."""
+        return hashlib.md5(','.join(sorted(set(course_ids))).encode()).hexdigest()
+    
+    def _get_enrolled_courses(self, lms_name: str, discover) -> List[Dict[str, Any]]:
+        """Return enrolled courses, rediscovering only when the cached list is stale."""
+        cache = None if self.refresh_courses else self.db.get_enrollment_cache(lms_name)
+        
+        if cache and self._enrollment_cache_is_valid(lms_name, cache):
+            print(f"  ♻️ Using cached course list ({cache['course_count']} courses)")
+            return cache['courses']
+        
+        courses = discover()
+        
+        if courses:
+            # Discovery leaves the browser on the dashboard; later scans compare theirs with this
+            observed = self._dashboard_course_ids(lms_name)
+            fingerprint = self._enrollment_fingerprint(observed or (c['course_id'] for c in courses))
+            self.db.save_enrollment_cache(lms_name, courses, fingerprint)
+            # Calendar deadlines naming a newly found course can now be linked to it
+            self.db.link_calendar_deadlines(lms_name)
+        elif cache:
+            # Dashboard did not render any courses; a stale list beats scanning nothing
+            print("  ⚠️ Course discovery found nothing, falling back to cached course list")
+            return cache['courses']
+        
+        return courses
+    
+    def _enrollment_cache_is_valid(self, lms_name: str, cache: Dict[str, Any]) -> bool:
+        """Check the cached course list against its TTL and the dashboard as it is now."""
+        if cache['age_hours'] >= ENROLLMENT_CACHE_TTL_HOURS:
+            print(f"  Course cache expired ({cache['age_hours']:.1f}h old), rediscovering...")
+            return False
+        
+        if len({c['course_id'] for c in cache['courses']}) != cache['course_count']:
+            print("  Course cache is inconsistent, rediscovering...")
+            return False
+        
+        # The cache holds a fingerprint of the dashboard's course links when it was
+        # filled; a course added to or dropped from the dashboard changes it
+        observed = self._dashboard_course_ids(lms_name)
+        if not observed:
+            print("  Could not read the dashboard, rediscovering...")
+            return False
+        
+        if self._enrollment_fingerprint(observed) != cache['fingerprint']:
+            print("  Enrolled courses changed since they were cached, rediscovering...")
+            return False
+        
+        return True
+    
+    def _dashboard_course_ids(self, lms_name: str) -> Optional[Set[str]]:
+        """
+        Course IDs linked from the LMS dashboard (/my/), loading it unless the
+        browser is already there (as it is after login). None if unreadable.
+        """
+        try:
+            if '/my/' not in self.driver.current_url:
+                self.driver.get(f"{LMS_BASE_URLS[lms_name]}/my/")
+                time.sleep(3)
+            
+            prefix = lms_name.lower()
+            return {
+                f"{prefix}_{course_num}"
+                for course_num in re.findall(r'/course/view\.php\?id=(\d+)', self.driver.page_source)
+            }
+        except Exception:
+            return None
+    
+    def _enrich_activity_details(self, activities: List[Dict[str, Any]]):
+        """
+        Attach the full text of each activity's own page as activity['details'].
+        Results are cached per activity version (fingerprint), so a page is only
+        fetched again after the activity changes; fetches stop once the per-crawl
+        DETAIL_FETCH_LIMIT is used up.
+        """
+        fetched = 0
+        skipped = 0
         
-        return activities
+        for activity in activities:
+            if not activity.get('url'):
+                continue
+            
+            details = self.db.get_activity_details(activity['activity_id'], activity['fingerprint'])
+            if details is None:
+                if self.detail_fetches_left <= 0:
+                    self._write(self.db.save_activity_details, activity['activity_id'], activity['fingerprint'], None)
+                    skipped += 1
+                    continue
+                
+                try:
+                    self.driver.get(activity['url'])
+                    time.sleep(1)
+                    details = self._parse(moodle_parser.parse_activity_details, self.driver.page_source)
+                except Exception as e:
+                    print(f"      ⚠️ Could not fetch details for {activity['title']}: {e}")
+                    continue
+                finally:
+                    self.detail_fetches_left -= 1
+                
+                self._write(self.db.save_activity_details, activity['activity_id'], activity['fingerprint'], details)
+                fetched += 1
+            
+            activity['details'] = details
+        
+        if fetched:
+            print(f"    🔎 Fetched details for {fetched} activities")
+        if skipped:
+            print(f"    ⏭️ Detail fetch limit reached, {skipped} deferred to a later scan")
     
-    def _scrape_forum_posts(self, course_url: str, course_id: str, 
-                           activities: List[Dict], lms_name: str) -> List[Dict[str, Any]]:
-        """Scrape forum discussions/announcements from forum activities."""
+    def _scrape_forum_posts(self, course_id: str, activities: List[Dict],
+                            index_counts: Optional[Dict[str, tuple]]) -> List[Dict[str, Any]]:
+        """
+        Scrape forum discussions/announcements from forum activities. index_counts
+        comes from the course's forum index page (None if it could not be read).
+        """
         forum_posts = []
         
         # Find all forum activities
@@ -769,125 +1284,126 @@ class MoodleScraper:
         if not forums:
             return forum_posts
         
-        print(f"    🔍 Checking {len(forums)} forum(s) for new posts...")
+        # Use the forum index to skip forums whose discussion/unread counts are unchanged
+        if index_counts is not None:
+            stored_counts = self.db.get_forum_counts(course_id)
+            changed_forums = []
+            for forum in forums:
+                forum_cmid = moodle_parser.extract_cmid(forum['url'])
+                counts = moodle_parser.forum_index_counts(forum['title'], index_counts)
+                if counts is None or stored_counts.get(forum_cmid) != counts:
+                    changed_forums.append(forum)
+            
+            print(f"    🔍 Forum index: {len(changed_forums)} of {len(forums)} forum(s) changed")
+            forums = changed_forums
+        else:
+            print(f"    🔍 Checking {len(forums)} forum(s) for new posts...")
         
         for forum in forums:
             try:
                 forum_url = forum['url']
                 forum_title = forum['title']
+                discussions_seen = 0
+                pages_read = 0
+                new_in_forum = 0
+                reached_known = False
+                page = 0
+                seen_ids = set()
                 
-                # Visit the forum
-                self.driver.get(forum_url)
-                time.sleep(2)
-                
-                soup = BeautifulSoup(self.driver.page_source, 'html.parser')
-                
-                # Find discussion/announcement items
-                # Moodle uses different selectors for discussions
-                discussions = []
-                
-                # Try standard discussion table
-                discussion_table = soup.find('table', class_=re.compile(r'discussion|forumheaderlist'))
-                if discussion_table:
-                    rows = discussion_table.find_all('tr', class_=re.compile(r'discussion'))
-                    for row in rows:
-                        try:
-                            # Find discussion link
-                            link = row.find('a', href=re.compile(r'/mod/forum/discuss\.php'))
-                            if not link:
-                                continue
-                            
-                            post_title = link.get_text(strip=True)
-                            post_url = link.get('href')
-                            
-                            # Make URL absolute
-                            if post_url.startswith('/'):
-                                base_url = forum_url.split('/mod/forum')[0]
-                                post_url = base_url + post_url
-                            
-                            # Try to find author and date
-                            author = ''
-                            post_date = ''
-                            
-                            author_cell = row.find('td', class_=re.compile(r'author|picture'))
-                            if author_cell:
-                                author_link = author_cell.find('a')
-                                if author_link:
-                                    author = author_link.get_text(strip=True)
-                            
-                            date_cell = row.find('td', class_=re.compile(r'lastpost|created'))
-                            if date_cell:
-                                post_date = date_cell.get_text(strip=True)
-                            
-                            discussions.append({
-                                'title': post_title,
-                                'url': post_url,
-                                'author': author,
-                                'date': post_date
-                            })
-                        except Exception as e:
+                # Walk discussion pages newest-first (by creation, so a reply to an old discussion
+                # doesn't move it above the new ones) until we reach a discussion we already have
+                while not reached_known and page < FORUM_MAX_PAGES:
+                    page_url = f"{forum_url}&o={FORUM_SORT_CREATED_DESC}"
+                    if page:
+                        page_url += f"&p={page}"
+                    self.driver.get(page_url)
+                    time.sleep(2)
+                    
+                    discussions, has_next_page = self._parse(
+                        moodle_parser.parse_forum_discussions, self.driver.page_source, forum_url, page
+                    )
+                    pages_read += 1
+                    discussions_seen += len(discussions)
+                    
+                    for disc in discussions:
+                        disc['activity_id'] = self.generate_activity_id(
+                            course_id, f"{forum_title}: {disc['title']}", 'forum_post', disc['url']
+                        )
+                    page_ids = [d['activity_id'] for d in discussions]
+                    known_ids = self.db.get_existing_activity_ids(page_ids)
+                    # Posts tombstoned with a forum that has come back are restored, and don't end the walk
+                    removed_ids = self.db.get_removed_activity_ids(page_ids)
+                    
+                    # Process each discussion as an activity
+                    for disc in discussions:
+                        if disc['activity_id'] in removed_ids:
+                            self._write(
+                                self.db.add_activity,
+                                activity_id=disc['activity_id'],
+                                course_id=course_id,
+                                activity_type='forum_post',
+                                title=f"{forum_title}: {disc['title']}",
+                                description=f"Posted by {disc['author']}" if disc['author'] else "Forum discussion",
+                                url=disc['url'],
+                                deadline=None,
+                                metadata={'forum_url': forum_url}
+                            )
+                            print(f"      ♻️ Restored post: {disc['title']}")
                             continue
-                
-                # Alternative: Try list-based forums (newer Moodle versions)
-                if not discussions:
-                    discussion_list = soup.find_all('div', class_=re.compile(r'discussion-container'))
-                    for disc_div in discussion_list:
-                        try:
-                            link = disc_div.find('a', href=re.compile(r'/mod/forum/discuss\.php'))
-                            if not link:
-                                continue
-                            
-                            post_title = link.get_text(strip=True)
-                            post_url = link.get('href')
-                            
-                            if post_url.startswith('/'):
-                                base_url = forum_url.split('/mod/forum')[0]
-                                post_url = base_url + post_url
-                            
-                            discussions.append({
-                                'title': post_title,
-                                'url': post_url,
-                                'author': '',
-                                'date': ''
-                            })
-                        except:
+                        
+                        if disc['activity_id'] in known_ids:
+                            # Pinned discussions stay on top regardless of age, so they don't end the walk
+                            if not disc['pinned']:
+                                reached_known = True
+                                break
                             continue
-                
-                # Process each discussion as an activity
-                for disc in discussions:
-                    try:
-                        # Create a unique ID for this forum post
-                        post_title_full = f"{forum_title}: {disc['title']}"
-                        activity_id = self.generate_activity_id(course_id, post_title_full, 'forum_post')
+                        
+                        # A discussion bumped between page loads can show up twice
+                        if disc['activity_id'] in seen_ids:
+                            continue
+                        seen_ids.add(disc['activity_id'])
+                        
+                        post = {
+                            'activity_id': disc['activity_id'],
+                            'type': 'forum_post',
+                            'title': f"{forum_title}: {disc['title']}",
+                            'url': disc['url'],
+                            'description': f"Posted by {disc['author']}" if disc['author'] else "Forum discussion",
+                            'deadline': None,
+                            'is_new': True
+                        }
+                        post['fingerprint'] = moodle_parser.activity_fingerprint(post)
                         
                         # Add to database
-                        is_new = self.db.add_activity(
-                            activity_id=activity_id,
+                        self._write(
+                            self.db.add_activity,
+                            activity_id=post['activity_id'],
                             course_id=course_id,
                             activity_type='forum_post',
-                            title=post_title_full,
-                            description=f"Posted by {disc['author']}" if disc['author'] else "Forum discussion",
-                            url=disc['url'],
-                            deadline=None
+                            title=post['title'],
+                            description=post['description'],
+                            url=post['url'],
+                            deadline=None,
+                            metadata={'forum_url': forum_url}
                         )
                         
-                        if is_new:
-                            print(f"      🆕 New post: {disc['title']}")
-                            forum_posts.append({
-                                'activity_id': activity_id,
-                                'type': 'forum_post',
-                                'title': post_title_full,
-                                'url': disc['url'],
-                                'description': f"Posted by {disc['author']}" if disc['author'] else "Forum discussion",
-                                'deadline': None,
-                                'is_new': True
-                            })
-                    except Exception as e:
-                        print(f"      ⚠️ Error processing forum post: {e}")
-                        continue
+                        new_in_forum += 1
+                        print(f"      🆕 New post: {disc['title']}")
+                        forum_posts.append(post)
+                    
+                    if not has_next_page:
+                        break
+                    page += 1
                 
-                if discussions:
-                    print(f"      Found {len(discussions)} discussions ({len([p for p in forum_posts if p.get('is_new')])} new)")
+                if discussions_seen:
+                    print(f"      Read {pages_read} page(s), {discussions_seen} discussions ({new_in_forum} new)")
+                
+                # Only remember the counts once the forum has actually been read
+                forum_cmid = moodle_parser.extract_cmid(forum_url)
+                counts = moodle_parser.forum_index_counts(forum_title, index_counts) if index_counts else None
+                if forum_cmid and counts:
+                    discussions_count, unread_count = counts
+                    self._write(self.db.update_forum_counts, course_id, forum_cmid, discussions_count, unread_count)
                 
             except Exception as e:
                 print(f"    ⚠️ Error scraping forum {forum.get('title', 'Unknown')}: {e}")
@@ -895,55 +1411,128 @@ class MoodleScraper:
         
         return forum_posts
     
-    def run_full_scan(self):
-        """Run a complete scan of all LMS instances."""
+    def _send_new_activity_notifications(self, total_new_activities: int):
+        """Send the PDF report and text notification for activities still marked as new."""
+        # Every scan ends here, so the deadlines it stored are de-duplicated before anything reads them
+        self.db.cluster_deadlines()
+        
+        if total_new_activities > 0:
+            print(f"\n📧 Processing notifications for {total_new_activities} new activities...")
+            new_activities = self.db.get_new_activities()
+            
+            # Generate and send PDF report FIRST (before marking as notified)
+            print("\n📄 Generating PDF report...")
+            try:
+                pdf_generator = PDFReportGenerator()
+                
+                # Get data for report (activities are still marked as is_new=1)
+                deadlines_for_report = self.db.get_all_upcoming_deadlines(days_ahead=30)
+                stats = self.db.get_stats()
+                
+                # Generate PDF
+                pdf_path = pdf_generator.generate_report(
+                    new_activities,  # Use the new_activities we already fetched
+                    deadlines_for_report,
+                    stats
+                )
+                
+                # Send PDF via email
+                print("📧 Sending PDF report via email...")
+                if self.notifier.send_email_with_pdf(
+                    pdf_path,
+                    len(new_activities),
+                    len(deadlines_for_report)
+                ):
+                    print("✅ PDF report sent successfully!")
+                else:
+                    print("⚠️ Failed to send PDF report")
+                
+            except Exception as pdf_error:
+                print(f"⚠️ Error generating/sending PDF report: {str(pdf_error)}")
+            
+            # Now send regular text notification
+            print("\n📧 Sending text notifications...")
+            if self.notifier.send_notification(new_activities):
+                # Mark as notified AFTER both PDF and text notifications are sent
+                activity_ids = [a['activity_id'] for a in new_activities]
+                self.db.mark_activities_as_notified(activity_ids)
+                print("✅ All notifications sent and activities marked as notified")
+            else:
+                print("⚠️ Failed to send text notifications")
+        else:
+            print("\n✅ No new activities found.")
+    
+    def _send_deadline_reminders(self):
+        """Send reminders for deadlines in the next 7 days."""
+        print("\n📅 Checking for upcoming deadlines...")
+        upcoming_deadlines = self.db.get_all_upcoming_deadlines(days_ahead=7)
+        
+        if upcoming_deadlines:
+            print(f"⏰ Found {len(upcoming_deadlines)} upcoming deadlines in the next 7 days")
+            print("📧 Sending deadline reminder email...")
+            self.notifier.send_deadline_reminders(upcoming_deadlines)
+        else:
+            print("✅ No upcoming deadlines in the next 7 days")
+    
+    def run_full_scan(self, resume: bool = False):
+        """
+        Run a complete scan of all LMS instances.
+        Progress is checkpointed in the database as each course finishes; with
+        resume=True an interrupted scan carries on from its last checkpoint
+        instead of crawling finished courses again.
+        """
         print("=" * 60)
         print("🚀 Starting LMS Full Scan")
         print(f"⏰ Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
         print("=" * 60)
         
-        self.setup_driver()
+        self._start_checkpoint(resume)
+        
+        to_scan = [lms_name for lms_name in ('OUSL', 'RUSL')
+                   if self.checkpoint['state']['lms'].get(lms_name, {}).get('status') != 'done']
+        unreachable = self._preflight(to_scan)
+        if len(unreachable) < len(to_scan):
+            self.setup_driver()
         
         results = {
             'ousl': None,
             'rusl': None,
             'total_new_activities': 0
         }
+        scan_complete = False
         
         try:
-            # Scrape OUSL
-            ousl_result = self.scrape_ousl()
-            results['ousl'] = ousl_result
-            
-            if ousl_result['success']:
-                total_courses = len(ousl_result['courses'])
-                total_activities = sum(len(c['activities']) for c in ousl_result['courses'])
-                new_activities = sum(sum(1 for a in c['activities'] if a.get('is_new')) 
-                                   for c in ousl_result['courses'])
+            for lms_name, scrape in (('OUSL', self.scrape_ousl), ('RUSL', self.scrape_rusl)):
+                progress = self.checkpoint['state']['lms'].get(lms_name, {})
+                if progress.get('status') == 'done':
+                    print(f"\n⏭️ {lms_name} finished before the interruption, skipping")
+                    results[lms_name.lower()] = {'success': True, 'resumed': True, 'courses': []}
+                    results['total_new_activities'] += progress['new_activities']
+                    continue
                 
-                self.db.add_scan_history('OUSL', total_courses, total_activities, 
-                                        new_activities, 'success')
-                results['total_new_activities'] += new_activities
-            else:
-                self.db.add_scan_history('OUSL', 0, 0, 0, 'failed', 
-                                        ousl_result.get('error'))
-            
-            # Scrape RUSL
-            rusl_result = self.scrape_rusl()
-            results['rusl'] = rusl_result
-            
-            if rusl_result['success']:
-                total_courses = len(rusl_result['courses'])
-                total_activities = sum(len(c['activities']) for c in rusl_result['courses'])
-                new_activities = sum(sum(1 for a in c['activities'] if a.get('is_new')) 
-                                   for c in rusl_result['courses'])
+                if lms_name in unreachable:
+                    results[lms_name.lower()] = {'success': False, 'unreachable': True,
+                                                 'error': unreachable[lms_name]}
+                    self._checkpoint_lms(lms_name, status='unreachable')
+                    continue
                 
-                self.db.add_scan_history('RUSL', total_courses, total_activities, 
-                                        new_activities, 'success')
-                results['total_new_activities'] += new_activities
-            else:
-                self.db.add_scan_history('RUSL', 0, 0, 0, 'failed', 
-                                        rusl_result.get('error'))
+                lms_result = scrape()
+                results[lms_name.lower()] = lms_result
+                
+                if lms_result['success']:
+                    total_courses, total_activities, new_activities = self._summarize_courses(lms_result['courses'])
+                    self.db.add_scan_history(lms_name, total_courses, total_activities,
+                                             new_activities, 'success')
+                    results['total_new_activities'] += new_activities
+                    if self._lms_crawl_complete(lms_name):
+                        self._checkpoint_lms(lms_name, status='done', new_activities=new_activities)
+                else:
+                    self.db.add_scan_history(lms_name, 0, 0, 0, 'failed',
+                                             lms_result.get('error'))
+                    self._checkpoint_lms(lms_name, status='failed')
+            
+            scan_complete = all(self.checkpoint['state']['lms'].get(lms_name, {}).get('status') == 'done'
+                                for lms_name in ('OUSL', 'RUSL'))
             
         except Exception as e:
             print(f"❌ Error during scan: {str(e)}")
@@ -954,73 +1543,783 @@ class MoodleScraper:
             
             # Send notifications if there are new activities (moved to finally block)
             try:
-                if results['total_new_activities'] > 0:
-                    print(f"\n📧 Processing notifications for {results['total_new_activities']} new activities...")
-                    new_activities = self.db.get_new_activities()
-                    
-                    # Generate and send PDF report FIRST (before marking as notified)
-                    print("\n📄 Generating PDF report...")
-                    try:
-                        pdf_generator = PDFReportGenerator()
-                        
-                        # Get data for report (activities are still marked as is_new=1)
-                        deadlines_for_report = self.db.get_all_upcoming_deadlines(days_ahead=30)
-                        stats = self.db.get_stats()
-                        
-                        # Generate PDF
-                        pdf_path = pdf_generator.generate_report(
-                            new_activities,  # Use the new_activities we already fetched
-                            deadlines_for_report,
-                            stats
-                        )
-                        
-                        # Send PDF via email
-                        print("📧 Sending PDF report via email...")
-                        if self.notifier.send_email_with_pdf(
-                            pdf_path,
-                            len(new_activities),
-                            len(deadlines_for_report)
-                        ):
-                            print("✅ PDF report sent successfully!")
-                        else:
-                            print("⚠️ Failed to send PDF report")
-                        
-                    except Exception as pdf_error:
-                        print(f"⚠️ Error generating/sending PDF report: {str(pdf_error)}")
-                    
-                    # Now send regular text notification
-                    print("\n📧 Sending text notifications...")
-                    if self.notifier.send_notification(new_activities):
-                        # Mark as notified AFTER both PDF and text notifications are sent
-                        activity_ids = [a['activity_id'] for a in new_activities]
-                        self.db.mark_activities_as_notified(activity_ids)
-                        print("✅ All notifications sent and activities marked as notified")
-                    else:
-                        print("⚠️ Failed to send text notifications")
-                else:
-                    print("\n✅ No new activities found.")
-                
-                # Send deadline reminders for upcoming deadlines (next 7 days)
-                print("\n📅 Checking for upcoming deadlines...")
-                upcoming_deadlines = self.db.get_all_upcoming_deadlines(days_ahead=7)
-                
-                if upcoming_deadlines:
-                    print(f"⏰ Found {len(upcoming_deadlines)} upcoming deadlines in the next 7 days")
-                    print("📧 Sending deadline reminder email...")
-                    self.notifier.send_deadline_reminders(upcoming_deadlines)
-                else:
-                    print("✅ No upcoming deadlines in the next 7 days")
+                # Includes new items from earlier scans that were never sent
+                state = self.checkpoint['state']
+                state['pending_notifications'] = self.db.flag_pending_notifications(state['pending_notifications'])
+                self._save_checkpoint()
+                self._send_new_activity_notifications(len(state['pending_notifications']))
+                self._send_deadline_reminders()
                 
             except Exception as e:
                 print(f"⚠️ Error sending notifications: {str(e)}")
                 import traceback
                 traceback.print_exc()
+            
+            if scan_complete:
+                self.db.finish_scan_checkpoint(self.checkpoint['run_id'])
+            else:
+                print("\n💾 Scan incomplete; continue it with: python scraper.py --resume")
+            self.checkpoint = None
         
         print("\n" + "=" * 60)
         print("✅ Scan Complete!")
         print("=" * 60)
         
         return results
+    
+    def _summarize_courses(self, courses: List[Dict[str, Any]]) -> tuple:
+        """Course, activity and new-activity totals for scan history (resumed courses keep their earlier counts)."""
+        total_activities = sum(c.get('activities_found', len(c['activities'])) for c in courses)
+        new_activities = sum(c.get('new_activities', sum(1 for a in c['activities'] if a.get('is_new')))
+                             for c in courses)
+        return len(courses), total_activities, new_activities
+    
+    def _start_checkpoint(self, resume: bool, scope: str = '', run_id: str = None):
+        """
+        Pick up the last unfinished scan (resume) or start checkpointing a new one.
+        scope keeps one shard's checkpoints apart from full scans and other shards.
+        """
+        previous = self.db.get_scan_checkpoint(scope=scope)
+        
+        if resume and previous:
+            self.checkpoint = {'run_id': previous['run_id'], 'state': previous['state']}
+            cursor = previous['state'].get('cursor') or {}
+            print(f"↩️ Resuming scan {previous['run_id']} (last checkpoint {previous['updated_at']}, "
+                  f"was at {cursor.get('lms', '-')} / {cursor.get('course', '-')})")
+            return
+        
+        if resume:
+            print("ℹ️ No interrupted scan to resume, starting a new one")
+        
+        # New activities that an earlier scan failed to send (or never got to) carry over;
+        # shards don't notify (the merge does), so theirs start empty
+        previous = previous or self.db.get_scan_checkpoint(include_finished=True, scope=scope)
+        
+        run_id = scope + (run_id or f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6]}")
+        state = {
+            'lms': {},
+            'cursor': None,
+            'pending_notifications': previous['state']['pending_notifications'] if previous and not scope else []
+        }
+        self.db.start_scan_checkpoint(run_id, state, scope)
+        self.checkpoint = {'run_id': run_id, 'state': state}
+    
+    def _save_checkpoint(self):
+        """Queue the current scan progress for the database, after the writes it describes."""
+        self._write(self.db.save_scan_checkpoint, self.checkpoint['run_id'],
+                    json.dumps(self.checkpoint['state']))
+    
+    def _checkpoint_plan(self, lms_name: str, scan_started: int, courses: List[Dict[str, Any]]):
+        """Record which courses of an LMS this scan is going to crawl."""
+        if not self.checkpoint:
+            return
+        self.checkpoint['state']['lms'][lms_name] = {
+            'status': 'crawling',
+            'scan_started': scan_started,
+            'plan': [c['course_id'] for c in courses],
+            'completed': {}
+        }
+        self._save_checkpoint()
+    
+    def _checkpoint_cursor(self, lms_name: str, course: Dict[str, Any]):
+        """Record the course currently being fetched."""
+        if not self.checkpoint:
+            return
+        self.checkpoint['state']['cursor'] = {'lms': lms_name, 'course': course['name']}
+        self._save_checkpoint()
+    
+    def _checkpoint_course(self, lms_name: str, course_id: str, activities: List[Dict[str, Any]]):
+        """Record a fully processed course and the new activities it still has to notify about."""
+        if not self.checkpoint:
+            return
+        state = self.checkpoint['state']
+        new_ids = [a['activity_id'] for a in activities if a.get('is_new')]
+        progress = state['lms'].setdefault(lms_name, {'status': 'crawling', 'plan': None, 'completed': {}})
+        progress['completed'][course_id] = {'activities': len(activities), 'new': len(new_ids)}
+        state['pending_notifications'].extend(new_ids)
+        self._save_checkpoint()
+    
+    def _checkpoint_lms(self, lms_name: str, **fields):
+        """Update the recorded status of an LMS (done / failed)."""
+        if not self.checkpoint:
+            return
+        self.checkpoint['state']['lms'].setdefault(lms_name, {'plan': None, 'completed': {}}).update(fields)
+        self._save_checkpoint()
+    
+    def _lms_crawl_complete(self, lms_name: str) -> bool:
+        """Whether every course planned for an LMS in this scan has been processed."""
+        progress = self.checkpoint['state']['lms'].get(lms_name) if self.checkpoint else None
+        if not progress or progress.get('plan') is None:
+            return False
+        return all(course_id in progress['completed'] for course_id in progress['plan'])
+    
+    def run_targeted_scan(self, course_ids: List[str] = None, lms_name: str = None) -> Dict[str, Any]:
+        """
+        Scan only the given courses, or every course of one LMS, right now.
+        Logs in, crawls just those course and forum pages, stores the results
+        and sends new-activity notifications like a full scan.
+        """
+        print("=" * 60)
+        print("🎯 Starting Targeted LMS Scan")
+        print(f"⏰ Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        print("=" * 60)
+        
+        results = {
+            'courses_scanned': 0,
+            'unknown_courses': [],
+            'lms': {},
+            'total_new_activities': 0
+        }
+        
+        # Group the requested courses by LMS, using the stored course URLs
+        targets = {}
+        if course_ids:
+            known = self.db.get_courses_by_ids(course_ids)
+            for course in known:
+                if lms_name and course['lms_name'] != lms_name:
+                    continue
+                targets.setdefault(course['lms_name'], []).append({
+                    'course_id': course['course_id'],
+                    'name': course['course_name'],
+                    'url': course['course_url']
+                })
+            known_ids = {c['course_id'] for c in known}
+            results['unknown_courses'] = [c for c in course_ids if c not in known_ids]
+            for unknown in results['unknown_courses']:
+                print(f"⚠️ Unknown course: {unknown} (run a full scan first)")
+        elif lms_name:
+            targets[lms_name] = None  # whole LMS: resolved after login
+        
+        if not targets:
+            print("❌ Nothing to scan")
+            return results
+        
+        unreachable = self._preflight(list(targets))
+        for target_lms, reason in unreachable.items():
+            results['lms'][target_lms] = {'success': False, 'unreachable': True, 'error': reason}
+            del targets[target_lms]
+        if not targets:
+            return results
+        
+        self.setup_driver()
+        
+        try:
+            for target_lms, courses in targets.items():
+                print(f"\n🔍 Scanning {target_lms}...")
+                login = self._login(target_lms)
+                if not login['success']:
+                    self.db.add_scan_history(target_lms, 0, 0, 0, 'failed', login.get('error'))
+                    results['lms'][target_lms] = login
+                    continue
+                
+                if courses is None:
+                    courses = self._get_enrolled_courses(target_lms, lambda: self._discover_courses(target_lms))
+                
+                scanned = self._crawl_courses(courses, target_lms)
+                total_activities = sum(len(c['activities']) for c in scanned)
+                new_activities = sum(sum(1 for a in c['activities'] if a.get('is_new')) for c in scanned)
+                
+                self.db.add_scan_history(target_lms, len(scanned), total_activities, new_activities, 'success')
+                
+                results['lms'][target_lms] = {'success': True, 'courses': scanned}
+                results['courses_scanned'] += len(scanned)
+                results['total_new_activities'] += new_activities
+        
+        except Exception as e:
+            print(f"❌ Error during targeted scan: {str(e)}")
+            import traceback
+            traceback.print_exc()
+        finally:
+            self.close_driver()
+            
+            try:
+                self._send_new_activity_notifications(results['total_new_activities'])
+            except Exception as e:
+                print(f"⚠️ Error sending notifications: {str(e)}")
+        
+        print("\n" + "=" * 60)
+        print(f"✅ Targeted Scan Complete! ({results['courses_scanned']} courses)")
+        print("=" * 60)
+        
+        return results
+    
+    def enqueue_scan(self, lms_name: str = None) -> Optional[str]:
+        """
+        Start a shared scan run: log in, work out which courses need crawling
+        (same change-feed logic as a normal scan) and queue one job per course.
+        Workers started with run_worker() then crawl the run together.
+        Returns the run ID.
+        """
+        print("=" * 60)
+        print("📋 Queueing LMS Scan")
+        print(f"⏰ Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        print("=" * 60)
+        
+        target_lms_names = [lms_name] if lms_name else list(LMS_BASE_URLS)
+        unreachable = self._preflight(target_lms_names)
+        target_lms_names = [name for name in target_lms_names if name not in unreachable]
+        if target_lms_names:
+            self.setup_driver()
+        jobs = []
+        checkpoints = {}
+        
+        try:
+            for target_lms in target_lms_names:
+                print(f"\n🔍 Checking {target_lms}...")
+                scan_started = int(time.time())
+                login = self._login(target_lms)
+                if not login['success']:
+                    self.db.add_scan_history(target_lms, 0, 0, 0, 'failed', login.get('error'))
+                    continue
+                
+                courses = self._get_enrolled_courses(target_lms, lambda: self._discover_courses(target_lms))
+                changed_course_ids = (self._detect_changed_courses(target_lms, courses)
+                                      if self.use_change_feeds else None)
+                to_crawl = [c for c in courses if changed_course_ids is None or c['course_id'] in changed_course_ids]
+                jobs.extend(dict(c, lms_name=target_lms) for c in to_crawl)
+                # Applied by _finish_scan_run once every job of this LMS is done
+                checkpoints[target_lms] = scan_started
+                print(f"  {len(to_crawl)} of {len(courses)} courses queued")
+        finally:
+            self.close_driver()
+        
+        run_id = f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        self.db.create_scan_run(run_id, jobs, checkpoints)
+        print(f"\n✅ Run {run_id} created with {len(jobs)} course job(s)")
+        
+        if not jobs:
+            self._finish_scan_run(run_id)
+        
+        return run_id
+    
+    def run_worker(self, run_id: str = None) -> int:
+        """
+        Work through a shared scan run: lease course jobs one by one as the crawl
+        pipeline asks for them, crawl each while a heartbeat keeps its lease alive,
+        and record the result (a course that could not be parsed is failed and retried).
+        Any number of workers can run at once; jobs whose worker stops
+        heartbeating are picked up by another. The worker that sees the run
+        complete records scan history and sends the notifications.
+        Returns the number of courses this worker crawled.
+        """
+        run_id = run_id or self.db.get_open_scan_run()
+        if not run_id:
+            print("✅ No open scan run to work on (create one with --enqueue)")
+            return 0
+        
+        worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        print(f"👷 Worker {worker_id} joining run {run_id}")
+        
+        self.setup_driver()
+        logins = {}
+        failed_logins = set()  # LMSs whose jobs this worker leaves to others
+        leases = {}  # course_id -> (job_id, heartbeat stop event) of jobs in the pipeline
+        crawled = 0
+        claimed = 0
+        
+        def claimed_courses():
+            nonlocal claimed
+            # Claimed one at a time as the pipeline asks for the next course
+            while True:
+                job = self.db.claim_scan_job(run_id, worker_id, SCAN_JOB_LEASE_SECONDS, SCAN_JOB_MAX_ATTEMPTS,
+                                             skip_lms=failed_logins)
+                if not job:
+                    return
+                claimed += 1
+                
+                target_lms = job['lms_name']
+                if target_lms not in logins:
+                    logins[target_lms] = self._login(target_lms)
+                if not logins[target_lms]['success']:
+                    self.db.complete_scan_job(job['job_id'], worker_id, 'failed',
+                                              error_message=logins[target_lms].get('error'))
+                    failed_logins.add(target_lms)
+                    continue
+                
+                # Every job gets the detail budget a scan of that one course would have
+                self.detail_fetches_left = DETAIL_FETCH_LIMIT
+                leases[job['course_id']] = (job['job_id'], self._keep_lease_alive(job['job_id'], worker_id))
+                yield {'course_id': job['course_id'], 'name': job['course_name'],
+                       'url': job['course_url'], 'lms_name': target_lms}
+        
+        def job_finished(course, result):
+            nonlocal crawled
+            job_id, stop_heartbeat = leases.pop(course['course_id'])
+            stop_heartbeat.set()
+            if result is None or not result['crawled']:
+                # Left for another attempt (by any worker) while it has attempts left
+                self.db.complete_scan_job(job_id, worker_id, 'failed',
+                                          error_message='course page could not be fetched or parsed')
+                return
+            
+            activities = result['activities']
+            self.db.complete_scan_job(job_id, worker_id, 'done', activities_found=len(activities),
+                                      new_activities=sum(1 for a in activities if a.get('is_new')))
+            crawled += 1
+        
+        try:
+            # One pipeline (parse pool and writer thread) crawls everything there is to claim.
+            # Courses that fail after the last claim become claimable again only once it has
+            # drained, so keep going until a pass finds nothing left to claim.
+            while True:
+                claimed_before = claimed
+                self._crawl_courses(claimed_courses(), None, on_finished=job_finished)
+                if claimed == claimed_before:
+                    break
+        except Exception as e:
+            print(f"  ⚠️ Worker stopped: {e}")
+        finally:
+            # Jobs still leased here expire and are picked up again
+            for _, stop_heartbeat in leases.values():
+                stop_heartbeat.set()
+            self.close_driver()
+        
+        print(f"\n👷 Worker {worker_id} done: {crawled} course(s) crawled")
+        for lms_name in failed_logins:
+            print(f"⚠️ Could not log in to {lms_name}; its jobs are left for another worker")
+        self._finish_scan_run(run_id)
+        return crawled
+    
+    def _keep_lease_alive(self, job_id: int, worker_id: str) -> threading.Event:
+        """Renew a job lease in the background until the returned event is set."""
+        stop = threading.Event()
+        
+        def heartbeat():
+            while not stop.wait(SCAN_JOB_LEASE_SECONDS / 3):
+                if not self.db.renew_scan_job_lease(job_id, worker_id, SCAN_JOB_LEASE_SECONDS):
+                    print(f"  ⚠️ Lost the lease on job {job_id}; another worker will redo it")
+                    return
+        
+        threading.Thread(target=heartbeat, daemon=True).start()
+        return stop
+    
+    def _finish_scan_run(self, run_id: str):
+        """Record history and send notifications for a run, if it is complete and nobody else has."""
+        summary = self.db.finish_scan_run(run_id, SCAN_JOB_MAX_ATTEMPTS)
+        if summary is None:
+            print("⏳ Other workers are still busy; the last one to finish sends notifications")
+            return
+        
+        total_new_activities = 0
+        failed_lms = set()
+        for lms in summary:
+            error = f"{lms['failed']} course(s) failed" if lms['failed'] else None
+            self.db.add_scan_history(lms['lms_name'], lms['courses'], lms['activities'],
+                                     lms['new_activities'], 'success', error)
+            total_new_activities += lms['new_activities']
+            if lms['failed']:
+                failed_lms.add(lms['lms_name'])
+        
+        # The change feeds only move past the run once every course it found changed was crawled
+        for lms_name, scan_started in self.db.get_scan_run_checkpoints(run_id).items():
+            if lms_name in failed_lms:
+                print(f"  ⚠️ {lms_name}: keeping the change-feed checkpoint, some courses failed")
+                continue
+            previous = self.db.get_change_feed_checkpoint(lms_name)
+            if previous is None or scan_started > previous:
+                self.db.set_change_feed_checkpoint(lms_name, scan_started)
+        
+        try:
+            self._send_new_activity_notifications(total_new_activities)
+            self._send_deadline_reminders()
+        except Exception as e:
+            print(f"⚠️ Error sending notifications: {str(e)}")
+        
+        print(f"✅ Run {run_id} complete")
+    
+    def _shard_of(self, course_id: str, shard_count: int) -> int:
+        """Stable shard number for a course (same on every machine and run)."""
+        return int(hashlib.md5(course_id.encode()).hexdigest(), 16) % shard_count
+    
+    def run_shard_scan(self, shard: int, shard_count: int, output_dir: str = 'shards',
+                       run_id: str = None, resume: bool = False) -> str:
+        """
+        Scan only this shard's share of the courses (split by a stable hash of the
+        course ID) against the local database, then write the resulting rows and
+        per-LMS totals to a compact shard file. No notifications are sent;
+        merge_shard_outputs() applies all shards and notifies once.
+        Progress is checkpointed like a full scan, per shard; with resume=True an
+        interrupted shard carries on and its earlier courses are still exported.
+        Returns the path of the shard file.
+        """
+        run_id = run_id or os.getenv('GITHUB_RUN_ID') or datetime.now().strftime('%Y%m%d%H')
+        
+        print("=" * 60)
+        print(f"🧩 Starting LMS Shard Scan {shard}/{shard_count} (run {run_id})")
+        print(f"⏰ Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        print("=" * 60)
+        
+        output = {
+            'run_id': run_id,
+            'shard': shard,
+            'shard_count': shard_count,
+            'lms': {}
+        }
+        crawled_ids = []
+        # A re-run of the workflow has a new run ID, so a shard resumes by its scope
+        self._start_checkpoint(resume, shard_checkpoint_scope(shard, shard_count), run_id)
+        
+        # The merge step records scan history, so the shard only notes what was down
+        unreachable = self._preflight(list(LMS_BASE_URLS), record_history=False)
+        for lms_name, reason in unreachable.items():
+            output['lms'][lms_name] = {'success': False, 'unreachable': True, 'error': reason}
+        if len(unreachable) < len(LMS_BASE_URLS):
+            self.setup_driver()
+        
+        try:
+            for lms_name in LMS_BASE_URLS:
+                if lms_name in unreachable:
+                    continue
+                print(f"\n🔍 Scanning {lms_name}...")
+                login = self._login(lms_name)
+                if not login['success']:
+                    output['lms'][lms_name] = {'success': False, 'error': login.get('error')}
+                    continue
+                
+                courses = self._get_enrolled_courses(lms_name, lambda: self._discover_courses(lms_name))
+                mine = [c for c in courses if self._shard_of(c['course_id'], shard_count) == shard]
+                print(f"  {len(mine)} of {len(courses)} courses in this shard")
+                
+                scanned = self._scrape_courses(mine, lms_name)
+                # Resumed courses were written before the interruption and are exported again
+                crawled_ids.extend(c['course_id'] for c in scanned if not c.get('unchanged'))
+                # A course that failed to crawl keeps the change feeds where they are (see _scrape_courses)
+                covered = {c['course_id'] for c in scanned if c.get('crawled') or c.get('unchanged') or c.get('resumed')}
+                total_courses, total_activities, new_activities = self._summarize_courses(scanned)
+                complete = all(c['course_id'] in covered for c in mine)
+                output['lms'][lms_name] = {
+                    'success': True,
+                    'courses': total_courses,
+                    'activities': total_activities,
+                    'new_activities': new_activities,
+                    # When the interrupted run started, if this is a resume
+                    'checkpoint': self.checkpoint['state']['lms'][lms_name]['scan_started'] if complete else None
+                }
+                if self._lms_crawl_complete(lms_name):
+                    self._checkpoint_lms(lms_name, status='done')
+            
+            if all(output['lms'][lms_name].get('checkpoint') for lms_name in LMS_BASE_URLS):
+                self.db.finish_scan_checkpoint(self.checkpoint['run_id'])
+            else:
+                print(f"\n💾 Shard incomplete; continue it with: python scraper.py --shard {shard}/{shard_count} --resume")
+        finally:
+            self.close_driver()
+            self.checkpoint = None
+        
+        output['rows'] = self.db.export_course_rows(crawled_ids, list(LMS_BASE_URLS))
+        
+        os.makedirs(output_dir, exist_ok=True)
+        path = os.path.join(output_dir, f"shard-{shard}-of-{shard_count}.json.gz")
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            json.dump(output, f, separators=(',', ':'))
+        
+        print(f"\n✅ Shard {shard}/{shard_count} written to {path} ({len(crawled_ids)} courses crawled)")
+        return path
+    
+    def merge_shard_outputs(self, paths: List[str]) -> bool:
+        """
+        Apply shard files to the database in shard order. Each shard of a run is
+        applied at most once, so a merge can safely be repeated. Once every shard
+        of the run is in, scan history, change-feed checkpoints and notifications
+        are handled exactly once. Returns True if the run is complete.
+        """
+        files = []
+        for path in paths:
+            if os.path.isdir(path):
+                files.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                             if name.endswith('.json.gz'))
+            else:
+                files.append(path)
+        
+        shards = []
+        for path in files:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                shards.append(json.load(f))
+        
+        if not shards:
+            print("❌ No shard files found")
+            return False
+        
+        run_ids = {s['run_id'] for s in shards}
+        if len(run_ids) > 1:
+            print(f"❌ Shard files come from different runs: {', '.join(sorted(run_ids))}")
+            return False
+        
+        run_id = shards[0]['run_id']
+        shard_count = shards[0]['shard_count']
+        shards.sort(key=lambda s: s['shard'])
+        
+        print(f"🧩 Merging {len(shards)} shard(s) of run {run_id}")
+        for output in shards:
+            if self.db.merge_shard_rows(run_id, output['shard'], output['rows']):
+                rows = sum(len(r) for r in output['rows'].values())
+                print(f"  ✅ Shard {output['shard']}/{shard_count}: {rows} rows merged")
+            else:
+                print(f"  ⏭️ Shard {output['shard']}/{shard_count}: already merged")
+        
+        missing = sorted(set(range(shard_count)) - {s['shard'] for s in shards})
+        if missing:
+            print(f"⚠️ Missing shard(s) {missing}; notifications wait until every shard is merged")
+            return False
+        
+        if not self.db.mark_scan_run_finished(run_id):
+            print(f"✅ Run {run_id} was already completed")
+            return True
+        
+        total_new_activities = 0
+        for lms_name in LMS_BASE_URLS:
+            results = [s['lms'][lms_name] for s in shards if lms_name in s['lms']]
+            succeeded = [r for r in results if r['success']]
+            if not succeeded:
+                error = next((r.get('error') for r in results), None)
+                status = 'unreachable' if results and all(r.get('unreachable') for r in results) else 'failed'
+                self.db.add_scan_history(lms_name, 0, 0, 0, status, error)
+                continue
+            
+            new_activities = sum(r['new_activities'] for r in succeeded)
+            self.db.add_scan_history(lms_name, sum(r['courses'] for r in succeeded),
+                                     sum(r['activities'] for r in succeeded), new_activities, 'success')
+            total_new_activities += new_activities
+            
+            # Only advance the change feeds when every shard covered every course of this LMS
+            if len(succeeded) == shard_count and all(r['checkpoint'] for r in succeeded):
+                self.db.set_change_feed_checkpoint(lms_name, min(r['checkpoint'] for r in succeeded))
+        
+        try:
+            self._send_new_activity_notifications(total_new_activities)
+            self._send_deadline_reminders()
+        except Exception as e:
+            print(f"⚠️ Error sending notifications: {str(e)}")
+        
+        print(f"✅ Run {run_id} merged")
+        return True
+    
+    def _preflight(self, lms_names: List[str], record_history: bool = True) -> Dict[str, str]:
+        """
+        Probe the given LMSs in parallel before any browser work. Returns
+        {lms_name: reason} for the unreachable ones, which are recorded in
+        scan history with status 'unreachable' unless record_history is False.
+        """
+        if not lms_names or PREFLIGHT_TIMEOUT <= 0:
+            return {}
+        
+        print(f"\n📡 Checking {', '.join(lms_names)} reachability...")
+        pool = ThreadPoolExecutor(max_workers=len(lms_names))
+        probes = {lms_name: pool.submit(self._probe_lms, lms_name) for lms_name in lms_names}
+        # DNS lookups can't be given a timeout, so bound the probes as a whole
+        wait(probes.values(), timeout=PREFLIGHT_TIMEOUT * 4)
+        pool.shutdown(wait=False)
+        
+        unreachable = {}
+        for lms_name, probe in probes.items():
+            if not probe.done():
+                reason = 'pre-flight probe timed out'
+            else:
+                reason = probe.result()
+            
+            if reason:
+                print(f"  ❌ {lms_name} unreachable: {reason}")
+                unreachable[lms_name] = reason
+                if record_history:
+                    self.db.add_scan_history(lms_name, 0, 0, 0, 'unreachable', reason)
+            else:
+                print(f"  ✅ {lms_name} is up")
+        
+        return unreachable
+    
+    def _probe_lms(self, lms_name: str) -> Optional[str]:
+        """Resolve, connect and HEAD an LMS login page. Returns None if it answered, else why not."""
+        url = urlparse(f"{LMS_BASE_URLS[lms_name]}/login/index.php")
+        host, port = url.hostname, url.port or 443
+        
+        try:
+            address = socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)[0][4]
+        except socket.gaierror as e:
+            return f"DNS lookup failed ({e})"
+        
+        try:
+            sock = socket.create_connection(address[:2], timeout=PREFLIGHT_TIMEOUT)
+        except OSError as e:
+            return f"TCP connect to {address[0]}:{port} failed ({e})"
+        
+        try:
+            try:
+                sock = ssl.create_default_context().wrap_socket(sock, server_hostname=host)
+            except ssl.SSLCertVerificationError:
+                # Reachability is the question here, not trust; let the browser judge the certificate
+                sock = socket.create_connection(address[:2], timeout=PREFLIGHT_TIMEOUT)
+                context = ssl.create_default_context()
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+                sock = context.wrap_socket(sock, server_hostname=host)
+            
+            conn = http.client.HTTPSConnection(host, port, timeout=PREFLIGHT_TIMEOUT)
+            conn.sock = sock
+            conn.request('HEAD', url.path, headers={'User-Agent': 'LMS-Activity-Monitor preflight'})
+            status = conn.getresponse().status
+        except (OSError, http.client.HTTPException) as e:
+            return f"TLS/HTTP check failed ({e})"
+        finally:
+            sock.close()
+        
+        if status >= 500:
+            return f"login page answered HTTP {status}"
+        return None
+    
+    def _login(self, lms_name: str) -> Dict[str, Any]:
+        """Log in to the given LMS."""
+        if lms_name == 'OUSL':
+            return self.login_ousl()
+        return self.login_rusl()
+    
+    def _discover_courses(self, lms_name: str) -> List[Dict[str, Any]]:
+        """Discover enrolled courses on the given LMS."""
+        if lms_name == 'OUSL':
+            return self._discover_ousl_courses()
+        return self._discover_rusl_courses()
+    
+    def watch(self, interval: int = WATCH_INTERVAL_SECONDS, sweep_minutes: float = WATCH_SWEEP_MINUTES):
+        """
+        Run continuously: keep a logged-in browser tab per LMS, poll the notification
+        feed every `interval` seconds and crawl only the courses that changed.
+        Runs until interrupted.
+        """
+        print("=" * 60)
+        print("👀 Starting LMS Watch Mode")
+        print(f"⏰ Polling every {interval}s, sweeping recent activity every {sweep_minutes:g} min")
+        print("=" * 60)
+        
+        self.setup_driver()
+        sessions = {}
+        
+        try:
+            for lms_name in LMS_BASE_URLS:
+                session = self._open_watch_session(lms_name, first=not sessions)
+                if session:
+                    sessions[lms_name] = session
+            
+            if not sessions:
+                print("❌ Could not log in to any LMS, stopping watch mode")
+                return
+            
+            while True:
+                cycle_started = time.time()
+                
+                for lms_name, session in sessions.items():
+                    try:
+                        self._watch_cycle(lms_name, session, sweep_minutes)
+                    except Exception as e:
+                        print(f"⚠️ Watch cycle failed for {lms_name}: {e}")
+                
+                time.sleep(max(0, interval - (time.time() - cycle_started)))
+        
+        except KeyboardInterrupt:
+            print("\n🛑 Watch mode stopped")
+        finally:
+            self.close_driver()
+    
+    def _open_watch_session(self, lms_name: str, first: bool) -> Optional[Dict[str, Any]]:
+        """Log in to an LMS in its own browser tab and load its course list."""
+        print(f"\n🔑 Opening {lms_name} session...")
+        
+        if not first:
+            self.driver.switch_to.new_window('tab')
+        
+        started = int(time.time())
+        login = self._login(lms_name)
+        if not login['success']:
+            self.db.add_scan_history(lms_name, 0, 0, 0, 'failed', login.get('error'))
+            return None
+        
+        courses = self._get_enrolled_courses(lms_name, lambda: self._discover_courses(lms_name))
+        retry = set()
+        
+        # Without a checkpoint there is nothing to compare against, so start with a normal scan
+        if self.db.get_change_feed_checkpoint(lms_name) is None:
+            results = self._scrape_courses(courses, lms_name)
+            new_activities = sum(sum(1 for a in c['activities'] if a.get('is_new')) for c in results)
+            self._send_new_activity_notifications(new_activities)
+            
+            # A failed course leaves the checkpoint unset; the cycles retry it and poll from here
+            done = {r['course_id'] for r in results if r.get('crawled') or r.get('unchanged') or r.get('resumed')}
+            retry = {course['course_id'] for course in courses} - done
+        
+        self.driver.get(f"{LMS_BASE_URLS[lms_name]}/my/")
+        
+        return {
+            'window': self.driver.current_window_handle,
+            'courses': courses,
+            'started': started,
+            'retry': retry,
+            'last_sweep': self.db.get_change_feed_checkpoint(lms_name) or started
+        }
+    
+    def _watch_cycle(self, lms_name: str, session: Dict[str, Any], sweep_minutes: float):
+        """Poll one LMS for changes and crawl the courses that changed."""
+        self.driver.switch_to.window(session['window'])
+        
+        # Until the first fully successful crawl there is no checkpoint; poll from the session start
+        since = self.db.get_change_feed_checkpoint(lms_name) or session['started']
+        polled_at = int(time.time())
+        
+        notifications = self._poll_notifications(since)
+        if notifications is None:
+            # Usually an expired session; log in again and retry once
+            print(f"🔑 {lms_name} session expired, logging in again...")
+            if not self._login(lms_name)['success']:
+                return
+            self.driver.get(f"{LMS_BASE_URLS[lms_name]}/my/")
+            notifications = self._poll_notifications(since)
+            if notifications is None:
+                # Keep the checkpoint, so the next cycle asks for these notifications again
+                print(f"⚠️ {lms_name} notification feed unavailable, retrying next cycle")
+                return
+        
+        courses = session['courses']
+        changed = set(session['retry'])
+        unattributed = 0
+        for notification in notifications:
+            course_id = self._course_for_notification(notification, lms_name)
+            if course_id:
+                changed.add(course_id)
+            else:
+                unattributed += 1
+        
+        # Notifications about brand-new items can't be mapped to a course yet,
+        # so they trigger an early sweep of the recent-activity pages
+        sweep_due = unattributed > 0 or polled_at - session['last_sweep'] >= sweep_minutes * 60
+        if sweep_due:
+            for course in courses:
+                if course['course_id'] not in changed and \
+                        self._course_has_recent_activity(course['url'], session['last_sweep']):
+                    changed.add(course['course_id'])
+        
+        if changed:
+            targets = [c for c in courses if c['course_id'] in changed]
+            print(f"\n🔔 {lms_name}: {len(targets)} course(s) changed at {datetime.now().strftime('%H:%M:%S')}")
+            
+            results = self._crawl_courses(targets, lms_name)
+            total_activities = sum(len(c['activities']) for c in results)
+            new_activities = sum(sum(1 for a in c['activities'] if a.get('is_new')) for c in results)
+            
+            self.db.add_scan_history(lms_name, len(results), total_activities, new_activities, 'success')
+            self._send_new_activity_notifications(new_activities)
+            
+            crawled = {result['course_id'] for result in results if result.get('crawled')}
+            session['retry'] = {course['course_id'] for course in targets} - crawled
+            if session['retry']:
+                # The next cycle polls from the same point and crawls the failed courses again
+                print(f"⚠️ {len(session['retry'])} {lms_name} course(s) could not be crawled, retrying next cycle")
+                self.driver.get(f"{LMS_BASE_URLS[lms_name]}/my/")
+                return
+        
+        self.db.set_change_feed_checkpoint(lms_name, polled_at)
+        if sweep_due:
+            session['last_sweep'] = polled_at
+        
+        # Crawls and sweeps navigate away; park the tab back on the dashboard for the next poll
+        if sweep_due or changed:
+            self.driver.get(f"{LMS_BASE_URLS[lms_name]}/my/")
 
 def main():
     """Main entry point."""
@@ -1031,6 +2330,35 @@ def main():
                        help='Run browser in headless mode')
     parser.add_argument('--test-email', action='store_true',
                        help='Send a test email')
+    parser.add_argument('--refresh-courses', action='store_true',
+                       help='Ignore the cached course list and rediscover enrolled courses')
+    parser.add_argument('--resume', action='store_true',
+                       help='Continue the last interrupted full scan (or, with --shard, that shard) from its checkpoint')
+    parser.add_argument('--full-crawl', action='store_true',
+                       help='Crawl every course instead of only those the change feeds report')
+    parser.add_argument('--course', action='append', dest='courses', metavar='COURSE_ID',
+                       help='Scan only this course (e.g. ousl_1437); can be repeated')
+    parser.add_argument('--lms', choices=list(LMS_BASE_URLS),
+                       help='Scan only this LMS')
+    parser.add_argument('--fetch-details', action='store_true', default=FETCH_ACTIVITY_DETAILS,
+                       help='Fetch the full page of new or changed activities (capped per scan)')
+    parser.add_argument('--enqueue', action='store_true',
+                       help='Queue a shared scan run for --worker processes (combine with --lms to limit it)')
+    parser.add_argument('--worker', action='store_true',
+                       help='Crawl courses from the open shared scan run alongside other workers')
+    parser.add_argument('--run-id',
+                       help='Run ID for --worker (default: the most recent open run) '
+                            'or --shard (default: $GITHUB_RUN_ID)')
+    parser.add_argument('--shard', metavar='I/N',
+                       help='Scan only shard I of N (courses split by a stable hash) and write a shard file')
+    parser.add_argument('--shard-dir', default='shards',
+                       help='Directory for shard files (default: shards)')
+    parser.add_argument('--merge', nargs='+', metavar='PATH',
+                       help='Merge shard files (or directories of them) into the database and notify once')
+    parser.add_argument('--watch', action='store_true',
+                       help='Run continuously, polling for changes and scanning only changed courses')
+    parser.add_argument('--watch-interval', type=int, default=WATCH_INTERVAL_SECONDS,
+                       help='Seconds between change polls in watch mode')
     
     args = parser.parse_args()
     
@@ -1040,8 +2368,41 @@ def main():
         notifier.send_test_email()
         return
     
-    scraper = MoodleScraper(headless=args.headless)
-    scraper.run_full_scan()
+    scraper = MoodleScraper(headless=args.headless, refresh_courses=args.refresh_courses,
+                            use_change_feeds=not args.full_crawl, fetch_details=args.fetch_details)
+    
+    if args.merge:
+        scraper.merge_shard_outputs(args.merge)
+        return
+    
+    if args.shard:
+        try:
+            shard, shard_count = (int(part) for part in args.shard.split('/'))
+        except ValueError:
+            parser.error('--shard must look like I/N, e.g. 0/3')
+        if not 0 <= shard < shard_count:
+            parser.error('--shard must be I/N with 0 <= I < N')
+        scraper.run_shard_scan(shard, shard_count, output_dir=args.shard_dir, run_id=args.run_id,
+                               resume=args.resume)
+        return
+    
+    if args.enqueue:
+        scraper.enqueue_scan(lms_name=args.lms)
+        return
+    
+    if args.worker:
+        scraper.run_worker(run_id=args.run_id)
+        return
+    
+    if args.watch:
+        scraper.watch(interval=args.watch_interval)
+        return
+    
+    if args.courses or args.lms:
+        scraper.run_targeted_scan(course_ids=args.courses, lms_name=args.lms)
+        return
+    
+    scraper.run_full_scan(resume=args.resume)
 
 if __name__ == '__main__':
     main()
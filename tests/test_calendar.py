@@ -0,0 +1,289 @@
+"""
+Test script for the calendar feed parser
+Checks that the streaming parser in calendar_scraper reads feeds exactly as
+icalendar does, that an unchanged feed is neither parsed nor synced, and
+that syncs replace old rows and roll back cleanly, and that recurring
+events are expanded within the queried window.
+No network needed: feeds are built here and served by a stub session.
+"""
+import os
+import sys
+import tempfile
+from datetime import datetime, timezone, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from icalendar import Calendar
+
+import ical_recurrence
+from calendar_scraper import CalendarScraper
+from database import Database
+
+NOW = datetime.now(timezone.utc)
+
+
+def ical_time(moment: datetime) -> str:
+    return moment.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def build_feed(events, stamp: datetime = NOW) -> bytes:
+    """An iCal body with CRLF line endings from a list of VEVENT line lists, exported at stamp."""
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//Moodle Pty Ltd//NONSGML Moodle Version 2023100900//EN',
+             'BEGIN:VTIMEZONE', 'TZID:Asia/Colombo', 'BEGIN:STANDARD', 'DTSTART:19700101T000000',
+             'TZOFFSETFROM:+0530', 'TZOFFSETTO:+0530', 'END:STANDARD', 'END:VTIMEZONE']
+    for event in events:
+        lines += ['BEGIN:VEVENT', f'DTSTAMP:{ical_time(stamp)}'] + event + ['END:VEVENT']
+    lines.append('END:VCALENDAR')
+    return ('\r\n'.join(lines) + '\r\n').encode('utf-8', errors='surrogateescape')
+
+
+def fold(line: str, width: int = 20) -> str:
+    """Fold a content line every few characters."""
+    return '\r\n '.join(line[i:i + width] for i in range(0, len(line), width))
+
+
+def fold_bytes(line: str, width: int = 20) -> str:
+    """Fold a content line every few bytes, even inside multi-byte characters (icalendar can't read these)."""
+    data = line.encode('utf-8')
+    parts = [data[i:i + width] for i in range(0, len(data), width)]
+    return b'\r\n '.join(parts).decode('utf-8', errors='surrogateescape')
+
+
+SAMPLE_EVENTS = [
+    # Folded lines and escaped text
+    [fold('SUMMARY:EEX3467 Mini project — ප්‍රොජෙක්ට් submission'), 'UID:1@oulms.ou.ac.lk',
+     f'DTSTART:{ical_time(NOW + timedelta(days=3))}',
+     fold('DESCRIPTION:Upload the report\\, slides and code\\nDue at 11:59 PM'),
+     'LOCATION:Online', 'SEQUENCE:2', 'LAST-MODIFIED:20250101T080000Z'],
+    # Quoted TZID parameter: the time is Colombo time, not UTC
+    ['SUMMARY:Quiz 2 closes', 'UID:2@oulms.ou.ac.lk',
+     f'DTSTART;TZID="Asia/Colombo":{(NOW + timedelta(days=5)).strftime("%Y%m%dT%H%M%S")}'],
+    ['SUMMARY:Lab session', 'UID:3@oulms.ou.ac.lk',
+     f'DTSTART;VALUE=DATE:{(NOW + timedelta(days=7)).strftime("%Y%m%d")}'],
+    # A VALARM's DESCRIPTION and TRIGGER belong to the alarm, not the event
+    ['SUMMARY:Assignment 3 due', 'UID:4@oulms.ou.ac.lk', 'BEGIN:VALARM', 'ACTION:DISPLAY',
+     'DESCRIPTION:Reminder', 'TRIGGER:-PT15M', 'END:VALARM',
+     f'DTSTART:{ical_time(NOW + timedelta(days=9))}', 'DESCRIPTION:Submit on the LMS'],
+    # A weekly series that starts in the future
+    ['SUMMARY:Weekly tutorial', 'UID:5@oulms.ou.ac.lk',
+     f'DTSTART:{ical_time(NOW + timedelta(days=2))}', 'RRULE:FREQ=WEEKLY;COUNT=4'],
+    # Past events are left out
+    ['SUMMARY:Old quiz', 'UID:6@oulms.ou.ac.lk', f'DTSTART:{ical_time(NOW - timedelta(days=30))}'],
+]
+
+
+def icalendar_events(content: bytes, lms_name: str):
+    """The upcoming events as the icalendar-based parser used to read them (floating times as UTC)."""
+    events = []
+    for component in Calendar.from_ical(content).walk('VEVENT'):
+        start = component.get('dtstart').dt
+        if not isinstance(start, datetime):
+            start = datetime.combine(start, datetime.min.time())
+        if start.tzinfo is None:
+            start = start.replace(tzinfo=timezone.utc)
+        if start <= NOW:
+            continue
+        last_modified = component.get('last-modified')
+        events.append({
+            'title': str(component.get('summary', 'Untitled Event')),
+            'date': start,
+            'description': str(component.get('description', '')),
+            'location': str(component.get('location', '')),
+            'uid': str(component.get('uid', '')),
+            'sequence': int(component.get('sequence', 0)),
+            'last_modified': last_modified.dt.isoformat() if last_modified else None,
+            'recurrence': ('RRULE:' + component['rrule'].to_ical().decode()) if 'rrule' in component else None,
+        })
+    return sorted(events, key=lambda event: event['date'])
+
+
+def test_parser_matches_icalendar():
+    feed = build_feed(SAMPLE_EVENTS)
+    parsed = CalendarScraper().parse_calendar(feed, 'OUSL')
+    expected = icalendar_events(feed, 'OUSL')
+    assert [event['uid'] for event in parsed] == [event['uid'] for event in expected]
+    for event, reference in zip(parsed, expected):
+        for key, value in reference.items():
+            assert event[key] == value, (key, event[key], value)
+    
+    colombo = next(event for event in parsed if event['uid'] == '2@oulms.ou.ac.lk')
+    assert colombo['date'].utcoffset() == timedelta(hours=5, minutes=30)
+    
+    # Folds inside a UTF-8 character and chunk boundaries anywhere in the body don't change the result
+    byte_folded = [[fold_bytes(line.replace('\r\n ', '')) if line.startswith('SUMMARY') else line
+                    for line in event] for event in SAMPLE_EVENTS]
+    assert CalendarScraper().parse_calendar(build_feed(byte_folded), 'OUSL') == parsed
+    chunks = [feed[i:i + 7] for i in range(0, len(feed), 7)]
+    assert CalendarScraper().parse_calendar_stream(chunks, 'OUSL') == parsed
+
+
+def test_quoted_parameters():
+    name, params, value = ical_recurrence.split_content_line(
+        b'DTSTART;TZID="Asia/Colombo";X-NOTE="a;b:c":20300105T100000')
+    assert (name, params, value) == ('DTSTART', {'TZID': 'Asia/Colombo', 'X-NOTE': 'a;b:c'}, '20300105T100000')
+    assert ical_recurrence.split_content_line(b'SUMMARY:Quiz;1: intro') == ('SUMMARY', {}, 'Quiz;1: intro')
+
+
+class StubResponse:
+    def __init__(self, body: bytes):
+        self.body = body
+        self.status_code = 200
+        self.headers = {}
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        return False
+    
+    def raise_for_status(self):
+        pass
+    
+    def iter_content(self, chunk_size):
+        return (self.body[i:i + chunk_size] for i in range(0, len(self.body), chunk_size))
+
+
+class StubSession:
+    def __init__(self, body: bytes):
+        self.body = body
+    
+    def get(self, url, **kwargs):
+        return StubResponse(self.body)
+
+
+def test_unchanged_feed_is_not_parsed():
+    with tempfile.TemporaryDirectory() as tmp:
+        scraper = CalendarScraper(Database(os.path.join(tmp, 'calendar.db')))
+        scraper.session = StubSession(build_feed(SAMPLE_EVENTS))
+        
+        update = scraper.fetch_feed_update('OUSL', scraper.ousl_calendar_url)
+        assert update['changed'] and len(update['events']) == 5
+        scraper.mark_feed_synced(update)
+        
+        # Only the DTSTAMP lines differ on the next export
+        scraper.session = StubSession(build_feed(SAMPLE_EVENTS, stamp=NOW + timedelta(minutes=5)))
+        
+        def fail(*args, **kwargs):
+            raise AssertionError('unchanged feed was parsed')
+        scraper.parse_calendar_stream = fail
+        assert scraper.fetch_feed_update('OUSL', scraper.ousl_calendar_url) == {'lms_name': 'OUSL', 'changed': False}
+
+
+
+def calendar_rows(db: Database, lms_name: str) -> dict:
+    """{deadline_id: title} of an LMS's stored calendar deadlines."""
+    conn = db.get_connection()
+    rows = conn.execute("SELECT deadline_id, title FROM deadlines WHERE source = 'calendar' AND lms_name = ?",
+                        (lms_name,)).fetchall()
+    conn.close()
+    return dict(rows)
+
+
+def test_first_sync_replaces_legacy_ids():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'calendar.db'))
+        scraper = CalendarScraper(db)
+        scraper.session = StubSession(build_feed(SAMPLE_EVENTS))
+        events = scraper.parse_calendar(build_feed(SAMPLE_EVENTS), 'OUSL')
+        
+        # Rows stored by the old sync, keyed by date + title
+        for event in events:
+            db.add_deadline(scraper.event_deadline_id(dict(event, uid='')), event['title'],
+                            event['date'].isoformat(), 'OUSL', source='calendar')
+        
+        # (The stub serves the same feed for both LMSs)
+        summary = scraper.sync_to_database()
+        assert calendar_rows(db, 'OUSL') == {scraper.event_deadline_id(event): event['title'] for event in events}
+        assert summary['removed'] == len(events) and summary['added'] == 2 * len(events)
+        
+        # Later syncs of a changed export leave the UID-keyed rows alone
+        scraper.session = StubSession(build_feed(SAMPLE_EVENTS + [['SUMMARY:Extra', 'UID:7@oulms.ou.ac.lk',
+                                                                   f'DTSTART:{ical_time(NOW + timedelta(days=4))}']]))
+        summary = scraper.sync_to_database()
+        assert (summary['added'], summary['updated'], summary['removed']) == (2, 0, 0)
+
+
+def test_failed_sync_is_rolled_back():
+    row = {'version': '1', 'description': '', 'deadline_date': (NOW + timedelta(days=3)).isoformat(),
+           'location': '', 'recurrence': None}
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'calendar.db'))
+        db.sync_calendar_events('OUSL', [dict(row, deadline_id='cal_a', title='Quiz 1')])
+        
+        # The second insert fails (a title is required) after the first went in and before cal_a is deleted
+        try:
+            db.sync_calendar_events('OUSL', [dict(row, deadline_id='cal_b', title='Quiz 2'),
+                                             dict(row, deadline_id='cal_c', title=None)])
+        except Exception:
+            pass
+        else:
+            raise AssertionError('sync with a missing title succeeded')
+        
+        # The next write on this thread must not commit any of the failed sync
+        db.add_deadline('scraped_1', 'TMA 1', row['deadline_date'], 'OUSL')
+        assert calendar_rows(db, 'OUSL') == {'cal_a': 'Quiz 1'}
+
+
+
+def test_recurrence_window():
+    start = '2030-01-07T09:00:00+00:00'
+    monday = lambda day, month=1: datetime(2030, month, day, 9, tzinfo=timezone.utc)
+    window = (datetime(2030, 1, 10, tzinfo=timezone.utc), datetime(2030, 3, 1, tzinfo=timezone.utc))
+    
+    # UNTIL is inclusive and EXDATE drops one week
+    series = 'RRULE:FREQ=WEEKLY;UNTIL=20300204T090000Z\nEXDATE:20300121T090000Z'
+    assert ical_recurrence.expand_recurrence(start, series, *window) == (monday(14), monday(28), monday(4, 2))
+    assert ical_recurrence.expand_recurrence(start, series, datetime(2030, 1, 20, tzinfo=timezone.utc),
+                                              datetime(2030, 1, 29, tzinfo=timezone.utc)) == (monday(28),)
+    
+    # A date-only UNTIL covers that whole day
+    series = 'RRULE:FREQ=WEEKLY;UNTIL=20300128'
+    assert ical_recurrence.expand_recurrence(start, series, *window) == (monday(14), monday(21), monday(28))
+
+
+def test_series_started_in_the_past():
+    start = (NOW - timedelta(days=20)).replace(microsecond=0)
+    skipped = start + timedelta(weeks=4)
+    feed = build_feed([
+        ['SUMMARY:Weekly lab', 'UID:8@oulms.ou.ac.lk', f'DTSTART:{ical_time(start)}',
+         'RRULE:FREQ=WEEKLY', f'EXDATE:{ical_time(skipped)}'],
+        # Every occurrence of this one is over
+        ['SUMMARY:Finished series', 'UID:9@oulms.ou.ac.lk', f'DTSTART:{ical_time(NOW - timedelta(days=30))}',
+         'RRULE:FREQ=DAILY;COUNT=3'],
+    ])
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'calendar.db'))
+        scraper = CalendarScraper(db)
+        events = scraper.parse_calendar(feed, 'OUSL')
+        assert [event['uid'] for event in events] == ['8@oulms.ou.ac.lk']
+        
+        scraper.session = StubSession(feed)
+        scraper.sync_to_database()
+        
+        # Only the upcoming weeks are listed, each as its own deadline
+        upcoming = [deadline for deadline in db.get_all_upcoming_deadlines(days_ahead=30)
+                    if deadline['lms_name'] == 'OUSL']
+        expected = [start + timedelta(weeks=week) for week in (3, 5, 6, 7)]
+        assert [datetime.fromisoformat(deadline['deadline_date']) for deadline in upcoming] == expected
+        assert len({deadline['id'] for deadline in upcoming}) == len(expected)
+
+
+if __name__ == '__main__':
+    print("📅 Testing Calendar Feeds\n")
+    print("=" * 60)
+    
+    test_parser_matches_icalendar()
+    print("✅ Streaming parser output identical to icalendar")
+    test_quoted_parameters()
+    print("✅ Quoted parameter values are unquoted")
+    test_unchanged_feed_is_not_parsed()
+    print("✅ Unchanged feeds are neither parsed nor synced")
+    test_first_sync_replaces_legacy_ids()
+    print("✅ The first sync replaces rows stored under date + title IDs")
+    test_failed_sync_is_rolled_back()
+    print("✅ A sync failing part-way leaves the stored events as they were")
+    test_recurrence_window()
+    print("✅ Recurring events expand within the window, honouring UNTIL and EXDATE")
+    test_series_started_in_the_past()
+    print("✅ A series that started in the past lists its upcoming occurrences")
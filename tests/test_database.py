@@ -0,0 +1,191 @@
+"""
+Test script for the database schema
+Checks that migrations bring new and pre-versioning databases to the current
+schema version (without merging rows of different modules), that course scans
+remove and restore forum posts with their forum (removed rows leave the
+activity lists), and that the dashboard and notification queries use indexes
+instead of scanning and sorting whole tables.
+"""
+import os
+import sys
+import sqlite3
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import database
+from database import Database
+
+# Tables the hot queries must never scan in full
+INDEXED_TABLES = ('activities', 'scan_history', 'deadlines')
+
+
+def captured_queries(db, call):
+    """Run call(db) and return the SELECT statements it sent to SQLite, with parameters bound."""
+    statements = []
+    conn = db.get_connection()
+    conn.set_trace_callback(statements.append)
+    try:
+        call(db)
+    finally:
+        conn.set_trace_callback(None)
+        conn.close()
+    return [sql for sql in statements if sql.lstrip().upper().startswith('SELECT')]
+
+
+def query_plan(db, sql):
+    conn = db.get_connection()
+    plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql)]
+    conn.close()
+    return plan
+
+
+def test_new_database_is_current():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'new.db'))
+        conn = db.get_connection()
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == len(database.MIGRATIONS)
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        conn.close()
+        assert {'idx_activities_course_first_seen', 'idx_activities_new', 'idx_scan_history_time'} <= indexes
+
+
+def test_legacy_database_is_migrated():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'legacy.db')
+        legacy = sqlite3.connect(path)
+        legacy.executescript("""
+            CREATE TABLE courses (id INTEGER PRIMARY KEY AUTOINCREMENT, course_id TEXT UNIQUE NOT NULL,
+                course_name TEXT NOT NULL, course_url TEXT NOT NULL, lms_name TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+            CREATE TABLE activities (id INTEGER PRIMARY KEY AUTOINCREMENT, activity_id TEXT UNIQUE NOT NULL,
+                course_id TEXT NOT NULL, activity_type TEXT NOT NULL, title TEXT NOT NULL, description TEXT,
+                url TEXT, deadline TEXT, first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP, is_new BOOLEAN DEFAULT 1,
+                metadata TEXT);
+            INSERT INTO courses (course_id, course_name, course_url, lms_name)
+                VALUES ('ousl_1', 'EEX3467 Software Engineering', 'https://example.org/course/view.php?id=1', 'OUSL');
+            INSERT INTO activities (activity_id, course_id, activity_type, title, url)
+                VALUES ('legacy-hash', 'ousl_1', 'assign', 'Assignment 1', 'https://example.org/mod/assign/view.php?id=42');
+        """)
+        legacy.close()
+        
+        db = Database(path)
+        conn = db.get_connection()
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == len(database.MIGRATIONS)
+        conn.close()
+        activities = db.get_activities_by_course('ousl_1')
+        assert [a['title'] for a in activities] == ['Assignment 1']
+        assert activities[0]['activity_id'] != 'legacy-hash'
+
+
+def test_migration_keeps_other_modules_apart():
+    quiz_url = 'https://oulms.ou.ac.lk/mod/quiz/view.php?id=63645'
+    site_forum_url = 'https://oulms.ou.ac.lk/mod/forum/view.php?id=136'
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'legacy.db')
+        legacy = sqlite3.connect(path)
+        legacy.executescript(f"""
+            CREATE TABLE courses (id INTEGER PRIMARY KEY AUTOINCREMENT, course_id TEXT UNIQUE NOT NULL,
+                course_name TEXT NOT NULL, course_url TEXT NOT NULL, lms_name TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+            CREATE TABLE activities (id INTEGER PRIMARY KEY AUTOINCREMENT, activity_id TEXT UNIQUE NOT NULL,
+                course_id TEXT NOT NULL, activity_type TEXT NOT NULL, title TEXT NOT NULL, description TEXT,
+                url TEXT, deadline TEXT, first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP, is_new BOOLEAN DEFAULT 1,
+                metadata TEXT);
+            INSERT INTO courses (course_id, course_name, course_url, lms_name) VALUES
+                ('ousl_1488', 'EEY4189 Programming', 'https://oulms.ou.ac.lk/course/view.php?id=1488', 'OUSL'),
+                ('ousl_338', 'EEX3467 Software Engineering', 'https://oulms.ou.ac.lk/course/view.php?id=338', 'OUSL');
+            -- The H5P row was stored with the quiz's link, the site forum under both courses
+            INSERT INTO activities (activity_id, course_id, activity_type, title, url) VALUES
+                ('hash-quiz', 'ousl_1488', 'quiz', 'PS02 Activity 2.1 - Abstraction', '{quiz_url}'),
+                ('hash-h5p', 'ousl_1488', 'h5pactivity', 'PS02 Activity 2.1 - Abstraction', '{quiz_url}'),
+                ('hash-site-1', 'ousl_1488', 'unknown', 'Site announcements', '{site_forum_url}'),
+                ('hash-site-2', 'ousl_338', 'unknown', 'Site announcements', '{site_forum_url}');
+        """)
+        legacy.close()
+        
+        db = Database(path)
+        conn = db.get_connection()
+        rows = set(conn.execute("SELECT activity_id, course_id, activity_type FROM activities"))
+        conn.close()
+        assert rows == {
+            ('ousl_cm_63645', 'ousl_1488', 'quiz'),
+            ('hash-h5p', 'ousl_1488', 'h5pactivity'),
+            ('hash-site-1', 'ousl_1488', 'unknown'),
+            ('hash-site-2', 'ousl_338', 'unknown'),
+        }
+
+
+def course_item(activity_id, activity_type, title, url=None, metadata=None):
+    return {'activity_id': activity_id, 'type': activity_type, 'title': title, 'description': '',
+            'url': url, 'deadline': None, 'metadata': metadata, 'fingerprint': f'{activity_id}:{title}'}
+
+
+def test_forum_posts_follow_their_forum():
+    forum_url = 'https://oulms.ou.ac.lk/mod/forum/view.php?id=90311'
+    assignment = course_item('ousl_cm_90310', 'assign', 'TMA 1')
+    forum = course_item('ousl_cm_90311', 'forum', 'Announcements', forum_url)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'scan.db'))
+        db.add_course('ousl_1', 'OUSL', 'EEX3467 Software Engineering', 'https://oulms.ou.ac.lk/course/view.php?id=1')
+        db.apply_course_scan('ousl_1', [assignment, forum])
+        db.add_activity('ousl_d_501', 'ousl_1', 'forum_post', 'Announcements: Welcome',
+                        metadata={'forum_url': forum_url})
+        # Stored before posts recorded their forum
+        db.add_activity('ousl_d_17', 'ousl_1', 'forum_post', 'Old post')
+        
+        # A course without any forum leaves posts of unknown forums alone
+        diff = db.apply_course_scan('ousl_1', [assignment])
+        assert diff['removed'] == {'ousl_cm_90311', 'ousl_d_501'}
+        assert db.get_stats()['activities_by_type'] == {'assign': 1, 'forum_post': 1}
+        listed = {'ousl_cm_90310', 'ousl_d_17'}
+        assert {a['activity_id'] for a in db.get_activities_by_course('ousl_1')} == listed
+        assert {a['activity_id'] for a in db.get_recent_activities()} == listed
+        assert {a['activity_id'] for a in db.get_activities_by_lms('OUSL')} == listed
+        
+        # The forum coming back brings its posts back
+        diff = db.apply_course_scan('ousl_1', [assignment, forum])
+        assert diff['changed'] == {'ousl_cm_90311'} and not diff['removed']
+        assert db.get_removed_activity_ids(['ousl_cm_90311', 'ousl_d_501', 'ousl_d_17']) == set()
+        stats = db.get_stats()
+        assert stats['removed_activities'] == 0 and stats['activities_by_type']['forum_post'] == 2
+
+
+def test_hot_queries_use_indexes():
+    hot_queries = {
+        'get_activities_by_course': lambda db: db.get_activities_by_course('ousl_1'),
+        'get_activities_by_lms': lambda db: db.get_activities_by_lms('OUSL'),
+        'get_recent_activities': lambda db: db.get_recent_activities(),
+        'get_new_activities': lambda db: db.get_new_activities(),
+        'get_scan_history': lambda db: db.get_scan_history(),
+    }
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'plans.db'))
+        for name, call in hot_queries.items():
+            statements = captured_queries(db, call)
+            assert statements, name
+            for sql in statements:
+                plan = query_plan(db, sql)
+                assert not any('TEMP B-TREE' in step for step in plan), (name, plan)
+                for table in INDEXED_TABLES:
+                    full_scans = [step for step in plan
+                                  if step.split()[:2] in (['SCAN', table], ['SCAN', table[0]]) and 'INDEX' not in step]
+                    assert not full_scans, (name, plan)
+
+
+if __name__ == '__main__':
+    print("🗄️ Testing Database Schema\n")
+    print("=" * 60)
+    
+    test_new_database_is_current()
+    print(f"✅ New databases are created at schema version {len(database.MIGRATIONS)}")
+    test_legacy_database_is_migrated()
+    print("✅ Pre-versioning databases are migrated in place")
+    test_migration_keeps_other_modules_apart()
+    print("✅ Rows of other modules or courses sharing a link are not merged")
+    test_forum_posts_follow_their_forum()
+    print("✅ Forum posts are removed and restored with their forum")
+    test_hot_queries_use_indexes()
+    print("✅ Dashboard and notification queries use indexes (no full scans or sorts)")
@@ -0,0 +1,198 @@
+"""
+Test script for the batch date extractor
+Checks that date_extractor returns exactly what the original per-pattern
+extractor returned, and benchmarks both on a generated corpus of activity texts.
+"""
+import os
+import re
+import sys
+import time
+import random
+import tempfile
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import date_extractor
+from database import Database
+
+
+def legacy_extract_dates(text):
+    """The extractor as it was before date_extractor (one finditer per pattern)."""
+    dates = []
+    seen_dates = set()
+    
+    if not text:
+        return dates
+    
+    priority_patterns = [
+        r'(?:by|before|due on|due|deadline|submit by)\s*:?\s*(?:monday|tuesday|wednesday|thursday|friday|saturday|sunday)?,?\s*(\d{1,2})[/-](\d{1,2})[/-](\d{4})',
+        r'(?:by|before|due on|due|deadline|submit by)\s*:?\s*(?:monday|tuesday|wednesday|thursday|friday|saturday|sunday)?,?\s*(\d{4})[/-](\d{1,2})[/-](\d{1,2})',
+        r'(?:by|before|due on|due|deadline|submit by)\s*:?\s*(?:monday|tuesday|wednesday|thursday|friday|saturday|sunday)?,?\s*(\d{1,2})(?:st|nd|rd|th)?\s+([A-Za-z]+)\s+(\d{4})',
+        r'(?:deadline|due date)\s*:\s*(\d{4})[/-](\d{1,2})[/-](\d{1,2})',
+    ]
+    
+    for pattern in priority_patterns:
+        for match in re.finditer(pattern, text, re.IGNORECASE):
+            try:
+                date = legacy_parse_date_groups(match.groups())
+                if date and date not in seen_dates:
+                    dates.append(date)
+                    seen_dates.add(date)
+            except (ValueError, IndexError):
+                continue
+    
+    if not dates:
+        for match in re.finditer(r'\b(\d{4})[/-](\d{1,2})[/-](\d{1,2})\b', text, re.IGNORECASE):
+            try:
+                date = legacy_parse_date_groups(match.groups())
+                if date and date not in seen_dates:
+                    dates.append(date)
+                    seen_dates.add(date)
+            except (ValueError, IndexError):
+                continue
+    
+    dates.sort(reverse=True)
+    return dates
+
+
+def legacy_parse_date_groups(groups):
+    if len(groups) != 3:
+        return None
+    
+    if groups[0].isdigit() and groups[1].isdigit() and groups[2].isdigit():
+        if len(groups[0]) == 4:
+            return datetime(int(groups[0]), int(groups[1]), int(groups[2]), tzinfo=timezone.utc)
+        elif len(groups[2]) == 4:
+            return datetime(int(groups[2]), int(groups[1]), int(groups[0]), tzinfo=timezone.utc)
+    elif groups[1].isalpha():
+        months = {
+            'january': 1, 'february': 2, 'march': 3, 'april': 4,
+            'may': 5, 'june': 6, 'july': 7, 'august': 8,
+            'september': 9, 'october': 10, 'november': 11, 'december': 12,
+            'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
+            'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12
+        }
+        month = months.get(groups[1].lower())
+        if month:
+            return datetime(int(groups[2]), month, int(groups[0]), tzinfo=timezone.utc)
+    
+    return None
+
+
+EDGE_CASES = [
+    None,
+    '',
+    'Assignment 1',
+    'Submit by 15/10/2025',
+    'Due: Sunday, 19 October 2025',
+    'due on 3rd Nov 2025 and deadline: 2025-11-10',
+    'Deadline: 2025/10/15 (extended from 2025-10-01)',
+    'Lecture notes uploaded 2025-10-01',
+    'by 1 by 2025/10/15',
+    'due 31/02/2025 or due 30/02/2025',  # invalid days
+    'due 12 Smarch 2025',  # not a month
+    'DUE BY 5 MAY 2026',
+    'Released 2025-09-01, due 2025-13-01',  # invalid month after keyword, valid bare date
+    'dueby2025-10-15deadline:2025-10-16',
+    'Quiz closes before Friday, 7th March 2025 — ලකුණු 2025-03-01',
+    'Due ٢٥/١٠/٢٠٢٥',  # non-ASCII digits
+    'due date: 2025-1-5\ndeadline : 2025-01-06',
+    '2025-10-15 2025-10-15 2025-10-15',
+]
+
+WORDS = ['Assignment', 'Quiz', 'Lab', 'report', 'submit', 'upload', 'the', 'final', 'Tutorial',
+         'week', 'marks', 'Please', 'portal', 'group', 'project', 'on', 'at', 'via', 'LMS']
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+MONTH_WORDS = ['January', 'Feb', 'march', 'APRIL', 'May', 'June', 'Jul', 'August', 'Sept', 'oct', 'November', 'Dec']
+
+
+def build_corpus(size=5000, seed=44):
+    """Generate Moodle-like activity texts: mostly prose, some keyword and bare dates."""
+    rng = random.Random(seed)
+    
+    def date_phrase():
+        day, month, year = rng.randint(1, 31), rng.randint(1, 13), rng.choice([2024, 2025, 2026])
+        keyword = rng.choice(['by', 'before', 'due on', 'Due', 'deadline', 'Submit by', 'Deadline:', 'due date:'])
+        weekday = rng.choice(['', f'{rng.choice(DAYS)}, '])
+        return rng.choice([
+            f'{keyword} {weekday}{day}/{month}/{year}',
+            f'{keyword} {year}-{month:02d}-{day:02d}',
+            f'{keyword} {weekday}{day}th {rng.choice(MONTH_WORDS)} {year}',
+            f'{year}/{month}/{day}',
+        ])
+    
+    corpus = list(EDGE_CASES)
+    while len(corpus) < size:
+        parts = [rng.choice(WORDS) for _ in range(rng.randint(3, 60))]
+        for _ in range(rng.choice([0, 0, 1, 1, 2, 3])):
+            parts.insert(rng.randint(0, len(parts)), date_phrase())
+        corpus.append(' '.join(parts))
+    return corpus
+
+
+def test_matches_legacy_extractor():
+    corpus = build_corpus()
+    for text in corpus:
+        assert date_extractor.extract_dates(text) == legacy_extract_dates(text), text
+
+
+def test_batch_matches_single_texts():
+    corpus = build_corpus()
+    assert date_extractor.extract_dates_batch(corpus) == [legacy_extract_dates(text) for text in corpus]
+    assert date_extractor.extract_dates_batch([]) == []
+
+
+def test_extraction_cache():
+    corpus = build_corpus(500)
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'cache.db'))
+        cache = date_extractor.ExtractionCache(db, size=100)
+        assert cache.extract_batch(corpus) == date_extractor.extract_dates_batch(corpus)
+        
+        # A new cache (as on the next scan) answers from the database without extracting
+        cache = date_extractor.ExtractionCache(db, size=100)
+        extract = date_extractor.extract_dates_batch
+        date_extractor.extract_dates_batch = None
+        try:
+            assert cache.extract_batch(corpus) == extract(corpus)
+            assert len(cache._recent) == 100
+        finally:
+            date_extractor.extract_dates_batch = extract
+
+
+def benchmark(corpus, rounds=5):
+    def best_of(func):
+        best = None
+        for _ in range(rounds):
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+    
+    results = [
+        ('original (per pattern)', best_of(lambda: [legacy_extract_dates(text) for text in corpus])),
+        ('extract_dates (per text)', best_of(lambda: [date_extractor.extract_dates(text) for text in corpus])),
+        ('extract_dates_batch', best_of(lambda: date_extractor.extract_dates_batch(corpus))),
+    ]
+    
+    baseline = results[0][1]
+    for name, seconds in results:
+        print(f"   {name:<26} {len(corpus) / seconds:>10,.0f} texts/s  ({baseline / seconds:.1f}x)")
+
+
+if __name__ == '__main__':
+    print("📅 Testing Date Extractor\n")
+    print("=" * 60)
+    
+    test_matches_legacy_extractor()
+    print("✅ Output identical to the original extractor")
+    test_batch_matches_single_texts()
+    print("✅ Batch output identical to single-text output")
+    test_extraction_cache()
+    print("✅ Extraction cache returns stored results without extracting again")
+    
+    corpus = build_corpus(20000)
+    print(f"\n⏱️  Benchmark ({len(corpus):,} texts, best of 5)")
+    benchmark(corpus)
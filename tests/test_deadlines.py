@@ -0,0 +1,104 @@
+"""
+Test script for deadline de-duplication
+Checks that Database.cluster_deadlines groups the activity, calendar and scraped
+copies of one deadline, keeps different deadlines apart, and leaves the
+clusters of long-past deadlines alone.
+"""
+import os
+import sys
+import tempfile
+from datetime import datetime, timezone, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from database import Database, DEADLINE_CLUSTER_LOOKBACK_DAYS
+
+DUE = (datetime.now(timezone.utc) + timedelta(days=10)).replace(hour=18, minute=29, second=0, microsecond=0)
+
+
+def course_db(tmp: str) -> Database:
+    db = Database(os.path.join(tmp, 'deadlines.db'))
+    db.add_course('ousl_1', 'OUSL', 'EEX3467 Software Engineering', 'https://oulms.ou.ac.lk/course/view.php?id=1')
+    return db
+
+
+def stored_clusters(db: Database) -> dict:
+    """{activity or deadline ID: cluster ID} of every clustered row."""
+    conn = db.get_connection()
+    rows = conn.execute("""
+        SELECT activity_id, deadline_cluster FROM activities WHERE deadline_cluster IS NOT NULL
+        UNION ALL
+        SELECT deadline_id, cluster_id FROM deadlines WHERE cluster_id IS NOT NULL
+    """).fetchall()
+    conn.close()
+    return dict(rows)
+
+
+def test_course_code_title_variant():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = course_db(tmp)
+        db.add_activity('ousl_cm_101', 'ousl_1', 'assign', 'TMA 1', deadline=DUE.isoformat())
+        # The calendar copy names the course and is due at the same moment in Colombo time
+        db.add_deadline('cal_1', 'EEX3467 TMA01 is due', DUE.astimezone(timezone(timedelta(hours=5, minutes=30))).isoformat(),
+                        'OUSL', source='calendar')
+        
+        assert db.cluster_deadlines() == 1
+        assert stored_clusters(db) == {'ousl_cm_101': 'ousl_cm_101', 'cal_1': 'ousl_cm_101'}
+
+
+def test_numbers_keep_deadlines_apart():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = course_db(tmp)
+        db.add_activity('ousl_cm_101', 'ousl_1', 'assign', 'TMA 1', deadline=DUE.isoformat())
+        db.add_deadline('cal_2', 'EEX3467 TMA 2 due', DUE.isoformat(), 'OUSL', source='calendar')
+        db.add_deadline('scr_3', 'TMA 3 submission', DUE.isoformat(), 'OUSL', course_id='ousl_1')
+        
+        assert db.cluster_deadlines() == 0
+        assert stored_clusters(db) == {}
+
+
+def test_chained_merges():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = course_db(tmp)
+        # The activity and the scraped notice are too different to match each other,
+        # but both match the calendar event, so all three are one deadline
+        db.add_activity('ousl_cm_102', 'ousl_1', 'assign', 'Mini project report', deadline=DUE.isoformat())
+        db.add_deadline('cal_3', 'Mini project report upload', DUE.isoformat(), 'OUSL', source='calendar')
+        db.add_deadline('scr_4', 'Project report upload portal', (DUE + timedelta(hours=12)).isoformat(),
+                        'OUSL', course_id='ousl_1')
+        
+        assert db.cluster_deadlines() == 1
+        assert stored_clusters(db) == {'ousl_cm_102': 'ousl_cm_102', 'cal_3': 'ousl_cm_102',
+                                       'scr_4': 'ousl_cm_102'}
+
+
+def test_past_deadlines_keep_their_cluster():
+    past = datetime.now(timezone.utc) - timedelta(days=DEADLINE_CLUSTER_LOOKBACK_DAYS + 5)
+    with tempfile.TemporaryDirectory() as tmp:
+        db = course_db(tmp)
+        db.add_activity('ousl_cm_103', 'ousl_1', 'assign', 'TMA 1', deadline=past.isoformat())
+        db.add_deadline('cal_4', 'TMA 1', past.isoformat(), 'OUSL', source='calendar')
+        conn = db.get_connection()
+        conn.execute("UPDATE activities SET deadline_cluster = 'ousl_cm_103'")
+        conn.execute("UPDATE deadlines SET cluster_id = 'ousl_cm_103'")
+        conn.commit()
+        conn.close()
+        # An old copy that was never clustered is not compared any more either
+        db.add_deadline('scr_5', 'TMA 1 submission', past.isoformat(), 'OUSL', course_id='ousl_1')
+        
+        assert db.cluster_deadlines() == 0
+        assert stored_clusters(db) == {'ousl_cm_103': 'ousl_cm_103', 'cal_4': 'ousl_cm_103'}
+
+
+if __name__ == '__main__':
+    print("🔗 Testing Deadline De-duplication\n")
+    print("=" * 60)
+    
+    test_course_code_title_variant()
+    print("✅ A calendar title with the course code joins the activity's deadline")
+    test_numbers_keep_deadlines_apart()
+    print("✅ TMA 1, 2 and 3 stay separate deadlines")
+    test_chained_merges()
+    print("✅ Copies matching through a third copy form one cluster")
+    test_past_deadlines_keep_their_cluster()
+    print("✅ Long-past deadlines keep their clusters and are not re-compared")
@@ -0,0 +1,87 @@
+"""
+Test script for the enrolled-course cache
+Checks that MoodleScraper reuses the cached course list while the dashboard
+shows the same courses, and rediscovers them once a course is added to or
+dropped from the dashboard.
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from database import Database
+from scraper import MoodleScraper
+
+DASHBOARD = 'https://oulms.ou.ac.lk/my/'
+
+
+class DashboardDriver:
+    """Stands in for the browser: the dashboard links the given course numbers."""
+    
+    def __init__(self, course_nums):
+        self.course_nums = course_nums
+        self.current_url = DASHBOARD
+    
+    def get(self, url):
+        self.current_url = url
+    
+    @property
+    def page_source(self):
+        return ''.join(f'<a href="https://oulms.ou.ac.lk/course/view.php?id={n}">Course {n}</a>'
+                       for n in self.course_nums)
+
+
+def make_scraper(db_path: str, course_nums) -> MoodleScraper:
+    scraper = MoodleScraper.__new__(MoodleScraper)
+    scraper.refresh_courses = False
+    scraper.db = Database(db_path)
+    scraper.driver = DashboardDriver(course_nums)
+    return scraper
+
+
+def enrolled(scraper: MoodleScraper, discoveries: list) -> list:
+    """Course IDs _get_enrolled_courses returns, noting each rediscovery."""
+    def discover():
+        discoveries.append(True)
+        return [{'course_id': f'ousl_{n}', 'name': f'Course {n}',
+                 'url': f'https://oulms.ou.ac.lk/course/view.php?id={n}'}
+                for n in scraper.driver.course_nums]
+    return sorted(c['course_id'] for c in scraper._get_enrolled_courses('OUSL', discover))
+
+
+def test_unchanged_dashboard_uses_cache():
+    with tempfile.TemporaryDirectory() as tmp:
+        discoveries = []
+        path = os.path.join(tmp, 'enrollment.db')
+        assert enrolled(make_scraper(path, [1, 2, 3]), discoveries) == ['ousl_1', 'ousl_2', 'ousl_3']
+        # The dashboard lists the same courses in a different order
+        assert enrolled(make_scraper(path, [3, 1, 2]), discoveries) == ['ousl_1', 'ousl_2', 'ousl_3']
+        assert len(discoveries) == 1
+
+
+def test_dropped_course_triggers_rediscovery():
+    with tempfile.TemporaryDirectory() as tmp:
+        discoveries = []
+        path = os.path.join(tmp, 'enrollment.db')
+        enrolled(make_scraper(path, [1, 2, 3]), discoveries)
+        
+        # Unenrolled from course 2: nothing new on the dashboard, but the cache is out of date
+        assert enrolled(make_scraper(path, [1, 3]), discoveries) == ['ousl_1', 'ousl_3']
+        assert len(discoveries) == 2
+        assert enrolled(make_scraper(path, [1, 3]), discoveries) == ['ousl_1', 'ousl_3']
+        assert len(discoveries) == 2
+        
+        # Enrolled in course 4
+        assert enrolled(make_scraper(path, [1, 3, 4]), discoveries) == ['ousl_1', 'ousl_3', 'ousl_4']
+        assert len(discoveries) == 3
+
+
+if __name__ == '__main__':
+    print("♻️ Testing Enrolled-Course Cache\n")
+    print("=" * 60)
+    
+    test_unchanged_dashboard_uses_cache()
+    print("✅ The cached course list is reused while the dashboard shows the same courses")
+    test_dropped_course_triggers_rediscovery()
+    print("✅ A course dropped from or added to the dashboard triggers rediscovery")
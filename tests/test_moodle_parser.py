@@ -0,0 +1,111 @@
+"""
+Test script for the Moodle page parsers
+Runs moodle_parser on saved copies of stock Moodle pages (tests/fixtures), so
+no network or browser is needed.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import moodle_parser
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES, name), encoding='utf-8') as f:
+        return f.read()
+
+
+def test_forum_index_counts():
+    counts = moodle_parser.parse_forum_index(fixture('forum_index.html'))
+    assert counts == {
+        'announcements': (14, 2),
+        'studentdiscussionforum': (37, 0),
+        'miniprojectgroups': (6, 1),
+    }
+    
+    # Course-page forum links carry a hidden " Forum" label but still find their index row
+    forums = moodle_parser.parse_course_page(fixture('course_forums.html'),
+                                             'https://oulms.ou.ac.lk/course/view.php?id=2210', 'ousl_2210')
+    assert [moodle_parser.forum_index_counts(forum['title'], counts) for forum in forums] == [
+        (14, 2), (37, 0), (6, 1)
+    ]
+
+
+def test_forum_index_skips_ambiguous_names():
+    html = fixture('forum_index.html').replace('Mini project groups', 'Announcements')
+    counts = moodle_parser.parse_forum_index(html)
+    assert 'announcements' not in counts
+    assert moodle_parser.forum_index_counts('AnnouncementsForum', counts) is None
+
+
+def test_module_index_due_dates():
+    index_url = 'https://oulms.ou.ac.lk/mod/{}/index.php'
+    
+    # The assignment index links to absolute view.php URLs
+    assert moodle_parser.parse_module_index(fixture('assign_index.html'), 'assign', 'due',
+                                            index_url.format('assign')) == {
+        '90318': '2025-10-17T18:29:00+00:00',
+        '90402': '2025-11-24T03:30:00+00:00',
+        '90455': None,
+    }
+    
+    # The quiz index links to relative ones
+    assert moodle_parser.parse_module_index(fixture('quiz_index.html'), 'quiz', 'close',
+                                            index_url.format('quiz')) == {
+        '90377': '2025-10-19T18:25:00+00:00',
+        '90421': '2025-12-04T11:30:00+00:00',
+    }
+    
+    bundle = moodle_parser.parse_course_bundle({
+        'course_id': 'ousl_2210',
+        'course_url': 'https://oulms.ou.ac.lk/course/view.php?id=2210',
+        'course_html': fixture('course_forums.html'),
+        'index_html': {'assign': fixture('assign_index.html'), 'quiz': fixture('quiz_index.html')},
+    })
+    assert bundle['index_summary'] == {'assign': (2, 3), 'quiz': (2, 2)}
+
+
+def test_unreadable_index_date_keeps_page_deadline():
+    # The assignment index shows "-" for the mini project, which has only a text deadline
+    bundle = moodle_parser.parse_course_bundle({
+        'course_id': 'ousl_2210',
+        'course_url': 'https://oulms.ou.ac.lk/course/view.php?id=2210',
+        'course_html': fixture('course_assignments.html'),
+        'index_html': {'assign': fixture('assign_index.html')},
+    })
+    deadlines = {moodle_parser.extract_cmid(activity['url']): activity['deadline'] for activity in bundle['activities']}
+    assert deadlines == {
+        '90318': '2025-10-17T18:29:00+00:00',
+        '90455': 'Due: after the viva, date to be announced',
+    }
+
+
+
+def test_activity_ids_come_from_the_module_itself():
+    activities = moodle_parser.parse_course_page(fixture('course_linked_modules.html'),
+                                                 'https://oulms.ou.ac.lk/course/view.php?id=1488', 'ousl_1488')
+    # Links to other modules (an availability condition, a description) don't decide the ID
+    assert [(a['activity_id'], a['type'], a['url']) for a in activities] == [
+        ('ousl_cm_63645', 'quiz', 'https://oulms.ou.ac.lk/mod/quiz/view.php?id=63645'),
+        ('ousl_cm_63644', 'h5pactivity', 'https://oulms.ou.ac.lk/mod/h5pactivity/view.php?id=63644'),
+        ('ousl_cm_63671', 'journal', 'https://oulms.ou.ac.lk/mod/journal/view.php?id=63671'),
+    ]
+
+
+if __name__ == '__main__':
+    print("🧩 Testing Moodle Parsers\n")
+    print("=" * 60)
+    
+    test_forum_index_counts()
+    print("✅ Forum index counts are matched to course-page forums")
+    test_forum_index_skips_ambiguous_names()
+    print("✅ Forums sharing a name are always visited")
+    test_module_index_due_dates()
+    print("✅ Assignment and quiz index due dates are read")
+    test_unreadable_index_date_keeps_page_deadline()
+    print("✅ Index rows without a readable date keep the course page's deadline")
+    test_activity_ids_come_from_the_module_itself()
+    print("✅ Activity IDs come from the module's own ID, not other links in its item")
@@ -0,0 +1,130 @@
+"""
+Test script for shared scan runs
+Checks the job queue workers crawl from: expired leases are reclaimed by
+another worker, a failed job with attempts left keeps its run open and is
+claimed again, and only one caller gets to finish a run. Also checks that
+merging a scan shard's rows twice changes nothing the second time.
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from database import Database
+
+MAX_ATTEMPTS = 3
+LEASE_SECONDS = 300
+
+
+def run_db(tmp: str, course_nums=(1, 2)) -> Database:
+    db = Database(os.path.join(tmp, 'runs.db'))
+    db.create_scan_run('run-1', [{'course_id': f'ousl_{n}', 'lms_name': 'OUSL', 'name': f'Course {n}',
+                                  'url': f'https://oulms.ou.ac.lk/course/view.php?id={n}'}
+                                 for n in course_nums],
+                       feed_checkpoints={'OUSL': 1700000000})
+    return db
+
+
+def test_expired_lease_is_reclaimed():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = run_db(tmp, course_nums=(1,))
+        # worker-a dies holding the job: its lease runs out
+        job = db.claim_scan_job('run-1', 'worker-a', -1, MAX_ATTEMPTS)
+        assert job['course_id'] == 'ousl_1' and job['attempts'] == 1
+        
+        reclaimed = db.claim_scan_job('run-1', 'worker-b', LEASE_SECONDS, MAX_ATTEMPTS)
+        assert reclaimed['job_id'] == job['job_id'] and reclaimed['attempts'] == 2
+        assert db.claim_scan_job('run-1', 'worker-c', LEASE_SECONDS, MAX_ATTEMPTS) is None
+        
+        # worker-a coming back can neither keep nor settle the job any more
+        assert not db.renew_scan_job_lease(job['job_id'], 'worker-a', LEASE_SECONDS)
+        db.complete_scan_job(job['job_id'], 'worker-a', 'failed', error_message='stale')
+        assert db.finish_scan_run('run-1', MAX_ATTEMPTS) is None
+        
+        assert db.renew_scan_job_lease(job['job_id'], 'worker-b', LEASE_SECONDS)
+        db.complete_scan_job(job['job_id'], 'worker-b', 'done', activities_found=4, new_activities=1)
+        assert db.finish_scan_run('run-1', MAX_ATTEMPTS) == [
+            {'lms_name': 'OUSL', 'courses': 1, 'activities': 4, 'new_activities': 1, 'failed': 0}
+        ]
+
+
+def test_run_is_finished_once():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = run_db(tmp)
+        # A run with jobs still pending or leased can't be finished
+        assert db.finish_scan_run('run-1', MAX_ATTEMPTS) is None
+        first = db.claim_scan_job('run-1', 'worker-a', LEASE_SECONDS, MAX_ATTEMPTS)
+        second = db.claim_scan_job('run-1', 'worker-b', LEASE_SECONDS, MAX_ATTEMPTS)
+        db.complete_scan_job(first['job_id'], 'worker-a', 'done', activities_found=2)
+        assert db.finish_scan_run('run-1', MAX_ATTEMPTS) is None
+        
+        db.complete_scan_job(second['job_id'], 'worker-b', 'done', activities_found=3)
+        # Both workers see the queue drained; only one of them sends the notifications
+        results = [db.finish_scan_run('run-1', MAX_ATTEMPTS), db.finish_scan_run('run-1', MAX_ATTEMPTS)]
+        assert results[1] is None
+        assert results[0] == [{'lms_name': 'OUSL', 'courses': 2, 'activities': 5, 'new_activities': 0, 'failed': 0}]
+        assert db.get_open_scan_run() is None
+
+
+def test_failed_last_job_keeps_run_open():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = run_db(tmp)
+        first = db.claim_scan_job('run-1', 'worker-a', LEASE_SECONDS, MAX_ATTEMPTS)
+        db.complete_scan_job(first['job_id'], 'worker-a', 'done')
+        
+        # The last job fails with attempts left: the run stays open and the job comes back
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            job = db.claim_scan_job('run-1', 'worker-a', LEASE_SECONDS, MAX_ATTEMPTS)
+            assert job['course_id'] == 'ousl_2' and job['attempts'] == attempt
+            db.complete_scan_job(job['job_id'], 'worker-a', 'failed', error_message='timeout')
+            if attempt < MAX_ATTEMPTS:
+                assert db.finish_scan_run('run-1', MAX_ATTEMPTS) is None
+                assert db.get_open_scan_run() == 'run-1'
+        
+        # Out of attempts: nothing left to claim and the run closes with the failure counted
+        assert db.claim_scan_job('run-1', 'worker-a', LEASE_SECONDS, MAX_ATTEMPTS) is None
+        assert db.finish_scan_run('run-1', MAX_ATTEMPTS) == [
+            {'lms_name': 'OUSL', 'courses': 2, 'activities': 0, 'new_activities': 0, 'failed': 1}
+        ]
+
+
+def test_shard_merge_is_idempotent():
+    with tempfile.TemporaryDirectory() as tmp:
+        shard_db = Database(os.path.join(tmp, 'shard.db'))
+        shard_db.add_course('ousl_1', 'OUSL', 'EEX3467 Software Engineering', 'https://oulms.ou.ac.lk/course/view.php?id=1')
+        shard_db.add_activity('ousl_cm_101', 'ousl_1', 'assign', 'TMA 1', deadline='2026-11-02T18:29:00+00:00')
+        rows = shard_db.export_course_rows(['ousl_1'])
+        
+        db = Database(os.path.join(tmp, 'merged.db'))
+        # The merged database already has the activity from an earlier scan, under another title
+        db.add_course('ousl_1', 'OUSL', 'EEX3467 Software Engineering', 'https://oulms.ou.ac.lk/course/view.php?id=1')
+        db.add_activity('ousl_cm_101', 'ousl_1', 'assign', 'Assignment 1')
+        
+        assert db.merge_shard_rows('run-1', 0, rows)
+        merged = db.get_activities_by_course('ousl_1')
+        assert [(a['activity_id'], a['title']) for a in merged] == [('ousl_cm_101', 'TMA 1')]
+        
+        # Merging the same shard again (a re-run merge job) is refused and leaves the rows alone
+        db.mark_activities_as_notified(['ousl_cm_101'])
+        assert not db.merge_shard_rows('run-1', 0, rows)
+        assert db.get_activities_by_course('ousl_1') == [dict(merged[0], is_new=0)]
+        
+        # Another shard of the run, or the same shard of the next run, still merges
+        assert db.merge_shard_rows('run-1', 1, {})
+        assert db.merge_shard_rows('run-2', 0, rows)
+        assert db.get_activities_by_course('ousl_1') == merged
+
+
+if __name__ == '__main__':
+    print("🧵 Testing Shared Scan Runs\n")
+    print("=" * 60)
+    
+    test_expired_lease_is_reclaimed()
+    print("✅ An expired lease is reclaimed and the old worker can't settle the job")
+    test_run_is_finished_once()
+    print("✅ Only one caller finishes a run, and only once every job is settled")
+    test_failed_last_job_keeps_run_open()
+    print("✅ A failed job with attempts left keeps the run open and is claimed again")
+    test_shard_merge_is_idempotent()
+    print("✅ Merging the same shard of a run twice changes nothing")